@@ -0,0 +1,103 @@
+"""
+Compares the dict based aggregate_transfers against the vectorized aggregate_transfer_columns.
+
+The rows are generated and aggregated in chunks so the 10M row run doesn't need every transfer dict in
+memory at once. Only the aggregation is timed, building the inputs is not. The columns get the distributor
+as one value the way TransferBatch.columns passes it, batches under VECTORIZE_MIN_ROWS take the one pass path.
+
+Run from the server directory:
+    python -m benchmarks.bench_aggregate --rows 10000 1000000 10000000
+"""
+import argparse
+import math
+import random
+import time
+from utils.utils import aggregate_transfers, aggregate_transfer_columns
+from .fixtures import random_address
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+TOKENS = ["sol", "USDC", "BONK", "JUP"]
+
+
+def make_columns(rng, count, wallet_pool):
+    """ Random transfer columns (wallets, distributors, tokens, amounts) """
+    wallets = [rng.choice(wallet_pool) for _ in range(count)]
+    distributors = [DISTRIBUTOR] * count
+    tokens = [rng.choice(TOKENS) for _ in range(count)]
+    amounts = [rng.random() * 100 for _ in range(count)]
+    return wallets, distributors, tokens, amounts
+
+
+def to_dicts(wallets, distributors, tokens, amounts):
+    """ The per transfer dicts that aggregate_transfers takes """
+    return [
+        {"wallet_address": w, "distributor": d, "token": t, "amount": a}
+        for w, d, t, a in zip(wallets, distributors, tokens, amounts)
+    ]
+
+
+def check_same(expected, actual):
+    """ Makes sure both functions produced the same wallets, tokens and totals """
+    assert expected.keys() == actual.keys(), "wallets differ"
+    for wallet, data in expected.items():
+        for distributor, dist_data in data["distributors"].items():
+            other = actual[wallet]["distributors"][distributor]["tokens"]
+            assert dist_data["tokens"].keys() == other.keys(), f"tokens differ for {wallet}"
+            for token, total in dist_data["tokens"].items():
+                assert math.isclose(total["total_amount"], other[token]["total_amount"], rel_tol=1e-9)
+
+
+def run(rows, chunk_size, wallet_count, seed):
+    """ Aggregates the rows chunk by chunk with both functions and prints the totals """
+    rng = random.Random(seed)
+    wallet_pool = [random_address(rng) for _ in range(wallet_count)]
+
+    dict_time = 0.0
+    column_time = 0.0
+    groups = 0
+
+    for start in range(0, rows, chunk_size):
+        columns = make_columns(rng, min(chunk_size, rows - start), wallet_pool)
+        transfers = to_dicts(*columns)
+
+        t = time.perf_counter()
+        expected = aggregate_transfers(transfers)
+        dict_time += time.perf_counter() - t
+        del transfers
+
+        t = time.perf_counter()
+        actual = aggregate_transfer_columns(columns[0], DISTRIBUTOR, columns[2], columns[3])
+        column_time += time.perf_counter() - t
+
+        # Only compare the first chunk, the check is slower than the aggregation
+        if start == 0:
+            check_same(expected, actual)
+
+        groups += sum(len(d["tokens"]) for w in actual.values() for d in w["distributors"].values())
+
+    print(
+        f"{rows:>10} rows  dict {dict_time:8.3f}s ({rows / dict_time:>12,.0f} rows/s)  "
+        f"columns {column_time:8.3f}s ({rows / column_time:>12,.0f} rows/s)  "
+        f"speedup {dict_time / column_time:5.2f}x  groups {groups}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Warm up both functions so the first run doesn't pay for numpy's first call overhead
+    warmup = make_columns(random.Random(0), 1000, [random_address(random.Random(0))])
+    aggregate_transfers(to_dicts(*warmup))
+    aggregate_transfer_columns(warmup[0], DISTRIBUTOR, warmup[2], warmup[3])
+
+    for rows in args.rows:
+        run(rows, args.chunk_size, args.wallets, args.seed)
+
+
+if __name__ == "__main__":
+    main()
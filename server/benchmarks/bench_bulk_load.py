@@ -0,0 +1,77 @@
+"""
+Measures the init write path (temp transaction inserts -> process_txs -> index build) with the default
+per batch commits against the bulk load mode. Runs against a scratch distributor db in a temp directory.
+
+Run from the server directory:
+    python -m benchmarks.bench_bulk_load --txs 50000
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from db.SQLiteDB import SQLiteDB
+from utils.utils import process_distributor_transactions
+from .bench_process_pool import DISTRIBUTOR, make_initializer
+from .fixtures import make_helius_transactions, FixedTokenRegistry
+
+
+def run(name, transactions, token_registry, bulk_load):
+    """ Runs the whole write path in a fresh directory and prints the timings """
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("backup/transfers")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db = SQLiteDB()
+        sqlite_db.create_distributor_tables(DISTRIBUTOR)
+        sqlite_db.create_checkpoint_table(DISTRIBUTOR)
+        if bulk_load:
+            sqlite_db.begin_bulk_load(DISTRIBUTOR)
+
+        # The fetch stage writes 1000 transactions per page with its checkpoint
+        start = time.perf_counter()
+        for i in range(0, len(transactions), 1000):
+            batch = transactions[i : i + 1000]
+            sqlite_db.insert_transactions_batch(DISTRIBUTOR, batch, page_cursor=batch[-1]["signature"])
+            sqlite_db.update_temp_txs_last_sig(DISTRIBUTOR, batch[-1]["signature"])
+        sqlite_db.save_init_checkpoint(DISTRIBUTOR, "fetch_txs", completed=True)
+        fetch_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        initializer = make_initializer(sqlite_db, token_registry, 1)
+        success = initializer.process_initial_txs(sqlite_db.get_init_checkpoint(DISTRIBUTOR, "process_txs"))
+        sqlite_db.save_init_checkpoint(DISTRIBUTOR, "process_txs", completed=True)
+        process_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        success = sqlite_db.clean_and_remove_temp_data(DISTRIBUTOR) and success
+        index_time = time.perf_counter() - start
+
+    total = fetch_time + process_time + index_time
+    print(
+        f"{name:<8} temp inserts {fetch_time:6.2f}s  process_txs {process_time:6.2f}s  indexes {index_time:6.2f}s  "
+        f"total {total:6.2f}s ({len(transactions) / total:>8,.0f} tx/s)  "
+        f"transfers {sqlite_db.get_transfers_count(DISTRIBUTOR)}  ok {success}"
+    )
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=50000)
+    args = parser.parse_args()
+
+    helius_transactions = make_helius_transactions(args.txs, DISTRIBUTOR)
+    token_registry = FixedTokenRegistry(helius_transactions)
+    transactions = process_distributor_transactions(helius_transactions)
+    del helius_transactions
+
+    print(f"{args.txs} transactions")
+    default_time = run("default", transactions, token_registry, bulk_load=False)
+    bulk_time = run("bulk", transactions, token_registry, bulk_load=True)
+    print(f"speedup {default_time / bulk_time:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
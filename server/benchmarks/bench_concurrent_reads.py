@@ -0,0 +1,162 @@
+"""
+Reads during ingest. Writer threads insert small transfer batches into a distributor db while reader threads
+query it, once the old way with a rollback journal and a connection per thread writing directly, and once
+through SQLiteDB with WAL and the single writer thread. Reports write and read throughput and the number
+of "database is locked" errors.
+
+Run from the server directory:
+    python -m benchmarks.bench_concurrent_reads --writers 8 --readers 4 --seconds 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from db.SQLiteDB import SQLiteDB
+from db.schemas import transfers as transfers_table, transfers_unique_index
+from utils.transfer_batch import TransferBatch
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+INSERT = """INSERT OR IGNORE INTO transfers
+            (signature, slot, timestamp, amount, token, wallet_address, distributor)
+            VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+READ = "SELECT COUNT(*), SUM(amount) FROM transfers WHERE wallet_address = ?"
+
+# The same read on the wallets/tokens/txs layout of the distributor dbs
+DISTRIBUTOR_READ = """SELECT COUNT(*), SUM(t.amount)
+                      FROM wallets w JOIN transfers t ON t.wallet_id = w.id
+                      WHERE w.address = ?"""
+
+
+def make_batch(writer, number, size):
+    """ A poll sized TransferBatch with unique signatures """
+    batch = TransferBatch(DISTRIBUTOR)
+    tx = batch.add_transaction(f"sig-{writer}-{number}", number, number)
+    for i in range(size):
+        batch.add_transfer(tx, f"wallet{i % 500:040d}", "sol", 1.0)
+    return batch
+
+
+def run(name, write, read, args):
+    """ Runs the writer and reader threads for args.seconds and prints the counts """
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def writer(number):
+        batch_number = 0
+        while not stop.is_set():
+            try:
+                write(make_batch(number, batch_number, args.batch_size))
+                count("writes")
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                count("locked")
+            batch_number += 1
+
+    def reader():
+        while not stop.is_set():
+            try:
+                read()
+                count("reads")
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                count("locked")
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(
+        f"{name:<8} writes {counts['writes'] / args.seconds:>8,.0f}/s  reads {counts['reads'] / args.seconds:>8,.0f}/s  "
+        f"locked errors {counts['locked']}"
+    )
+
+
+def run_direct(args):
+    """ The previous setup, rollback journal and every thread writing with its own connection """
+    path = os.path.join(tempfile.mkdtemp(), "direct.db")
+    connection = sqlite3.connect(path)
+    connection.execute(transfers_table)
+    connection.execute(transfers_unique_index)
+    connection.commit()
+    connection.close()
+
+    local = threading.local()
+
+    def get_connection():
+        if not hasattr(local, "connection"):
+            local.connection = sqlite3.connect(path, timeout=1)
+        return local.connection
+
+    def write(batch):
+        connection = get_connection()
+        try:
+            connection.executemany(INSERT, batch.rows())
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    def read():
+        get_connection().execute(READ, (f"wallet{1:040d}",)).fetchall()
+
+    run("direct", write, read, args)
+
+
+def run_writer(args):
+    """ SQLiteDB with WAL, the writer thread and read only connections """
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("backup/transfers")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db = SQLiteDB()
+        sqlite_db.create_distributor_tables(DISTRIBUTOR)
+        sqlite_db.create_distributor_indexes(DISTRIBUTOR)
+
+    def write(batch):
+        if sqlite_db.insert_transfer_batch(DISTRIBUTOR, batch) is False:
+            raise sqlite3.OperationalError("insert failed")
+
+    def read():
+        connection, cursor = sqlite_db.get_distributors_db(DISTRIBUTOR)
+        cursor.execute(DISTRIBUTOR_READ, (f"wallet{1:040d}",))
+        cursor.fetchall()
+
+    run("writer", write, read, args)
+
+    stats = sqlite_db.get_connection_stats()
+    print(f"         {stats['writes']} writes committed in {stats['transactions']} transactions")
+    sqlite_db.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    run_direct(args)
+    run_writer(args)
+
+
+if __name__ == "__main__":
+    main()
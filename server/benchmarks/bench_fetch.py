@@ -0,0 +1,50 @@
+"""
+Measures the Helius fetch path against the local stand-in.
+
+Start the stand-in first, then run from the server directory:
+    python -m benchmarks.helius_standin --txs 20000 --latency 0.05 &
+    HELIUS_API_URL=http://127.0.0.1:8899 HELIUS_RPC_URL=http://127.0.0.1:8899/ python -m benchmarks.bench_fetch
+"""
+import argparse
+import time
+from utils.helius import get_historical_transactions_for_distributor, get_token_metadata_batch
+from utils.helius_client import get_helius_client
+from utils.rate_governor import get_rate_governor
+from .helius_standin import DEFAULT_DISTRIBUTOR
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distributor", default=DEFAULT_DISTRIBUTOR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tx_count = 0
+    errors = 0
+    mints = set()
+
+    for txs_batch in get_historical_transactions_for_distributor(args.distributor, None):
+        if txs_batch == 404:
+            errors += 1
+            continue
+
+        tx_count += len(txs_batch["txs"])
+        mints.update(tf[2] for tx in txs_batch["txs"] for tf in tx["token_transfers"])
+
+        if txs_batch.get("finished"):
+            break
+
+    fetch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tokens = get_token_metadata_batch(mints)
+    metadata_time = time.perf_counter() - start
+
+    print(f"Fetched {tx_count} transactions in {fetch_time:.2f}s ({tx_count / fetch_time:.1f} tx/s), {errors} failed pages")
+    print(f"Resolved {len(tokens)}/{len(mints)} mints in {metadata_time:.3f}s")
+    print(f"Client: {get_helius_client().get_stats()}")
+    print(f"Governor: {get_rate_governor().get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
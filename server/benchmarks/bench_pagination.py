@@ -0,0 +1,95 @@
+"""
+Full scan time of a transfers table paged with LIMIT/OFFSET against keyset paging (WHERE id > ?) at
+different table sizes.
+
+Run from the server directory:
+    python -m benchmarks.bench_pagination --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from db.schemas import transfers as transfers_table
+
+OFFSET_QUERY = """SELECT signature, slot, timestamp, amount, token, wallet_address, distributor
+                  FROM transfers
+                  ORDER BY id ASC
+                  LIMIT ? OFFSET ?"""
+
+KEYSET_QUERY = """SELECT id, signature, slot, timestamp, amount, token, wallet_address, distributor
+                  FROM transfers
+                  WHERE id > ?
+                  ORDER BY id ASC
+                  LIMIT ?"""
+
+
+def fill(cursor, rows, seed=1):
+    """ Inserts random transfer rows """
+    rng = random.Random(seed)
+    cursor.executemany(
+        """INSERT INTO transfers (signature, slot, timestamp, amount, token, wallet_address, distributor)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (f"sig{i:088d}", i, i, rng.random(), "sol", f"wallet{rng.randint(0, 20000):038d}", "dist")
+            for i in range(rows)
+        ),
+    )
+
+
+def scan_offset(cursor, batch_size):
+    """ The previous paging, every batch skips all of the rows before it """
+    offset = 0
+    while True:
+        cursor.execute(OFFSET_QUERY, (batch_size, offset))
+        results = cursor.fetchall()
+        if not results:
+            return
+        offset += batch_size
+
+
+def scan_keyset(cursor, batch_size):
+    """ Keyset paging, every batch is a seek on the primary key """
+    last_id = 0
+    while True:
+        cursor.execute(KEYSET_QUERY, (last_id, batch_size))
+        results = cursor.fetchall()
+        if not results:
+            return
+        last_id = results[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        connection = sqlite3.connect(path)
+        cursor = connection.cursor()
+        cursor.execute(transfers_table)
+        fill(cursor, rows)
+        connection.commit()
+
+        start = time.perf_counter()
+        scan_offset(cursor, args.batch_size)
+        offset_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scan_keyset(cursor, args.batch_size)
+        keyset_time = time.perf_counter() - start
+
+        print(
+            f"{rows:>10} rows  offset {offset_time:8.2f}s  keyset {keyset_time:8.2f}s  "
+            f"speedup {offset_time / keyset_time:7.1f}x"
+        )
+
+        connection.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+On disk size, insert rate and scan rate of the temp transactions table with the transfer payloads stored as
+the old JSON text against the binary encodings and compressions in db.payload_codec. Goes through
+SQLiteDB.insert_transactions_batch and get_transactions, the scan decodes both payloads of every row like
+the process_txs stage does.
+
+Run from the server directory:
+    python -m benchmarks.bench_payloads --txs 50000
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from db.SQLiteDB import SQLiteDB
+from db.payload_codec import msgpack, zstandard
+from utils.utils import process_distributor_transactions
+from .fixtures import make_helius_transactions
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+
+def get_size(path):
+    """ Size of the db with its WAL """
+    return sum(os.path.getsize(file) for file in (path, f"{path}-wal") if os.path.exists(file))
+
+
+def run(encoding, compression, transactions):
+    """ Inserts the transactions in 1000 row batches, scans them back and prints the numbers """
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("backup/transfers")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db = SQLiteDB()
+        sqlite_db.create_distributor_tables(DISTRIBUTOR)
+    sqlite_db.payload_encoding, sqlite_db.payload_compression = encoding, compression
+
+    start = time.perf_counter()
+    for i in range(0, len(transactions), 1000):
+        sqlite_db.insert_transactions_batch(DISTRIBUTOR, transactions[i : i + 1000])
+    insert_time = time.perf_counter() - start
+
+    size = get_size(sqlite_db.get_distributor_db_path(DISTRIBUTOR))
+
+    start = time.perf_counter()
+    transfers = 0
+    for batch, last_id in sqlite_db.get_transactions(DISTRIBUTOR):
+        for tx in batch:
+            transfers += len(tx["native_transfers"]) + len(tx["token_transfers"])
+    scan_time = time.perf_counter() - start
+
+    count = len(transactions)
+    print(
+        f"{encoding + '+' + compression:<16} {size / 1024 / 1024:8.1f} MB  {size / count:7.0f} B/tx  "
+        f"insert {count / insert_time:>9,.0f} tx/s  scan {count / scan_time:>9,.0f} tx/s  transfers {transfers}"
+    )
+    sqlite_db.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=50000)
+    parser.add_argument("--wallets", type=int, default=500)
+    args = parser.parse_args()
+
+    transactions = process_distributor_transactions(
+        make_helius_transactions(args.txs, DISTRIBUTOR, wallets=args.wallets)
+    )
+
+    formats = [("json", "none"), ("struct", "none"), ("struct", "zlib")]
+    if zstandard:
+        formats.append(("struct", "zstd"))
+    if msgpack:
+        formats += [("msgpack", "none"), ("msgpack", "zlib")]
+
+    print(f"{args.txs} transactions, {args.wallets} wallets")
+    for encoding, compression in formats:
+        run(encoding, compression, transactions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures process_txs throughput with the serial process_initial_txs and the process pool version at
+different worker counts. Runs against a scratch distributor db in a temp directory. The pool only beats
+the in-process path with more than one cpu (0.94x-1.05x on a single cpu at 5k and 25k row chunks), which is
+why INIT_PROCESS_WORKERS defaults to 1 and the initializer never runs more workers than cpus.
+
+Run from the server directory:
+    python -m benchmarks.bench_process_pool --txs 50000 --workers 1 2 4 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from db.SQLiteDB import SQLiteDB
+from lib.ProjectInitializer import ProjectInitializer
+from utils.utils import process_distributor_transactions
+from .fixtures import make_helius_transactions, FixedTokenRegistry
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+
+def make_initializer(sqlite_db, token_registry, workers):
+    """ ProjectInitializer with just what the process_txs stage needs, no MongoDB """
+    initializer = ProjectInitializer.__new__(ProjectInitializer)
+    initializer.distributor = DISTRIBUTOR
+    initializer.sqlite_db = sqlite_db
+    initializer.token_registry = token_registry
+    initializer.process_workers = workers
+    return initializer
+
+
+def reset(sqlite_db):
+    """ Clears the transfers and the process_txs checkpoint between runs """
+    def clear(cursor):
+        cursor.execute("DELETE FROM transfers")
+        cursor.execute("DELETE FROM init_checkpoints")
+
+    sqlite_db.write_distributor(DISTRIBUTOR, clear)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=50000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("backup/transfers")
+
+    sqlite_db = SQLiteDB()
+    sqlite_db.create_distributor_tables(DISTRIBUTOR)
+    sqlite_db.create_checkpoint_table(DISTRIBUTOR)
+
+    # Fill the temp transactions the way the fetch stage does
+    transactions = make_helius_transactions(args.txs, DISTRIBUTOR)
+    token_registry = FixedTokenRegistry(transactions)
+    for i in range(0, len(transactions), 1000):
+        sqlite_db.insert_transactions_batch(DISTRIBUTOR, process_distributor_transactions(transactions[i : i + 1000]))
+    del transactions
+
+    print(f"{args.txs} temp transactions, {os.cpu_count()} cpus")
+
+    baseline = None
+    for workers in args.workers:
+        reset(sqlite_db)
+        initializer = make_initializer(sqlite_db, token_registry, workers)
+        checkpoint = sqlite_db.get_init_checkpoint(DISTRIBUTOR, "process_txs")
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if workers > 1:
+                success = initializer.process_initial_txs_parallel(checkpoint)
+            else:
+                success = initializer.process_initial_txs(checkpoint)
+        elapsed = time.perf_counter() - start
+
+        rate = args.txs / elapsed
+        baseline = baseline or rate
+        print(
+            f"workers {workers:>2}  {elapsed:7.2f}s  {rate:>9,.0f} tx/s  speedup {rate / baseline:5.2f}x  "
+            f"transfers {sqlite_db.get_transfers_count(DISTRIBUTOR)}  ok {success}"
+        )
+
+
+if __name__ == "__main__":
+    main()
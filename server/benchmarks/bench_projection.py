@@ -0,0 +1,93 @@
+"""
+Compares keeping the full Helius transfer arrays against projecting them down to the fields we use.
+
+Run from the server directory:
+    python -m benchmarks.bench_projection --txs 10000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from utils.utils import process_distributor_transactions
+from .fixtures import make_helius_transactions
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+PAGE_SIZE = 100
+
+
+def process_full(transactions):
+    """ The previous behaviour that kept the full tokenTransfers and nativeTransfers objects """
+    return [
+        {
+            "fee_payer": tx.get("feePayer"),
+            "signature": tx.get("signature"),
+            "slot": tx.get("slot"),
+            "timestamp": tx.get("timestamp"),
+            "token_transfers": tx.get("tokenTransfers", []),
+            "native_transfers": tx.get("nativeTransfers", []),
+        }
+        for tx in transactions
+    ]
+
+
+def decode(process, pages):
+    """ Decodes every page and keeps the processed transactions """
+    kept = []
+    for page in pages:
+        kept.extend(process(json.loads(page)))
+    return kept
+
+
+def run(name, process, pages, dump_kwargs):
+    """ Decodes every page, stores the temp rows as JSON and reads them back """
+    start = time.perf_counter()
+    kept = decode(process, pages)
+    decode_time = time.perf_counter() - start
+
+    # Separate pass for memory since tracemalloc slows down allocation heavy code
+    del kept
+    tracemalloc.start()
+    kept = decode(process, pages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    rows = [
+        (json.dumps(tx["token_transfers"], **dump_kwargs), json.dumps(tx["native_transfers"], **dump_kwargs))
+        for tx in kept
+    ]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for token_transfers, native_transfers in rows:
+        json.loads(token_transfers)
+        json.loads(native_transfers)
+    read_time = time.perf_counter() - start
+
+    stored = sum(len(a) + len(b) for a, b in rows)
+    print(
+        f"{name:<10} decode {decode_time:7.3f}s  encode {encode_time:7.3f}s  read {read_time:7.3f}s  "
+        f"stored {stored / 1e6:8.2f} MB  peak {peak / 1e6:8.2f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=10000)
+    args = parser.parse_args()
+
+    transactions = make_helius_transactions(args.txs, DISTRIBUTOR)
+
+    # Raw JSON pages the way they come off the wire
+    pages = [
+        json.dumps(transactions[i : i + PAGE_SIZE]) for i in range(0, len(transactions), PAGE_SIZE)
+    ]
+    del transactions
+
+    print(f"{args.txs} transactions in {len(pages)} pages ({sum(map(len, pages)) / 1e6:.2f} MB raw)")
+    run("full", process_full, pages, {})
+    run("projected", process_distributor_transactions, pages, {"separators": (",", ":")})
+
+
+if __name__ == "__main__":
+    main()
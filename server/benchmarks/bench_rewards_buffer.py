@@ -0,0 +1,141 @@
+"""
+MongoDB wallet reward writes of a poll cycle with every batch written straight away against the RewardsBuffer
+flushing once per cycle, and the buffered run again with every batch added twice like a retried poll. The
+distributors share one wallet pool so the same hot wallets are paid by every project. MongoDB is modelled by a
+sink that keeps the reward batch ledger, merges the new batches like apply_wallet_rewards and sleeps --rtt-ms
+per bulk_write of up to 5000 ops plus --op-us per op.
+
+Run from the server directory:
+    python -m benchmarks.bench_rewards_buffer --distributors 20 --txs 250 --cycles 3
+"""
+import argparse
+import random
+import time
+from db.RewardsBuffer import RewardsBuffer, merge_wallet_rewards
+from utils.utils import (
+    process_distributor_transactions,
+    process_distributor_transfers,
+    aggregate_transfer_columns,
+    get_batch_id,
+)
+from .fixtures import make_helius_transactions, random_address, FixedTokenRegistry
+
+
+class MongoSink:
+    """ Counts the $inc updates and bulk writes apply_wallet_rewards would send and keeps the totals """
+
+    def __init__(self, rtt, op_time, batch_size=5000):
+        self.rtt = rtt
+        self.op_time = op_time
+        self.batch_size = batch_size
+        self.ops = 0
+        self.bulk_writes = 0
+        self.ledger = set()
+        self.totals = {}
+
+    def write(self, batches):
+        # Batches in the ledger are skipped, the rest are merged into one upsert per wallet
+        wallets = {}
+        for batch_id, batch in batches.items():
+            if batch_id not in self.ledger:
+                self.ledger.add(batch_id)
+                merge_wallet_rewards(wallets, batch["wallets"])
+
+        for i in range(0, len(wallets), self.batch_size):
+            ops = min(self.batch_size, len(wallets) - i)
+            self.ops += ops
+            self.bulk_writes += 1
+            time.sleep(self.rtt + ops * self.op_time)
+
+        merge_wallet_rewards(self.totals, wallets)
+        return len(wallets)
+
+
+def make_cycles(args):
+    """ The aggregated reward batches of every distributor for each poll cycle """
+    rng = random.Random(7)
+    distributors = [random_address(rng) for _ in range(args.distributors)]
+    wallet_pool = [random_address(rng) for _ in range(args.wallets)]
+
+    cycles = []
+    for cycle in range(args.cycles):
+        batches = []
+        for number, distributor in enumerate(distributors):
+            # Every distributor pays from the same wallet pool
+            transactions = make_helius_transactions(
+                args.txs, distributor, seed=1 + cycle * 1000 + number, wallet_pool=wallet_pool
+            )
+            token_registry = FixedTokenRegistry(transactions)
+            transactions = process_distributor_transactions(transactions)
+
+            for i in range(0, len(transactions), args.batch_size):
+                batch = process_distributor_transfers(token_registry, transactions[i : i + args.batch_size], distributor)
+                batch_id = get_batch_id(distributor, batch.signatures)
+                batches.append((batch_id, aggregate_transfer_columns(*batch.columns())))
+        cycles.append(batches)
+
+    return cycles
+
+
+def run(name, cycles, sink, flush_interval, replays=1):
+    """ Feeds every cycle to a RewardsBuffer and flushes at the end of the cycle like the timer would """
+    rewards_buffer = RewardsBuffer(sink.write, max_pending=100000, flush_interval=flush_interval)
+
+    start = time.perf_counter()
+    for batches in cycles:
+        for _ in range(replays):
+            for batch_id, wallets in batches:
+                rewards_buffer.add(batch_id, wallets)
+            rewards_buffer.flush()
+    rewards_buffer.close()
+    elapsed = time.perf_counter() - start
+
+    stats = rewards_buffer.get_stats()
+    print(
+        f"{name:<10} updates {stats['added']:>8}  mongo ops {sink.ops:>8}  bulk writes {sink.bulk_writes:>5}  "
+        f"coalescing {stats['coalescing_ratio']:5.1f}x  avg flush {stats['avg_flush_ms']:7.1f}ms  "
+        f"max flush {stats['max_flush_ms']:7.1f}ms  total {elapsed:6.2f}s"
+    )
+    return sink.totals
+
+
+def same_totals(a, b):
+    """ The totals are summed in a different order so they are compared with a tolerance """
+    flatten = lambda wallets: {
+        (wallet, distributor, token): total["total_amount"]
+        for wallet, wallet_data in wallets.items()
+        for distributor, distributor_data in wallet_data["distributors"].items()
+        for token, total in distributor_data["tokens"].items()
+    }
+    a, b = flatten(a), flatten(b)
+    return a.keys() == b.keys() and all(abs(a[key] - b[key]) <= 1e-9 * max(1.0, abs(a[key])) for key in a)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distributors", type=int, default=20)
+    parser.add_argument("--txs", type=int, default=250)
+    parser.add_argument("--wallets", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--rtt-ms", type=float, default=20)
+    parser.add_argument("--op-us", type=float, default=50)
+    args = parser.parse_args()
+
+    cycles = make_cycles(args)
+    print(
+        f"{args.cycles} cycles of {args.distributors} distributors x {args.txs} txs in batches of {args.batch_size}, "
+        f"{args.wallets} wallets"
+    )
+
+    # A flush interval of 0 writes every batch as it is added, the way aggregate_rewards used to
+    unbuffered = run("unbuffered", cycles, MongoSink(args.rtt_ms / 1000, args.op_us / 1e6), 0)
+    buffered = run("buffered", cycles, MongoSink(args.rtt_ms / 1000, args.op_us / 1e6), 3600)
+
+    # Every cycle is added and flushed twice, the second time every batch is already in the ledger
+    replayed = run("replayed", cycles, MongoSink(args.rtt_ms / 1000, args.op_us / 1e6), 3600, replays=2)
+    print(f"totals match: {same_totals(unbuffered, buffered) and same_totals(unbuffered, replayed)}")
+
+
+if __name__ == "__main__":
+    main()
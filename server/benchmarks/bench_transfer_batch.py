@@ -0,0 +1,145 @@
+"""
+Compares the old list of transfer dicts against TransferBatch through extract -> SQLite insert -> aggregate.
+Memory is the size of the extracted batch while it is held, time is the whole path.
+
+Run from the server directory:
+    python -m benchmarks.bench_transfer_batch --txs 50000
+"""
+import argparse
+import gc
+import sqlite3
+import time
+import tracemalloc
+from db.schemas import transfers as transfers_table
+from utils.utils import (
+    process_distributor_transactions,
+    process_distributor_transfers,
+    aggregate_transfers,
+    aggregate_transfer_columns,
+)
+from .fixtures import make_helius_transactions, FixedTokenRegistry
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+INSERT = """INSERT INTO transfers
+            (signature, slot, timestamp, amount, token, wallet_address, distributor)
+            VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def extract_dicts(token_registry, transactions, distributor):
+    """ The previous behaviour that built a 7 key dict for every transfer """
+    known_tokens = token_registry.known_tokens_dict
+    total_transfers = []
+    for tx in transactions:
+        for to_user_account, amount in tx["native_transfers"]:
+            total_transfers.append({
+                "signature": tx["signature"],
+                "slot": tx["slot"],
+                "timestamp": tx["timestamp"],
+                "amount": amount / 1e9,
+                "token": "sol",
+                "wallet_address": to_user_account,
+                "distributor": distributor,
+            })
+        for to_user_account, amount, mint in tx["token_transfers"]:
+            total_transfers.append({
+                "signature": tx["signature"],
+                "slot": tx["slot"],
+                "timestamp": tx["timestamp"],
+                "amount": amount,
+                "token": known_tokens[mint.lower()],
+                "wallet_address": to_user_account,
+                "distributor": distributor,
+            })
+    return total_transfers
+
+
+def insert_dicts(cursor, transfers):
+    """ The previous insert that turned each dict back into a tuple """
+    cursor.executemany(INSERT, [
+        (
+            transfer.get("signature", ""),
+            transfer.get("slot", 0),
+            transfer.get("timestamp", 0),
+            transfer.get("amount", 0.0),
+            transfer.get("token", ""),
+            transfer.get("wallet_address", ""),
+            transfer.get("distributor", ""),
+        )
+        for transfer in transfers
+    ])
+
+
+def measure_memory(extract, token_registry, transactions):
+    """ Bytes held by the extracted batch """
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    batch = extract(token_registry, transactions, DISTRIBUTOR)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(batch), after - before
+
+
+def run(name, extract, insert, aggregate, token_registry, transactions):
+    """ Runs extract -> insert -> aggregate and prints the timings """
+    count, held = measure_memory(extract, token_registry, transactions)
+
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    cursor.execute(transfers_table)
+
+    start = time.perf_counter()
+    batch = extract(token_registry, transactions, DISTRIBUTOR)
+    extract_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    insert(cursor, batch)
+    connection.commit()
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    aggregated = aggregate(batch)
+    aggregate_time = time.perf_counter() - start
+
+    total = extract_time + insert_time + aggregate_time
+    print(
+        f"{name:<14} extract {extract_time:6.2f}s  insert {insert_time:6.2f}s  aggregate {aggregate_time:6.2f}s  "
+        f"total {total:6.2f}s ({count / total:>10,.0f} transfers/s)  "
+        f"held {held / count:6.1f} MB per 1M transfers  wallets {len(aggregated)}"
+    )
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=50000)
+    parser.add_argument("--wallets", type=int, default=20000)
+    args = parser.parse_args()
+
+    helius_transactions = make_helius_transactions(args.txs, DISTRIBUTOR, wallets=args.wallets)
+    token_registry = FixedTokenRegistry(helius_transactions)
+    transactions = process_distributor_transactions(helius_transactions)
+    del helius_transactions
+
+    print(f"{args.txs} transactions")
+    run(
+        "dicts",
+        extract_dicts,
+        insert_dicts,
+        aggregate_transfers,
+        token_registry,
+        transactions,
+    )
+    run(
+        "TransferBatch",
+        process_distributor_transfers,
+        lambda cursor, batch: cursor.executemany(INSERT, batch.rows()),
+        lambda batch: aggregate_transfer_columns(*batch.columns()),
+        token_registry,
+        transactions,
+    )
+
+
+if __name__ == "__main__":
+    main()
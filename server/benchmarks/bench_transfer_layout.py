@@ -0,0 +1,187 @@
+"""
+Size and read speed of a distributors transfers table in the old layout, with the signature, wallet, token and
+distributor strings on every row, against the wallets/tokens/txs id layout SQLiteDB uses now. Reports the
+table and index sizes from dbstat, the insert time, the get_transfer_columns scan and the get_wallet_totals
+aggregation, and checks that migrating the old db gives the same totals.
+
+Run from the server directory:
+    python -m benchmarks.bench_transfer_layout --txs 20000 --transfers-per-tx 50 --wallets 50000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from db.SQLiteDB import SQLiteDB
+from db.schemas import transfers as transfers_table, transfers_unique_index
+from utils.transfer_batch import TransferBatch
+
+DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+# The distributor indexes before the id layout
+OLD_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_distributor ON transfers(wallet_address, distributor)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_token ON transfers(wallet_address, token, amount)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_signature ON transfers(signature)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_address ON transfers(wallet_address)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_distributor ON transfers(distributor)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_timestamp ON transfers(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_slot ON transfers(slot)",
+]
+
+
+def make_batches(args):
+    """ TransferBatches of 100 transactions, every transaction pays transfers_per_tx random wallets """
+    rng = random.Random(1)
+    wallets = [f"{i:044d}" for i in range(args.wallets)]
+    tokens = ["sol"] + [f"Mint{i:040d}" for i in range(4)]
+
+    batches = []
+    for first in range(0, args.txs, 100):
+        batch = TransferBatch(DISTRIBUTOR)
+        for number in range(first, min(first + 100, args.txs)):
+            tx = batch.add_transaction(f"{number:088d}", 300000000 + number, 1700000000 + number)
+            token = rng.choice(tokens)
+            for wallet in rng.sample(wallets, args.transfers_per_tx):
+                batch.add_transfer(tx, wallet, token, rng.random())
+        batches.append(batch)
+
+    return batches
+
+
+def get_sizes(path):
+    """ Total size of the db and the pages used by each table and index """
+    connection = sqlite3.connect(path)
+    sizes = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    connection.close()
+    return os.path.getsize(path), sizes
+
+
+def print_sizes(name, path, insert_time, rows):
+    total, sizes = get_sizes(path)
+    print(f"{name:<4} {total / 1024 / 1024:8.1f} MB  {total / rows:6.1f} B/transfer  insert {rows / insert_time:>9,.0f} rows/s")
+    for table, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        if size >= 64 * 1024:
+            print(f"       {table:<36} {size / 1024 / 1024:8.1f} MB")
+
+
+def run_old(batches, path):
+    """ The old layout written directly, indexes built at the end like clean_and_remove_temp_data did """
+    connection = sqlite3.connect(path)
+    connection.execute(transfers_table)
+    connection.execute(transfers_unique_index)
+
+    start = time.perf_counter()
+    for batch in batches:
+        connection.executemany(
+            """INSERT OR IGNORE INTO transfers
+               (signature, slot, timestamp, amount, token, wallet_address, distributor)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            batch.rows(),
+        )
+    for index_sql in OLD_INDEXES:
+        connection.execute(index_sql)
+    connection.commit()
+    insert_time = time.perf_counter() - start
+
+    rows = connection.execute("SELECT COUNT(*) FROM transfers").fetchone()[0]
+    connection.execute("VACUUM")
+
+    # The old get_transfer_columns and get_wallet_totals queries
+    start = time.perf_counter()
+    last_id = 0
+    while True:
+        results = connection.execute(
+            "SELECT id, wallet_address, distributor, token, amount FROM transfers WHERE id > ? ORDER BY id LIMIT 50000",
+            (last_id,),
+        ).fetchall()
+        if not results:
+            break
+        ids, *columns = zip(*results)
+        last_id = ids[-1]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    totals = connection.execute(
+        "SELECT wallet_address, token, SUM(amount) FROM transfers GROUP BY wallet_address, token"
+    ).fetchall()
+    aggregate_time = time.perf_counter() - start
+    connection.close()
+
+    print_sizes("old", path, insert_time, rows)
+    print(f"       scan {rows / scan_time:>11,.0f} rows/s  totals {aggregate_time:6.2f}s for {len(totals)} wallet tokens")
+
+
+def run_new(batches, sqlite_db):
+    """ SQLiteDB with the id layout, the same insert and index path as the initializer """
+    start = time.perf_counter()
+    for batch in batches:
+        sqlite_db.insert_transfer_batch(DISTRIBUTOR, batch)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db.create_distributor_indexes(DISTRIBUTOR)
+    insert_time = time.perf_counter() - start
+
+    rows = sqlite_db.get_transfers_count(DISTRIBUTOR)
+    path = sqlite_db.get_distributor_db_path(DISTRIBUTOR)
+    sqlite_db.writer.submit(path, lambda connection: connection.execute("VACUUM"), transaction=False).result()
+
+    start = time.perf_counter()
+    for columns, last_id, row_count in sqlite_db.get_transfer_columns(DISTRIBUTOR):
+        pass
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    totals = sum(len(batch) for batch in sqlite_db.get_wallet_totals(DISTRIBUTOR))
+    aggregate_time = time.perf_counter() - start
+
+    print_sizes("new", path, insert_time, rows)
+    print(f"       scan {rows / scan_time:>11,.0f} rows/s  totals {aggregate_time:6.2f}s for {totals} wallet tokens")
+
+
+def check_migration(old_path, sqlite_db):
+    """ Migrates a copy of the old db and compares its totals with the ones from the new layout """
+    expected = {(w, t): a for batch in sqlite_db.get_wallet_totals(DISTRIBUTOR) for w, t, a in batch}
+
+    migrated = "Migr1111111111111111111111111111111111111111"
+    shutil.copy(old_path, sqlite_db.get_distributor_db_path(migrated))
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db.create_distributor_tables(migrated)
+    migrate_time = time.perf_counter() - start
+
+    totals = {(w, t): a for batch in sqlite_db.get_wallet_totals(migrated) for w, t, a in batch}
+    matches = totals.keys() == expected.keys() and all(abs(totals[key] - expected[key]) < 1e-9 for key in expected)
+    print(f"migration {migrate_time:.2f}s, totals match: {matches}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--txs", type=int, default=20000)
+    parser.add_argument("--transfers-per-tx", type=int, default=50)
+    parser.add_argument("--wallets", type=int, default=50000)
+    args = parser.parse_args()
+
+    batches = make_batches(args)
+    print(f"{args.txs} transactions, {args.txs * args.transfers_per_tx} transfers, {args.wallets} wallets")
+
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("backup/transfers")
+    old_path = os.path.abspath("old.db")
+    run_old(batches, old_path)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sqlite_db = SQLiteDB(temp=False)
+        sqlite_db.create_distributor_tables(DISTRIBUTOR)
+
+    run_new(batches, sqlite_db)
+    check_migration(old_path, sqlite_db)
+    sqlite_db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Write and read latency of the nested wallets documents against the flat wallet_rewards documents, one per
+(wallet, distributor, token). A few hot wallets are paid by every distributor in several tokens the way the
+busiest holders are, the rest by one or two. Every flush goes through MongoDB.insert_wallet_rewards and every
+read through MongoDB.get_wallet_rewards with the layout switched, then the collection and index sizes are
+printed from collStats and the reads of the two layouts are compared.
+
+Needs a MongoDB server, the benchmark database is dropped before and after each layout. Run from the server directory:
+    python -m benchmarks.bench_wallet_layout --mongo-url mongodb://localhost:27017 --wallets 20000
+"""
+import argparse
+import random
+import statistics
+import time
+from db.MongoDB import MongoDB
+from .fixtures import random_address
+
+
+def make_flushes(args):
+    """ The aggregated rewards of every flush, the {wallet: {"distributors": ...}} dict the buffer writes """
+    rng = random.Random(11)
+    wallets = [random_address(rng) for _ in range(args.wallets)]
+    distributors = [random_address(rng) for _ in range(args.distributors)]
+    tokens = ["sol"] + [f"TOKEN{i}" for i in range(args.tokens - 1)]
+    hot = set(wallets[: args.hot_wallets])
+
+    flushes = []
+    for _ in range(args.flushes):
+        flush = {}
+        for wallet_address in rng.sample(wallets, args.wallets_per_flush):
+            # Hot wallets get paid by every distributor in every token
+            if wallet_address in hot:
+                pairs = [(distributor, token) for distributor in distributors for token in tokens]
+            else:
+                pairs = [(rng.choice(distributors), rng.choice(tokens)) for _ in range(rng.randint(1, 2))]
+
+            distributors_data = flush.setdefault(wallet_address, {"distributors": {}})["distributors"]
+            for distributor, token in pairs:
+                tokens_data = distributors_data.setdefault(distributor, {"tokens": {}})["tokens"]
+                tokens_data[token] = {"total_amount": rng.random()}
+        flushes.append(flush)
+
+    return wallets, list(hot), flushes
+
+
+def percentiles(times):
+    """ p50 and p99 in milliseconds """
+    times = sorted(times)
+    return times[len(times) // 2] * 1000, times[min(len(times) - 1, int(len(times) * 0.99))] * 1000
+
+
+def get_sizes(mongo_db, collection):
+    """ Data size, average document size and index size from collStats """
+    try:
+        stats = mongo_db._db.command("collStats", collection)
+        return stats["size"], stats.get("avgObjSize", 0), stats["totalIndexSize"]
+    except Exception as e:
+        return None
+
+
+def run(args, layout, wallets, hot, flushes):
+    """ Writes every flush and reads a sample of the wallets with one layout """
+    mongo_db = MongoDB(mongo_url=args.mongo_url, database=args.database, wallet_rewards_layout=layout)
+    mongo_db._client.drop_database(args.database)
+    mongo_db.create_indexes()
+
+    write_times = []
+    ops = 0
+    for flush in flushes:
+        ops += len(mongo_db.build_wallet_reward_ops(flush))
+        start = time.perf_counter()
+        mongo_db.insert_wallet_rewards(flush)
+        write_times.append(time.perf_counter() - start)
+
+    # Half of the reads are the hot wallets, the ones with the largest documents
+    rng = random.Random(5)
+    sample = [rng.choice(hot) if i % 2 else rng.choice(wallets) for i in range(args.reads)]
+
+    read_times = []
+    results = {}
+    for wallet_address in sample:
+        start = time.perf_counter()
+        wallet = mongo_db.get_wallet_rewards(wallet_address)
+        read_times.append(time.perf_counter() - start)
+        results[wallet_address] = MongoDB.get_wallet_totals(wallet) if wallet else {}
+
+    hot_times = [elapsed for i, elapsed in enumerate(read_times) if i % 2]
+    sizes = get_sizes(mongo_db, mongo_db.get_wallet_rewards_collection().name)
+
+    write_p50, write_p99 = percentiles(write_times)
+    read_p50, read_p99 = percentiles(read_times)
+    hot_p50, hot_p99 = percentiles(hot_times)
+    print(
+        f"{layout:<7} write ops {ops:>8}  flush p50 {write_p50:8.1f}ms  p99 {write_p99:8.1f}ms  "
+        f"total {sum(write_times):6.2f}s"
+    )
+    print(
+        f"        read p50 {read_p50:6.2f}ms  p99 {read_p99:6.2f}ms  hot wallets p50 {hot_p50:6.2f}ms  "
+        f"p99 {hot_p99:6.2f}ms  mean {statistics.mean(read_times) * 1000:6.2f}ms"
+    )
+    if sizes:
+        size, average, index_size = sizes
+        print(
+            f"        data {size / 1024 / 1024:8.1f} MB  avg document {average:8.0f} B  "
+            f"indexes {index_size / 1024 / 1024:6.1f} MB"
+        )
+
+    mongo_db._client.drop_database(args.database)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="bench_wallet_layout")
+    parser.add_argument("--wallets", type=int, default=20000)
+    parser.add_argument("--hot-wallets", type=int, default=50)
+    parser.add_argument("--distributors", type=int, default=30)
+    parser.add_argument("--tokens", type=int, default=4)
+    parser.add_argument("--flushes", type=int, default=20)
+    parser.add_argument("--wallets-per-flush", type=int, default=5000)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    wallets, hot, flushes = make_flushes(args)
+    print(
+        f"{args.flushes} flushes of {args.wallets_per_flush} wallets out of {args.wallets}, {args.hot_wallets} hot "
+        f"wallets paid by {args.distributors} distributors in {args.tokens} tokens, {args.reads} reads"
+    )
+
+    nested = run(args, "nested", wallets, hot, flushes)
+    flat = run(args, "flat", wallets, hot, flushes)
+
+    matches = nested.keys() == flat.keys() and all(
+        nested[wallet].keys() == flat[wallet].keys()
+        and all(abs(nested[wallet][key] - flat[wallet][key]) < 1e-9 for key in nested[wallet])
+        for wallet in nested
+    )
+    print(f"reads match: {matches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import random
+import string
+
+# Base58 alphabet used by Solana addresses and signatures
+BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def random_address(rng, length=44):
+    """ Random base58 string that looks like a Solana address """
+    return "".join(rng.choice(BASE58) for _ in range(length))
+
+
+def make_helius_transactions(count, distributor, wallets=500, mints=20, transfers_per_tx=20, seed=1, wallet_pool=None):
+    """
+    Builds synthetic enhanced transactions shaped like the Helius /v0/addresses/{addr}/transactions
+    response, including the fields the ingestion path ignores, newest first. A wallet_pool can be passed so
+    transactions of different distributors pay the same wallets
+    """
+    rng = random.Random(seed)
+    generated_pool = [random_address(rng) for _ in range(wallets)]
+    wallet_pool = wallet_pool or generated_pool
+    mint_pool = [random_address(rng) for _ in range(mints)]
+
+    transactions = []
+    for i in range(count):
+        slot = 300_000_000 - i
+        receivers = rng.sample(wallet_pool, min(transfers_per_tx, len(wallet_pool)))
+        mint = rng.choice(mint_pool)
+
+        native_transfers = [
+            {"fromUserAccount": distributor, "toUserAccount": wallet, "amount": rng.randint(1_000, 10_000_000)}
+            for wallet in receivers[: transfers_per_tx // 2]
+        ]
+        token_transfers = [
+            {
+                "fromUserAccount": distributor,
+                "toUserAccount": wallet,
+                "fromTokenAccount": random_address(rng),
+                "toTokenAccount": random_address(rng),
+                "tokenAmount": round(rng.uniform(0.001, 1000), 6),
+                "mint": mint,
+                "tokenStandard": "Fungible",
+            }
+            for wallet in receivers[transfers_per_tx // 2 :]
+        ]
+
+        transactions.append(
+            {
+                "description": "",
+                "type": "TRANSFER",
+                "source": "SYSTEM_PROGRAM",
+                "fee": 5000,
+                "feePayer": distributor,
+                "signature": random_address(rng, 88),
+                "slot": slot,
+                "timestamp": 1_700_000_000 - i * 60,
+                "tokenTransfers": token_transfers,
+                "nativeTransfers": native_transfers,
+                "accountData": [
+                    {"account": wallet, "nativeBalanceChange": 0, "tokenBalanceChanges": []}
+                    for wallet in receivers
+                ],
+                "transactionError": None,
+                "instructions": [
+                    {
+                        "accounts": [distributor, wallet],
+                        "data": "".join(rng.choice(string.ascii_letters) for _ in range(24)),
+                        "programId": "11111111111111111111111111111111",
+                        "innerInstructions": [],
+                    }
+                    for wallet in receivers
+                ],
+                "events": {},
+            }
+        )
+
+    return transactions
+
+
+def make_assets(transactions):
+    """
+    Builds getAsset style results for every mint in the transactions
+    """
+    mints = {
+        tf["mint"]
+        for tx in transactions
+        for tf in tx.get("tokenTransfers", [])
+    }
+
+    return {
+        mint: {
+            "id": mint,
+            "interface": "FungibleToken",
+            "content": {"metadata": {"symbol": f"TK{i}", "name": f"Token {i}"}},
+        }
+        for i, mint in enumerate(sorted(mints))
+    }
+
+
+class FixedTokenRegistry:
+    """
+    Stands in for the TokenRegistry with the fixture mints already resolved so benchmarks don't go to Helius
+    """
+
+    def __init__(self, transactions):
+        self.known_tokens_dict = {
+            mint.lower(): asset["content"]["metadata"]["symbol"]
+            for mint, asset in make_assets(transactions).items()
+        }
+
+    def resolve_mints(self, mint_addresses):
+        pass
+
+    def get_token_symbols(self, mint_addresses):
+        return {mint: self.known_tokens_dict[mint.lower()] for mint in mint_addresses}
@@ -0,0 +1,157 @@
+"""
+Local stand-in for the parts of Helius the ingestion path uses so it can be benchmarked and regression
+tested without paying for API calls. It serves:
+
+    GET  /v0/addresses/{address}/transactions   with before/until/limit pagination, newest first
+    POST /                                      JSON-RPC getAsset and getAssetBatch
+
+Transactions come from a recorded fixture file or are generated. Latency, errors and 429s can be injected.
+
+Run from the server directory:
+    python -m benchmarks.helius_standin --txs 20000 --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02
+
+Then point the app at it with:
+    HELIUS_API_URL=http://127.0.0.1:8899 HELIUS_RPC_URL=http://127.0.0.1:8899/
+"""
+import argparse
+import asyncio
+import json
+import random
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from .fixtures import make_helius_transactions, make_assets
+
+DEFAULT_DISTRIBUTOR = "Dist1111111111111111111111111111111111111111"
+
+
+def create_app(transactions, assets, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+    """
+    Builds the stand-in app. transactions maps an address to its transactions ordered newest first and
+    assets maps a mint to its getAsset result
+    """
+    app = FastAPI(title="Helius stand-in")
+    rng = random.Random(seed)
+
+    # Signature -> position so before/until lookups are O(1)
+    positions = {
+        address: {tx["signature"]: i for i, tx in enumerate(txs)}
+        for address, txs in transactions.items()
+    }
+
+    app.state.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    async def inject_faults():
+        """ Applies the configured latency and returns an error response if one should be injected """
+        app.state.stats["requests"] += 1
+
+        delay = latency + (rng.uniform(0, jitter) if jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            app.state.stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": "Too many requests"},
+                headers={"Retry-After": str(retry_after)},
+            )
+        if roll < rate_limit_rate + error_rate:
+            app.state.stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"error": "Service unavailable"})
+
+        return None
+
+    @app.get("/v0/addresses/{address}/transactions")
+    async def get_transactions(address: str, before: str = None, until: str = None, limit: int = 100):
+        error = await inject_faults()
+        if error is not None:
+            return error
+
+        txs = transactions.get(address, [])
+        index = positions.get(address, {})
+
+        # before is exclusive, paging continues after that signature
+        start = index[before] + 1 if before in index else 0
+
+        # until is exclusive, stop before that signature
+        end = index[until] if until in index else len(txs)
+
+        return txs[start : min(end, start + min(limit, 100))]
+
+    @app.post("/")
+    async def rpc(request: Request):
+        error = await inject_faults()
+        if error is not None:
+            return error
+
+        body = await request.json()
+        method = body.get("method")
+        params = body.get("params", {})
+
+        if method == "getAsset":
+            result = assets.get(params.get("id"))
+        elif method == "getAssetBatch":
+            result = [assets.get(mint) for mint in params.get("ids", [])]
+        else:
+            return {"jsonrpc": "2.0", "id": body.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+
+        return {"jsonrpc": "2.0", "id": body.get("id"), "result": result}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+
+def load_fixtures(path):
+    """
+    Loads a recorded fixture file shaped like {"transactions": {address: [...]}, "assets": {mint: {...}}}
+    """
+    with open(path) as f:
+        fixtures = json.load(f)
+
+    transactions = fixtures.get("transactions", {})
+    assets = fixtures.get("assets") or make_assets([tx for txs in transactions.values() for tx in txs])
+    return transactions, assets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", help="Recorded fixture file, synthetic transactions are used when missing")
+    parser.add_argument("--distributor", default=DEFAULT_DISTRIBUTOR)
+    parser.add_argument("--txs", type=int, default=10000, help="Number of synthetic transactions")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that get a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests that get a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8899)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        transactions, assets = load_fixtures(args.fixtures)
+    else:
+        txs = make_helius_transactions(args.txs, args.distributor, seed=args.seed)
+        transactions, assets = {args.distributor: txs}, make_assets(txs)
+
+    app = create_app(
+        transactions,
+        assets,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+    print(f"Serving {sum(map(len, transactions.values()))} transactions for {len(transactions)} addresses")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
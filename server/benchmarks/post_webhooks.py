@@ -0,0 +1,55 @@
+"""
+Posts recorded or synthetic enhanced transaction payloads to the webhook route the way Helius does, so
+webhook ingestion can be tested locally. Use --replay to send every payload twice and check idempotency.
+
+Run from the server directory with the API running:
+    python -m benchmarks.post_webhooks --url http://127.0.0.1:8000/webhooks/helius --secret $HELIUS_WEBHOOK_SECRET
+"""
+import argparse
+import json
+import time
+import requests
+from .fixtures import make_helius_transactions
+from .helius_standin import DEFAULT_DISTRIBUTOR
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhooks/helius")
+    parser.add_argument("--secret", required=True, help="Same value as HELIUS_WEBHOOK_SECRET")
+    parser.add_argument("--fixtures", help="Recorded payload file, a JSON list of enhanced transactions")
+    parser.add_argument("--distributor", default=DEFAULT_DISTRIBUTOR)
+    parser.add_argument("--txs", type=int, default=100, help="Number of synthetic transactions")
+    parser.add_argument("--batch-size", type=int, default=10, help="Transactions per webhook payload")
+    parser.add_argument("--replay", action="store_true", help="Post every payload a second time")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            transactions = json.load(f)
+    else:
+        transactions = make_helius_transactions(args.txs, args.distributor)
+
+    payloads = [
+        transactions[i : i + args.batch_size] for i in range(0, len(transactions), args.batch_size)
+    ]
+    if args.replay:
+        payloads = payloads + payloads
+
+    session = requests.Session()
+    totals = {"received": 0, "txs": 0, "skipped": 0, "transfers": 0}
+    start = time.perf_counter()
+
+    for payload in payloads:
+        response = session.post(args.url, json=payload, headers={"Authorization": args.secret}, timeout=30)
+        response.raise_for_status()
+
+        for key, value in response.json().items():
+            totals[key] = totals.get(key, 0) + value
+
+    elapsed = time.perf_counter() - start
+    print(f"Posted {len(payloads)} payloads in {elapsed:.2f}s: {totals}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import os
+from datetime import datetime
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 from pymongo.errors import DuplicateKeyError, BulkWriteError
 from pymongo import UpdateOne
+from .RewardsBuffer import merge_wallet_rewards
 
 load_dotenv()
 
@@ -13,12 +15,30 @@ class MongoDB:
     This class connects to the MongoDB cluster url from the .env file. It can be used
     to query read and write projects and transactions to the database
     """
-    def __init__(self):
+
+    # Key of the flat wallet_rewards documents, also the order they are read in
+    WALLET_REWARDS_KEY = [("wallet_address", 1), ("distributor", 1), ("token", 1)]
+    WALLET_REWARDS_PROJECTION = {"_id": 0, "wallet_address": 1, "distributor": 1, "token": 1, "total_amount": 1}
+
+    # Wallets documents without the batches that are still being written to them
+    WALLET_PROJECTION = {"_id": 0, "applying_batches": 0}
+
+    def __init__(self, mongo_url=None, database="rewards_db", wallet_rewards_layout=None):
         """
         Create the connection to mongodb and get the target db
         """
-        self._client = MongoClient(os.getenv("MONGO_URL"), server_api=ServerApi("1"))
-        self._db = self._client.rewards_db
+        self._client = MongoClient(mongo_url or os.getenv("MONGO_URL"), server_api=ServerApi("1"))
+        self._db = self._client[database]
+
+        # Whether the server has transactions, checked the first time wallet rewards are applied
+        self.transactions = None
+
+        # "nested" keeps a wallets document per wallet with every distributor and token in it, "flat" keeps a
+        # wallet_rewards document per (wallet, distributor, token)
+        self.wallet_rewards_layout = wallet_rewards_layout or os.getenv("WALLET_REWARDS_LAYOUT", "nested")
+        if self.wallet_rewards_layout not in ("nested", "flat"):
+            print(f"Unknown WALLET_REWARDS_LAYOUT {self.wallet_rewards_layout}, using the nested wallets documents")
+            self.wallet_rewards_layout = "nested"
 
     def create_indexes(self):
         """
@@ -39,9 +59,22 @@ class MongoDB:
             # Wallets collection indexes
             wallets_collection.create_index("wallet_address", unique=True)
 
+            # Wallet rewards collection index, a wallets documents are one range of it
+            self._db.wallet_rewards.create_index(self.WALLET_REWARDS_KEY, unique=True)
+
+            # Batches being written without a transaction, only set until the batch is applied
+            wallets_collection.create_index("applying_batches", sparse=True)
+            self._db.wallet_rewards.create_index("applying_batches", sparse=True)
+
             # Known tokens collection indexes
             known_tokens_collection.create_index("mint", unique=True)
 
+            # Processed signatures only need to outlive the gap between polls
+            self._db.processed_signatures.create_index("created_at", expireAfterSeconds=30 * 24 * 60 * 60)
+
+            # The reward batch ledger only has to catch replays, the same as the processed signatures
+            self._db.reward_batches.create_index("created_at", expireAfterSeconds=30 * 24 * 60 * 60)
+
             # Rewards wallets collencion indexes
             transfers_collection.create_index(
                 [
@@ -193,6 +226,62 @@ class MongoDB:
             print(f"Error adding project to supported project")
             return None
 
+    def insert_known_tokens(self, tokens):
+        """
+        Bulk insert known tokens, tokens that are already in the collection are skipped
+        """
+        if not tokens:
+            return 0
+
+        try:
+            # get the collection to write to
+            collection = self._db.known_tokens
+
+            # document structure
+            documents = [
+                {
+                    "symbol": token["symbol"],
+                    "name": token["name"],
+                    "mint": token["mint"],
+                    "decimals": token["decimals"],
+                }
+                for token in tokens
+            ]
+
+            result = collection.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+
+        except BulkWriteError as e:
+            # Duplicates are expected, anything else gets logged
+            errors = e.details["writeErrors"]
+            for error in errors:
+                if error["code"] != 11000:
+                    print(f"Error adding known token: {error.get('errmsg')}")
+            return e.details.get("nInserted", 0)
+
+        except Exception as e:
+            print(f"Error adding known tokens: {e}")
+            return 0
+
+    ##########################################################
+    #              Processed Signatures Functions            #
+    ##########################################################
+    def get_processed_signatures(self, distributor, signatures):
+        """
+        Returns the signatures that were already applied for the distributor. They are recorded with the
+        wallet increments in apply_wallet_rewards, the _id is built from the distributor and signature
+        """
+        if not signatures:
+            return set()
+
+        collection = self._db.processed_signatures
+
+        documents = collection.find(
+            {"_id": {"$in": [f"{distributor}:{signature}" for signature in signatures]}}, {"signature": 1}
+        )
+
+        return {document["signature"] for document in documents}
+
     ##########################################################
     #                    Transfer Functions                  #
     ##########################################################
@@ -288,76 +377,474 @@ class MongoDB:
         Get all wallet documents from the wallets collection
         """
         try:
+            if self.wallet_rewards_layout == "flat":
+                return [wallet for batch in self.get_rewards_wallet_batches() for wallet in batch]
+
             collection = self._db.wallets
 
             # Find all documents, exclude _id field
-            wallets = list(collection.find({}, {"_id": 0}))
+            wallets = list(collection.find({}, self.WALLET_PROJECTION))
             return wallets
 
         except Exception as e:
             print(f"Error getting all wallets: {e}")
             return None
 
+    def get_rewards_wallet_batches(self, batch_size=1000, layout=None):
+        """
+        Generator that yields the wallet documents in batches so the whole collection is never held in memory.
+        In the flat layout the wallet_rewards documents are read in index order and put back together by wallet
+        """
+        if (layout or self.wallet_rewards_layout) == "flat":
+            documents = self._db.wallet_rewards.find({}, self.WALLET_REWARDS_PROJECTION).sort(self.WALLET_REWARDS_KEY)
+            wallets = self.group_wallet_rewards(documents.batch_size(batch_size))
+        else:
+            wallets = self._db.wallets.find({}, self.WALLET_PROJECTION).batch_size(batch_size)
+
+        batch = []
+        for wallet in wallets:
+            batch.append(wallet)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
     def get_wallet_rewards(self, wallet_address):
         """
-        Get a specific wallet with all its distributors and tokens
+        Get a specific wallet with all its distributors and tokens. In the flat layout it is one range of the
+        wallet_rewards index
         """
         try:
+            if self.wallet_rewards_layout == "flat":
+                documents = self._db.wallet_rewards.find(
+                    {"wallet_address": wallet_address}, self.WALLET_REWARDS_PROJECTION
+                )
+                return next(self.group_wallet_rewards(documents), None)
+
             collection = self._db.wallets
 
             # Find the wallet by its address
-            wallet = collection.find_one({"wallet_address": wallet_address})
+            wallet = collection.find_one({"wallet_address": wallet_address}, {"applying_batches": 0})
 
             return wallet
         except Exception as e:
             print(f"Error getting wallet rewards")
             return None
 
+    @staticmethod
+    def group_wallet_rewards(documents):
+        """
+        Turns wallet_rewards documents sorted by wallet into wallet documents in the shape of the wallets
+        collection
+        """
+        wallet = None
+        for document in documents:
+            if wallet is None or document["wallet_address"] != wallet["wallet_address"]:
+                if wallet is not None:
+                    yield wallet
+                wallet = {"wallet_address": document["wallet_address"], "distributors": {}}
+
+            tokens = wallet["distributors"].setdefault(document["distributor"], {"tokens": {}})["tokens"]
+            tokens[document["token"]] = {"total_amount": document["total_amount"]}
+
+        if wallet is not None:
+            yield wallet
+
+    def get_wallet_rewards_collection(self):
+        """ The collection the wallet reward increments go to for the configured layout """
+        return self._db.wallet_rewards if self.wallet_rewards_layout == "flat" else self._db.wallets
+
     def insert_wallet_rewards(self, wallets, batch_size=5000):
         """
         Bulk update wallet balances with multiple distributors per wallet
         """
-        collection = self._db.wallets
+        collection = self.get_wallet_rewards_collection()
 
-        # Convert dict to list for slicing
-        wallet_items = list(wallets.items())
+        # Build bulk operations for every wallet
+        bulk_ops = self.build_wallet_reward_ops(wallets)
 
         total_updated = 0
-        total_batches = (len(wallet_items) + batch_size - 1) // batch_size
 
-        for i in range(0, len(wallet_items), batch_size):
-            # Get the current batch of wallets
-            batch = wallet_items[i:i + batch_size]
+        for i in range(0, len(bulk_ops), batch_size):
             batch_num = (i // batch_size) + 1
 
-            # Build bulk operations for batch
-            bulk_ops = []
+            # Execute this batch
+            total_updated += self.bulk_write_wallet_rewards(collection, bulk_ops[i:i + batch_size], batch_num)
 
-            for wallet_address, wallet_data in batch:
-                # Build the $inc operations for all distributor/token combinations
-                inc_ops = {}
+        return total_updated
 
+    def build_wallet_reward_ops(self, wallets, batch_id=None):
+        """
+        Builds the $inc upserts for the aggregated rewards. The nested layout has one per wallet with a dotted
+        path for every distributor/token total, the flat layout has one per (wallet, distributor, token).
+        With a batch_id the documents are created first and the $incs only match the ones that don't have the
+        batch in applying_batches yet, adding it as they go
+        """
+        bulk_ops = []
+
+        if self.wallet_rewards_layout == "flat":
+            for wallet_address, wallet_data in wallets.items():
                 for distributor, distributor_data in wallet_data['distributors'].items():
                     for token, token_data in distributor_data['tokens'].items():
-                        # Use dot notation for nested path
-                        path = f"distributors.{distributor}.tokens.{token}.total_amount"
-                        inc_ops[path] = token_data['total_amount']
-
-                # Create the update operation using UpdateOne class
-                bulk_ops.append(
-                    UpdateOne(
-                        {"wallet_address": wallet_address},
-                        {"$inc": inc_ops},
-                        upsert=True
-                    )
+                        bulk_ops.extend(
+                            self.build_wallet_reward_op(
+                                {"wallet_address": wallet_address, "distributor": distributor, "token": token},
+                                {"total_amount": token_data['total_amount']},
+                                batch_id,
+                            )
+                        )
+
+            return bulk_ops
+
+        for wallet_address, wallet_data in wallets.items():
+            # Build the $inc operations for all distributor/token combinations
+            inc_ops = {}
+
+            for distributor, distributor_data in wallet_data['distributors'].items():
+                for token, token_data in distributor_data['tokens'].items():
+                    # Use dot notation for nested path
+                    path = f"distributors.{distributor}.tokens.{token}.total_amount"
+                    inc_ops[path] = token_data['total_amount']
+
+            # Create the update operation using UpdateOne class
+            bulk_ops.extend(self.build_wallet_reward_op({"wallet_address": wallet_address}, inc_ops, batch_id))
+
+        return bulk_ops
+
+    @staticmethod
+    def build_wallet_reward_op(key, inc_ops, batch_id=None):
+        """ The $inc upsert for one document, or the create and the marked $inc when there is a batch_id """
+        if batch_id is None:
+            return [UpdateOne(key, {"$inc": inc_ops}, upsert=True)]
+
+        return [
+            UpdateOne(key, {"$setOnInsert": {"applying_batches": []}}, upsert=True),
+            UpdateOne(
+                {**key, "applying_batches": {"$ne": batch_id}},
+                {"$inc": inc_ops, "$addToSet": {"applying_batches": batch_id}},
+            ),
+        ]
+
+    def supports_transactions(self):
+        """
+        Transactions need a replica set or a sharded cluster, a standalone server doesn't have them
+        """
+        try:
+            hello = self._client.admin.command("hello")
+            return "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            return False
+
+    def apply_wallet_rewards(self, batches, batch_size=5000):
+        """
+        Applies RewardsBuffer batches to the wallets exactly once. The batch ids go into the reward_batches
+        ledger and their signatures into processed_signatures in the same transaction as the $incs, so a batch
+        that was already applied is skipped. Without a replica set there are no transactions and every batch
+        is marked on the documents it increments instead, see write_reward_batches_without_transactions.
+        Errors are raised so the buffer keeps the batches.
+
+        Returns the ids of the batches applied now, the ones that were already in the ledger, the ones dropped
+        because another batch applied their signatures and the number of wallets updated
+        """
+        if self.transactions is None:
+            self.transactions = self.supports_transactions()
+            if not self.transactions:
+                print("MongoDB has no transactions, wallet reward batches are marked on the documents they are written to")
+
+        if not self.transactions:
+            return self.write_reward_batches_without_transactions(batches, batch_size)
+
+        with self._client.start_session() as session:
+            return session.with_transaction(lambda s: self.write_reward_batches(batches, s, batch_size))
+
+    def check_reward_batches(self, batches, session=None):
+        """
+        Splits the batches into the ones already in the ledger, the new ones and the ones dropped because a batch
+        from another writer applied one of their signatures. Pending ledger entries were cut short part way
+        and count as new
+        """
+        ledger = self._db.reward_batches
+        processed = self._db.processed_signatures
+
+        # Batches in the ledger were written by an earlier flush
+        applied = {
+            document["_id"]
+            for document in ledger.find({"_id": {"$in": list(batches)}}, {"_id": 1, "status": 1}, session=session)
+            if document.get("status") != "pending"
+        }
+
+        claims = {
+            batch_id: [f"{batch['distributor']}:{signature}" for signature in batch["signatures"]]
+            for batch_id, batch in batches.items()
+            if batch_id not in applied
+        }
+        claim_ids = [claim_id for ids in claims.values() for claim_id in ids]
+
+        # A signature that is already processed by another batch was applied by another writer, the ones a
+        # pending batch recorded itself before it was cut short don't count
+        processed_by = {}
+        if claim_ids:
+            processed_by = {
+                document["_id"]: document.get("batch_id")
+                for document in processed.find({"_id": {"$in": claim_ids}}, {"_id": 1, "batch_id": 1}, session=session)
+            }
+
+        new_ids = []
+        dropped = []
+        for batch_id, ids in claims.items():
+            if any(claim_id in processed_by and processed_by[claim_id] != batch_id for claim_id in ids):
+                dropped.append(batch_id)
+            else:
+                new_ids.append(batch_id)
+
+        if dropped:
+            print(f"Dropped {len(dropped)} wallet reward batches with signatures that were already applied")
+
+        return applied, new_ids, dropped
+
+    @staticmethod
+    def get_reward_batch_documents(batches, new_ids, now):
+        """ The processed_signatures and reward_batches ledger documents of the new batches """
+        signature_documents = []
+        ledger_documents = []
+        for batch_id in new_ids:
+            distributor, signatures = batches[batch_id]["distributor"], batches[batch_id]["signatures"]
+
+            signature_documents.extend(
+                {
+                    "_id": f"{distributor}:{signature}",
+                    "distributor": distributor,
+                    "signature": signature,
+                    "batch_id": batch_id,
+                    "created_at": now,
+                }
+                for signature in signatures
+            )
+            ledger_documents.append(
+                {
+                    "_id": batch_id,
+                    "distributor": distributor,
+                    "first_sig": signatures[0] if signatures else None,
+                    "last_sig": signatures[-1] if signatures else None,
+                    "signatures": len(signatures),
+                    "wallets": len(batches[batch_id]["wallets"]),
+                    "created_at": now,
+                }
+            )
+
+        return signature_documents, ledger_documents
+
+    def write_reward_batches(self, batches, session, batch_size=5000):
+        """
+        Checks the ledger, writes the merged increments of the new batches and records them, all in session.
+        Runs again from the top when the transaction is retried
+        """
+        applied, new_ids, dropped = self.check_reward_batches(batches, session)
+
+        wallets = {}
+        for batch_id in new_ids:
+            merge_wallet_rewards(wallets, batches[batch_id]["wallets"])
+
+        # The increments, then the signatures and the ledger
+        collection = self.get_wallet_rewards_collection()
+        bulk_ops = self.build_wallet_reward_ops(wallets)
+        updated = 0
+
+        for i in range(0, len(bulk_ops), batch_size):
+            result = collection.bulk_write(bulk_ops[i:i + batch_size], ordered=False, session=session)
+            updated += result.modified_count + result.upserted_count
+
+        signature_documents, ledger_documents = self.get_reward_batch_documents(batches, new_ids, datetime.utcnow())
+
+        if signature_documents:
+            self._db.processed_signatures.insert_many(signature_documents, ordered=False, session=session)
+        if ledger_documents:
+            self._db.reward_batches.insert_many(ledger_documents, ordered=False, session=session)
+
+        return {"applied": new_ids, "replayed": sorted(applied), "dropped": dropped, "updated": updated}
+
+    def write_reward_batches_without_transactions(self, batches, batch_size=5000):
+        """
+        write_reward_batches for a server without transactions, where a failed bulk write can have applied
+        some of its $incs already. The new batches go in the ledger as pending first, then each batch is written
+        on its own with its id added to every document it increments and the $incs skip the documents that
+        already have it. Once the signatures are in the batches are marked applied and the ids are pulled, so a
+        batch retried after any failure only adds the increments that are missing
+        """
+        applied, new_ids, dropped = self.check_reward_batches(batches)
+        ledger = self._db.reward_batches
+
+        signature_documents, ledger_documents = self.get_reward_batch_documents(batches, new_ids, datetime.utcnow())
+        if not ledger_documents:
+            return {"applied": [], "replayed": sorted(applied), "dropped": dropped, "updated": 0}
+
+        ledger.bulk_write(
+            [
+                UpdateOne({"_id": document["_id"]}, {"$setOnInsert": {**document, "status": "pending"}}, upsert=True)
+                for document in ledger_documents
+            ],
+            ordered=False,
+        )
+
+        collection = self.get_wallet_rewards_collection()
+        updated = 0
+
+        for batch_id in new_ids:
+            # Errors are raised so the batch stays pending and the buffer keeps it
+            bulk_ops = self.build_wallet_reward_ops(batches[batch_id]["wallets"], batch_id)
+            for i in range(0, len(bulk_ops), batch_size):
+                updated += self.bulk_write_wallet_rewards(
+                    collection, bulk_ops[i:i + batch_size], (i // batch_size) + 1, raise_errors=True
                 )
 
-            # Execute this batch
-            if bulk_ops:
-                try:
-                    result = collection.bulk_write(bulk_ops, ordered=False)
-                    total_updated += result.modified_count + result.upserted_count
-                except Exception as e:
-                    print(f"Error inserting wallet rewards into db {batch_num}")
+        # Upserts so the signatures a cut short run already recorded don't fail the retry
+        if signature_documents:
+            self._db.processed_signatures.bulk_write(
+                [
+                    UpdateOne({"_id": document["_id"]}, {"$setOnInsert": document}, upsert=True)
+                    for document in signature_documents
+                ],
+                ordered=False,
+            )
+
+        ledger.update_many({"_id": {"$in": new_ids}}, {"$set": {"status": "applied"}})
+        collection.update_many(
+            {"applying_batches": {"$in": new_ids}}, {"$pull": {"applying_batches": {"$in": new_ids}}}
+        )
+
+        return {"applied": new_ids, "replayed": sorted(applied), "dropped": dropped, "updated": updated}
+
+    def get_reward_batch_ids(self, batch_size=10000):
+        """
+        Yields the ids of the applied batches in the reward_batches ledger in lists of up to batch_size
+        """
+        batch = []
+        for document in self._db.reward_batches.find({"status": {"$ne": "pending"}}, {"_id": 1}):
+            batch.append(document["_id"])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def migrate_wallets_to_wallet_rewards(self, batch_size=1000, after=None):
+        """
+        Copies the nested wallets documents into the flat wallet_rewards collection. The totals are set, not
+        added, so it can be run again and a last run with the poller stopped catches up the increments written
+        during the first one. Yields the wallets and documents written and the last wallet of every batch, a
+        stopped run carries on with after set to that wallet
+        """
+        query = {"wallet_address": {"$gt": after}} if after else {}
+        wallets = self._db.wallets.find(query, self.WALLET_PROJECTION).sort("wallet_address", 1).batch_size(batch_size)
+
+        batch = []
+        batch_num = 0
+        for wallet in wallets:
+            batch.append(wallet)
+
+            if len(batch) >= batch_size:
+                batch_num += 1
+                yield self.write_flat_wallets(batch, batch_num)
+                batch = []
+
+        if batch:
+            yield self.write_flat_wallets(batch, batch_num + 1)
+
+    def write_flat_wallets(self, wallets, batch_num):
+        """
+        Sets the wallet_rewards totals to the ones in nested wallet documents. Returns the number of wallets,
+        the number of documents written and the last wallet
+        """
+        bulk_ops = [
+            UpdateOne(
+                {"wallet_address": wallet["wallet_address"], "distributor": distributor, "token": token},
+                {"$set": {"total_amount": token_data.get("total_amount", 0)}},
+                upsert=True
+            )
+            for wallet in wallets
+            for distributor, distributor_data in (wallet.get("distributors") or {}).items()
+            for token, token_data in (distributor_data.get("tokens") or {}).items()
+        ]
+
+        written = self.bulk_write_wallet_rewards(self._db.wallet_rewards, bulk_ops, batch_num) if bulk_ops else 0
+
+        return len(wallets), written, wallets[-1]["wallet_address"]
+
+    def verify_wallet_rewards(self, batch_size=1000):
+        """
+        Compares every nested wallets document with the one put together from wallet_rewards. Returns the
+        number of wallets checked and the addresses that don't match
+        """
+        checked = 0
+        mismatched = []
+
+        for wallets in self.get_rewards_wallet_batches(batch_size, layout="nested"):
+            addresses = [wallet["wallet_address"] for wallet in wallets]
+            documents = self._db.wallet_rewards.find(
+                {"wallet_address": {"$in": addresses}}, self.WALLET_REWARDS_PROJECTION
+            ).sort(self.WALLET_REWARDS_KEY)
+            flat = {wallet["wallet_address"]: wallet for wallet in self.group_wallet_rewards(documents)}
+
+            for wallet in wallets:
+                checked += 1
+                flat_wallet = flat.get(wallet["wallet_address"], {"distributors": {}})
+                if self.get_wallet_totals(wallet) != self.get_wallet_totals(flat_wallet):
+                    mismatched.append(wallet["wallet_address"])
+
+        return checked, mismatched
+
+    @staticmethod
+    def get_wallet_totals(wallet):
+        """ The {(distributor, token): total_amount} totals of a wallet document """
+        return {
+            (distributor, token): token_data.get("total_amount", 0)
+            for distributor, distributor_data in (wallet.get("distributors") or {}).items()
+            for token, token_data in (distributor_data.get("tokens") or {}).items()
+        }
+
+    def bulk_write_wallet_rewards(self, collection, bulk_ops, batch_num, retries=3, raise_errors=False):
+        """
+        Runs the wallet $inc upserts. When two writers upsert the same new wallet at the same time one of them
+        hits the unique wallet_address index, by then the document exists so those ops are retried as updates.
+        With raise_errors any other error is raised instead of logged, for callers that can't record the
+        write as done unless all of it went through
+        """
+        total_updated = 0
+
+        for attempt in range(retries + 1):
+            try:
+                result = collection.bulk_write(bulk_ops, ordered=False)
+                return total_updated + result.modified_count + result.upserted_count
+
+            except BulkWriteError as e:
+                details = e.details
+                total_updated += details.get("nModified", 0) + len(details.get("upserted", []))
+
+                # Only the duplicate key errors are safe to retry, everything else is logged
+                errors = details.get("writeErrors", [])
+                retry_indices = {error["index"] for error in errors if error["code"] == 11000}
+                for error in errors:
+                    if error["code"] != 11000:
+                        print(f"Error inserting wallet rewards into db {batch_num}: {error.get('errmsg')}")
+                        if raise_errors:
+                            raise
+
+                bulk_ops = [op for idx, op in enumerate(bulk_ops) if idx in retry_indices]
+                if not bulk_ops:
+                    return total_updated
+
+            except Exception as e:
+                print(f"Error inserting wallet rewards into db {batch_num}")
+                if raise_errors:
+                    raise
+                return total_updated
+
+        print(f"Gave up on {len(bulk_ops)} wallet rewards after {retries} retries in batch {batch_num}")
+        if raise_errors:
+            raise RuntimeError(f"Gave up on {len(bulk_ops)} wallet rewards in batch {batch_num}")
 
         return total_updated
@@ -0,0 +1,206 @@
+import threading
+import time
+
+
+def merge_wallet_rewards(target, wallets):
+    """
+    Adds the totals of a {wallet: {"distributors": {distributor: {"tokens": {token: {"total_amount"}}}}}} dict
+    into target, which has the same shape
+    """
+    for wallet_address, wallet_data in wallets.items():
+        pending = target.setdefault(wallet_address, {"distributors": {}})["distributors"]
+
+        for distributor, distributor_data in wallet_data["distributors"].items():
+            tokens = pending.setdefault(distributor, {"tokens": {}})["tokens"]
+
+            for token, token_data in distributor_data["tokens"].items():
+                total = tokens.setdefault(token, {"total_amount": 0})
+                total["total_amount"] += token_data["total_amount"]
+
+    return target
+
+
+class RewardsBuffer:
+    """
+    Write behind buffer for the wallet reward increments. Aggregated rewards are added as batches with a
+    deterministic id and written with one call to write, which merges them so a wallet paid by many batches
+    between flushes is one $inc instead of one per batch. Flushes happen once max_pending wallets are waiting,
+    every flush_interval seconds from a background thread, when flush is called and on close.
+
+    write takes a {batch_id: {"wallets", "distributor", "signatures"}} dict, where wallets is the
+    {wallet: {"distributors": {distributor: {"tokens": {token: {"total_amount"}}}}}} dict that
+    aggregate_transfer_columns returns. A batch id that is already pending is a replay and is dropped, the
+    ledger behind write skips the ones that were already written. Callbacks passed to add run after the flush
+    that wrote their increments, that is where checkpoints go so they never get ahead of what was written
+    """
+
+    def __init__(self, write, max_pending=10000, flush_interval=5):
+        self.write = write
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        # Pending batches by id, the wallets and signatures in them, how many wallet updates they hold and the
+        # callbacks waiting on them
+        self.batches = {}
+        self.pending_wallets = set()
+        self.pending_signatures = set()
+        self.flushing_signatures = set()
+        self.pending_added = 0
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+        # Only one flush at a time so the writes and callbacks keep their order
+        self.flush_lock = threading.Lock()
+
+        self.stats = {
+            "added": 0,
+            "replayed": 0,
+            "flushed_added": 0,
+            "written": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "flush_time": 0.0,
+            "max_flush_time": 0.0,
+        }
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        if flush_interval:
+            self.thread = threading.Thread(target=self.run, name="rewards-buffer", daemon=True)
+            self.thread.start()
+
+    def add(self, batch_id, wallets, distributor=None, signatures=(), callback=None):
+        """
+        Adds a batch of aggregated rewards. Flushes right away when the buffer is full or when there is no
+        flush interval
+        """
+        with self.lock:
+            if batch_id in self.batches:
+                self.stats["replayed"] += 1
+            else:
+                self.batches[batch_id] = {"wallets": wallets, "distributor": distributor, "signatures": list(signatures)}
+                self.pending_wallets.update(wallets)
+                self.pending_signatures.update(signatures)
+                self.pending_added += len(wallets)
+                self.stats["added"] += len(wallets)
+
+            if callback is not None:
+                self.callbacks.append(callback)
+
+            full = len(self.pending_wallets) >= self.max_pending
+
+        if full or not self.flush_interval:
+            return self.flush()
+
+        return True
+
+    def add_callback(self, callback):
+        """ Runs callback after the next flush, once everything added before it has been written """
+        with self.lock:
+            self.callbacks.append(callback)
+
+        if not self.flush_interval:
+            return self.flush()
+
+        return True
+
+    def get_pending_signatures(self, signatures):
+        """ Returns the signatures that are in a batch waiting to be written or being written """
+        with self.lock:
+            return {
+                signature
+                for signature in signatures
+                if signature in self.pending_signatures or signature in self.flushing_signatures
+            }
+
+    def flush(self):
+        """
+        Writes everything that is pending. When the write raises the batches are put back so the next flush
+        tries them again. Returns False if they couldn't be written
+        """
+        with self.flush_lock:
+            with self.lock:
+                batches, added, callbacks = self.batches, self.pending_added, self.callbacks
+                self.batches, self.pending_added, self.callbacks = {}, 0, []
+
+                # The signatures count as pending until the write is done, so they aren't added again meanwhile
+                self.flushing_signatures = self.pending_signatures
+                self.pending_wallets, self.pending_signatures = set(), set()
+
+            if not batches and not callbacks:
+                return True
+
+            start = time.perf_counter()
+            try:
+                written = self.write(batches) if batches else 0
+
+            except Exception as e:
+                print(f"Error flushing {len(batches)} wallet reward batches, keeping them for the next flush: {e}")
+                with self.lock:
+                    # Batches added again while the write was running are the same increments
+                    self.batches = {**batches, **self.batches}
+                    for batch in batches.values():
+                        self.pending_wallets.update(batch["wallets"])
+                        self.pending_signatures.update(batch["signatures"])
+                    self.pending_added += added
+                    self.callbacks = callbacks + self.callbacks
+                    self.flushing_signatures = set()
+                    self.stats["failed_flushes"] += 1
+                return False
+
+            flush_time = time.perf_counter() - start
+            with self.lock:
+                self.flushing_signatures = set()
+                self.stats["flushed_added"] += added
+                self.stats["written"] += written or 0
+                self.stats["flushes"] += 1
+                self.stats["flush_time"] += flush_time
+                self.stats["max_flush_time"] = max(self.stats["max_flush_time"], flush_time)
+
+            # The rewards are written, a failing callback only skips itself
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error running wallet rewards flush callback: {e}")
+
+            return True
+
+    def run(self):
+        """ Flushes every flush_interval seconds until close is called """
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in the rewards buffer flush thread: {e}")
+
+    def close(self):
+        """ Stops the flush thread and writes what is left """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        return self.flush()
+
+    def get_stats(self):
+        """
+        Returns the number of wallet updates added and written, the coalescing ratio of the flushed updates to
+        the writes they became, the batches dropped as replays, the flush latency in milliseconds and the
+        number of wallets still pending
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            pending = len(self.pending_wallets)
+
+        flushes = stats["flushes"]
+        return {
+            "added": stats["added"],
+            "written": stats["written"],
+            "pending": pending,
+            "replayed": stats["replayed"],
+            "coalescing_ratio": stats["flushed_added"] / stats["written"] if stats["written"] else 0.0,
+            "flushes": flushes,
+            "failed_flushes": stats["failed_flushes"],
+            "avg_flush_ms": stats["flush_time"] / flushes * 1000 if flushes else 0.0,
+            "max_flush_ms": stats["max_flush_time"] * 1000,
+        }
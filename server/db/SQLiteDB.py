@@ -1,12 +1,26 @@
 import os
 import sqlite3
-import json
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
+from .SQLiteWriter import SQLiteWriter
+from .RewardsBuffer import merge_wallet_rewards
+from .payload_codec import encode_transfers, get_payload_format, AddressBook, TempTransaction
 from .schemas import (
     temp_transactions,
+    temp_addresses,
     temp_txs_last_sigs,
+    init_checkpoints,
     transfers,
+    transfers_unique_index,
+    distributor_wallets,
+    distributor_tokens,
+    distributor_txs,
+    distributor_transfers,
+    distributor_transfers_unique_index,
     wallets,
+    reward_batches,
     supported_projects,
     known_tokens,
 )
@@ -18,24 +32,61 @@ class SQLiteDB:
     The SQLiteDB class is used to manage the backup data for the rewards token tracker. It creates a
     DB for every distributor which stores all of the transfers. There is a "config" DB that stores all
     of the wallet rewards data, supported projects and their most recent tx sigs, and known tokens.
+
+    The dbs run in WAL mode. Every write goes through the SQLiteWriter thread and reads use their own
+    read only connections, so reads keep going while the initializer or the poller is writing.
     """
 
-    def __init__(self, temp=True):
+    CONFIG_DB_PATH = "backup/config.db"
+    TEMP_TRANSFERS_DB_PATH = "backup/temp_transfers"
+
+    # Seconds a reward batch stays in the ledger, matches the TTL of the MongoDB ledger
+    REWARD_BATCH_TTL = 30 * 24 * 60 * 60
+
+    # Read indexes of a distributors db, built once the transfers are loaded
+    DISTRIBUTOR_INDEXES = [
+        # Covering index for the wallet totals, also used for any lookup by wallet
+        "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_token ON transfers(wallet_id, token_id, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_txs_timestamp ON txs(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_txs_slot ON txs(slot)",
+    ]
+
+    def __init__(self, temp=True, max_open=None):
         """Initialize the BackupDB class by configuring DB's"""
         self.temp = temp
 
-        # Configure db collections
-        self.config_connection = sqlite3.connect(f"backup/config.db")
-        self.config_cursor = self.config_connection.cursor()
+        # Distributor db connections are cached per (distributor, thread) and the least recently used one is
+        # closed once more than max_open are open so we stay well under the open files limit
+        self.max_open = max_open or int(os.getenv("SQLITE_MAX_OPEN_CONNECTIONS", 64))
+        self.distributor_connections = OrderedDict()
+        self.distributor_connections_lock = threading.Lock()
+        self.connection_stats = {"opened": 0, "closed": 0, "evicted": 0, "hits": 0, "misses": 0}
 
-        # This one is for the temp transfers
-        self.temp_transfers_connection = sqlite3.connect("backup/temp_transfers")
-        self.temp_transfers_cursor = self.temp_transfers_connection.cursor()
+        # How the transfers of the temp transactions are stored, see payload_codec
+        self.payload_encoding, self.payload_compression = get_payload_format(
+            os.getenv("TEMP_TX_ENCODING", "struct"), os.getenv("TEMP_TX_COMPRESSION", "none")
+        )
+
+        # The writers AddressBook for every distributor with temp transactions, only used in the writer thread
+        self.address_books = {}
+
+        # Does all of the writes, the connections below are only for reading
+        self.writer = SQLiteWriter(max_open=self.max_open)
 
         # Create the tables if they haven't been already
         self.create_config_tables()
         self.create_config_indexes()
 
+        # Configure db collections
+        self.config_connection = self.open_reader(self.CONFIG_DB_PATH)
+        self.config_cursor = self.config_connection.cursor()
+
+        # This one is for the temp transfers. The poller reads it from worker threads
+        # so it can't be tied to the creating thread and the shared cursor is used with a lock
+        self.temp_transfers_connection = self.open_reader(self.TEMP_TRANSFERS_DB_PATH)
+        self.temp_transfers_cursor = self.temp_transfers_connection.cursor()
+        self.temp_transfers_lock = threading.Lock()
+
     def __del__(self):
         """Destructor to ensure connections are closed"""
         self.close_connections()
@@ -45,24 +96,130 @@ class SQLiteDB:
     ##########################################################
     def create_config_tables(self):
         """Creates the tables for the dbs"""
-        self.config_cursor.execute(wallets)
-        self.config_cursor.execute(supported_projects)
-        self.config_cursor.execute(known_tokens)
+        def create_config(cursor):
+            # The first wallets table had a distributors text column and was never written to, it is replaced
+            # by the wallet totals
+            cursor.execute("PRAGMA table_info(wallets)")
+            if "distributors" in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("DROP TABLE wallets")
+                print("Replaced the old wallets table with the wallet totals table")
+
+            cursor.execute(wallets)
+            cursor.execute(reward_batches)
+            cursor.execute(supported_projects)
+            cursor.execute(known_tokens)
+
+        def create_temp_transfers(cursor):
+            cursor.execute(transfers)
+            self.create_transfers_unique_index(cursor)
+
+        self.writer.execute(self.CONFIG_DB_PATH, create_config)
 
         # Temp transfers db
-        self.temp_transfers_cursor.execute(transfers)
+        self.writer.execute(self.TEMP_TRANSFERS_DB_PATH, create_temp_transfers)
 
     def create_distributor_tables(self, distributor):
-        """Creates the tables for the dbs"""
-        connection, cursor = self.get_distributors_db(distributor)
+        """
+        Creates the tables for the dbs. A db still on the old transfers layout, with the addresses and the
+        distributor on every row, is migrated to the wallets/tokens/txs tables first and then vacuumed
+        """
+        def create(cursor):
+            cursor.execute("PRAGMA table_info(transfers)")
+            migrated = "wallet_address" in [column[1] for column in cursor.fetchall()]
+            if migrated:
+                self.migrate_transfers(cursor)
+
+            # Create the transfers tables with the unique index so duplicates are dropped as they are inserted
+            self.create_transfers_tables(cursor)
+
+            # Only needed when initializing new projects
+            if self.temp:
+                cursor.execute(temp_transactions)
+                cursor.execute(temp_addresses)
+                cursor.execute(temp_txs_last_sigs)
+
+            return migrated
+
+        if self.write_distributor(distributor, create):
+            # Gives back the space of the old table, VACUUM can't run inside a transaction
+            path = self.get_distributor_db_path(distributor)
+            self.writer.submit(path, lambda connection: connection.execute("VACUUM"), transaction=False).result()
+            print(f"Vacuumed {distributor} db after the migration")
+
+    @staticmethod
+    def create_transfers_tables(cursor):
+        """ The transfers table of a distributors db and the tables its ids point at """
+        cursor.execute(distributor_wallets)
+        cursor.execute(distributor_tokens)
+        cursor.execute(distributor_txs)
+        cursor.execute(distributor_transfers)
+        cursor.execute(distributor_transfers_unique_index)
+
+    @classmethod
+    def migrate_transfers(cls, cursor):
+        """
+        Moves an old transfers table over to the id layout. Every wallet, token and signature is added once
+        and the transfers keep their ids so the initializer checkpoints still line up. Duplicates that made
+        it in before the unique index are dropped on the way
+        """
+        print("Migrating transfers to the wallets/tokens/txs layout")
 
-        # Create the transfers table
-        cursor.execute(transfers)
+        # The old indexes are on columns that are going away
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transfers' AND sql IS NOT NULL"
+        )
+        for (index_name,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
 
-        # Only needed when initializing new projects
-        if self.temp:
-            cursor.execute(temp_transactions)
-            cursor.execute(temp_txs_last_sigs)
+        cursor.execute("ALTER TABLE transfers RENAME TO transfers_old")
+        cls.create_transfers_tables(cursor)
+
+        cursor.execute(
+            "INSERT OR IGNORE INTO wallets (address) SELECT DISTINCT COALESCE(wallet_address, '') FROM transfers_old"
+        )
+        cursor.execute("INSERT OR IGNORE INTO tokens (token) SELECT DISTINCT COALESCE(token, '') FROM transfers_old")
+
+        # The first row of every signature has its slot and timestamp
+        cursor.execute(
+            """INSERT OR IGNORE INTO txs (signature, slot, timestamp, created_at)
+               SELECT COALESCE(signature, ''), slot, timestamp, created_at
+               FROM transfers_old
+               WHERE id IN (SELECT MIN(id) FROM transfers_old GROUP BY COALESCE(signature, ''))"""
+        )
+
+        cursor.execute(
+            """INSERT OR IGNORE INTO transfers (id, tx_id, wallet_id, token_id, amount)
+               SELECT o.id, x.id, w.id, k.id, o.amount
+               FROM transfers_old o
+               JOIN txs x ON x.signature = COALESCE(o.signature, '')
+               JOIN wallets w ON w.address = COALESCE(o.wallet_address, '')
+               JOIN tokens k ON k.token = COALESCE(o.token, '')
+               ORDER BY o.id ASC"""
+        )
+        print(f"Migrated {cursor.rowcount} transfers")
+
+        cursor.execute("DROP TABLE transfers_old")
+
+        # The project is already loaded so it gets its read indexes back right away
+        for index_sql in cls.DISTRIBUTOR_INDEXES:
+            cursor.execute(index_sql)
+
+    @classmethod
+    def create_transfers_unique_index(cls, cursor):
+        """
+        Makes sure a transfers table has its natural key unique index. Tables made before the index existed can
+        already hold duplicates, those are removed once and then the index is built
+        """
+        try:
+            cursor.execute(transfers_unique_index)
+        except sqlite3.IntegrityError:
+            print("Found duplicate transfers from before the unique index, removing them")
+            cls.delete_duplicates(cursor)
+            cursor.execute(transfers_unique_index)
+
+    def create_checkpoint_table(self, distributor):
+        """Creates the table that holds the initializer stage checkpoints, this one outlives the temp tables"""
+        self.write_distributor(distributor, lambda cursor: cursor.execute(init_checkpoints))
 
     ##########################################################
     #                        DB Indexes                      #
@@ -77,8 +234,11 @@ class SQLiteDB:
                 "CREATE UNIQUE INDEX IF NOT EXISTS idx_supported_projects_distributor ON supported_projects(distributor)",
                 "CREATE INDEX IF NOT EXISTS idx_supported_projects_last_sig ON supported_projects(last_sig)",
 
-                # Wallets table indexes
-                "CREATE UNIQUE INDEX IF NOT EXISTS idx_wallets_wallet_address ON wallets(wallet_address)",
+                # Wallets table indexes, lookups by wallet use the primary key
+                "CREATE INDEX IF NOT EXISTS idx_wallets_distributor ON wallets(distributor)",
+
+                # Reward batch ledger index for pruning the old batches
+                "CREATE INDEX IF NOT EXISTS idx_reward_batches_applied_at ON reward_batches(applied_at)",
 
                 # Known tokens table indexes
                 "CREATE UNIQUE INDEX IF NOT EXISTS idx_known_tokens_mint ON known_tokens(mint)",
@@ -93,51 +253,28 @@ class SQLiteDB:
             ]
 
             # Execute config database indexes
-            for index_sql in config_indexes:
-                self.config_cursor.execute(index_sql)
-
-            for index_sql in transfers_indexes:
-                self.temp_transfers_cursor.execute(index_sql)
-
-            # Commit all changes
-            self.config_connection.commit()
-            self.temp_transfers_connection.commit()
+            def create_indexes(indexes):
+                def create(cursor):
+                    for index_sql in indexes:
+                        cursor.execute(index_sql)
+                return create
+
+            self.writer.execute(self.CONFIG_DB_PATH, create_indexes(config_indexes))
+            self.writer.execute(self.TEMP_TRANSFERS_DB_PATH, create_indexes(transfers_indexes))
             return True
         except Exception as e:
             print(f"Error when creating config indexes! {e}")
             return False
 
     def create_distributor_indexes(self, distributor):
-
-        # Delete any duplicates before trying to make the indexes
-        success = self.delete_duplicate_transfers(distributor)
-        if success is not True:
-            return False
-
-        # Get the connection the the distributors db
-        connection, cursor = self.get_distributors_db(distributor)
-
         try:
-            # Transfers table indexes (for both temp and distributor databases)
-            transfers_indexes = [
-                # Composite unique index
-                "CREATE UNIQUE INDEX IF NOT EXISTS idx_transfers_unique ON transfers(wallet_address, distributor, signature, slot, timestamp, token, amount)",
-
-                # Individual indexes
-                "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_distributor ON transfers(wallet_address, distributor)",
-                "CREATE INDEX IF NOT EXISTS idx_transfers_signature ON transfers(signature)",
-                "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_address ON transfers(wallet_address)",
-                "CREATE INDEX IF NOT EXISTS idx_transfers_distributor ON transfers(distributor)",
-                "CREATE INDEX IF NOT EXISTS idx_transfers_timestamp ON transfers(timestamp)",
-                "CREATE INDEX IF NOT EXISTS idx_transfers_slot ON transfers(slot)",
-            ]
-
-            # Execute the indexes
-            for index_sql in transfers_indexes:
-                cursor.execute(index_sql)
+            # The unique index is already there since the table was created and the signatures, wallets and
+            # tokens are unique in their own tables
+            def create(cursor):
+                for index_sql in self.DISTRIBUTOR_INDEXES:
+                    cursor.execute(index_sql)
 
-            # Commit all changes
-            connection.commit()
+            self.write_distributor(distributor, create)
 
             print("Database indexes created successfully")
             return True
@@ -149,67 +286,214 @@ class SQLiteDB:
     #                DB Connection Management                #
     ##########################################################
     def get_distributors_db(self, distributor):
-        connection = sqlite3.connect(
-            f"backup/transfers/{distributor}.db"
-        )
+        """
+        Returns a read only connection and cursor for the distributors db, writes go through write_distributor
+        """
+        # Connections aren't shared between threads so every thread keeps its own transaction state
+        key = (distributor, threading.get_ident())
+
+        with self.distributor_connections_lock:
+            connection = self.distributor_connections.get(key)
+
+            if connection is not None:
+                self.distributor_connections.move_to_end(key)
+                self.connection_stats["hits"] += 1
+            else:
+                self.connection_stats["misses"] += 1
+                connection = self.open_distributor_connection(distributor)
+                self.distributor_connections[key] = connection
+                self.evict_distributor_connections()
+
+        return connection, connection.cursor()
+
+    def open_distributor_connection(self, distributor):
+        """
+        Opens a cached read only connection to the distributors db. A db that doesn't exist yet is created by
+        the writer first so it is already in WAL mode
+        """
+        path = self.get_distributor_db_path(distributor)
+        if not os.path.exists(path):
+            self.writer.execute(path, lambda cursor: None)
+
+        connection = self.open_reader(path)
+        self.connection_stats["opened"] += 1
+        return connection
+
+    @staticmethod
+    def open_reader(path):
+        """
+        Opens a read only connection and applies the connection pragmas once. It can be used and closed
+        from any thread
+        """
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
         cursor = connection.cursor()
+        cursor.execute("PRAGMA cache_size = -16000")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+
+        return connection
 
-        return connection, cursor
+    def write_distributor(self, distributor, write, rows=0):
+        """
+        Runs write(cursor) in a transaction on the distributors db in the writer thread and returns its result
+        once it is committed, in bulk load mode once it is part of the open bulk transaction
+        """
+        return self.writer.execute(self.get_distributor_db_path(distributor), write, rows)
+
+    def evict_distributor_connections(self):
+        """
+        Closes the least recently used connections until we are back at max_open, connections that are in
+        the middle of a transaction are skipped. Called with the connections lock held
+        """
+        for key in list(self.distributor_connections):
+            if len(self.distributor_connections) <= self.max_open:
+                return
+
+            connection = self.distributor_connections[key]
+            if connection.in_transaction:
+                continue
+
+            del self.distributor_connections[key]
+            connection.close()
+            self.connection_stats["evicted"] += 1
+            self.connection_stats["closed"] += 1
+
+    def get_connection_stats(self):
+        """
+        Returns the distributor connection cache stats, open is the number of connections open right now,
+        plus the number of writes and the transactions the writer grouped them in
+        """
+        with self.distributor_connections_lock:
+            lookups = self.connection_stats["hits"] + self.connection_stats["misses"]
+            return {
+                "open": len(self.distributor_connections),
+                "max_open": self.max_open,
+                **self.connection_stats,
+                "hit_rate": self.connection_stats["hits"] / lookups if lookups else 0.0,
+                **self.writer.get_stats(),
+            }
+
+    @staticmethod
+    def get_distributor_db_path(distributor):
+        """ Path to the distributors db file """
+        return f"backup/transfers/{distributor}.db"
 
     def close_connections(self):
         """Close all database connections"""
         try:
+            with self.distributor_connections_lock:
+                for connection in self.distributor_connections.values():
+                    connection.close()
+                    self.connection_stats["closed"] += 1
+                self.distributor_connections.clear()
+
             self.config_connection.close()
             self.temp_transfers_connection.close()
 
+            # Finishes the queued writes and commits any open bulk load. The writer closes last so it can
+            # checkpoint the WALs back into the dbs
+            self.writer.close()
+
         except Exception as e:
             print(f"Error closing connections")
 
     def close_distributor_connection(self, distributor):
-        connection, cursor = self.get_distributors_db(distributor)
-        try:
-            connection.close()
-        except Exception as e:
-            print(f"Error closing distributor: {distributor} connection: {e}")
+        """ Closes every cached connection to the distributors db """
+        with self.distributor_connections_lock:
+            keys = [key for key in self.distributor_connections if key[0] == distributor]
+
+            for key in keys:
+                connection = self.distributor_connections.pop(key)
+                try:
+                    connection.close()
+                    self.connection_stats["closed"] += 1
+                except Exception as e:
+                    print(f"Error closing distributor: {distributor} connection: {e}")
+
+    ##########################################################
+    #                     Bulk Load Mode                     #
+    ##########################################################
+    def begin_bulk_load(self, distributor, commit_rows=100000, cache_mb=256):
+        """
+        Puts the distributors db in bulk load mode while a new project is initialized. The writer runs it with
+        synchronous OFF and a big page cache, secondary indexes are dropped until clean_and_remove_temp_data
+        builds them once, and writes are grouped into big transactions that commit every commit_rows rows.
+        The checkpoints are written in the same transactions so a crash only loses work that the checkpoints
+        haven't recorded yet
+        """
+        def drop_indexes(cursor):
+            # Every index on transfers except the unique one that drops duplicates on insert
+            cursor.execute(
+                """SELECT name FROM sqlite_master
+                   WHERE type = 'index' AND tbl_name = 'transfers' AND sql IS NOT NULL AND name != 'idx_transfers_unique'"""
+            )
+            for (index_name,) in cursor.fetchall():
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+                print(f"Dropped index {index_name} for the bulk load")
+
+        path = self.get_distributor_db_path(distributor)
+        self.writer.begin_bulk_load(path, commit_rows, cache_mb)
+        self.writer.execute(path, drop_indexes)
+        print(f"Started bulk load for {distributor}")
+
+    def flush_bulk_load(self, distributor):
+        """ Commits the pending bulk load transaction so the readers can see it """
+        self.writer.flush(self.get_distributor_db_path(distributor))
+
+    def end_bulk_load(self, distributor):
+        """ Commits what is pending and folds the WAL back into the db """
+        if self.writer.end_bulk_load(self.get_distributor_db_path(distributor)):
+            print(f"Finished bulk load for {distributor}")
 
     ##########################################################
     #                       DB Clean Up                      #
     ##########################################################
     def clean_and_remove_temp_data(self, distributor):
         """
-        This removes any duplicates from processing the transactions and removes them. Then it creates the
-        indexes for the transfer table within the distributors db. Finally it drops the temp tables
+        This creates the indexes for the transfer table within the distributors db and then drops the temp
+        tables. Duplicates never make it into the transfers table so there is nothing to clean up first.
+        When the db was bulk loaded this is the one index build, then ANALYZE updates the query planner
+        stats and the bulk load is ended
         """
-        # Delete any duplicates
-        success = self.create_distributor_indexes(distributor)
+        try:
+            # Create the indexes
+            success = self.create_distributor_indexes(distributor)
 
-        if success is not True:
-            return False
+            if success is not True:
+                return False
 
-        # Drop the temp tables since we don't need them anymore
-        sucess = self.drop_temp_tables(distributor)
+            # Drop the temp tables since we don't need them anymore
+            sucess = self.drop_temp_tables(distributor)
 
-        if sucess is not True:
-            return False
+            if sucess is not True:
+                return False
 
-        return True
+            # Fresh stats now that the table and indexes are complete
+            self.write_distributor(distributor, lambda cursor: cursor.execute("ANALYZE"))
+
+            return True
+
+        finally:
+            self.end_bulk_load(distributor)
 
     def drop_temp_tables(self, distributor):
         """Drop temporary tables used for transaction processing."""
         # Tables to drop
         temp_tables = [
             'temp_transactions',
+            'temp_addresses',
             'temp_txs_last_sigs'
         ]
 
-        connection, cursor = self.get_distributors_db(distributor)
-
-        try:
+        def drop(cursor):
             for table in temp_tables:
                 cursor.execute(f"DROP TABLE IF EXISTS {table}")
                 print(f"Dropped table: {table}")
 
-            connection.commit()
+            self.address_books.pop(distributor, None)
+
+        try:
+            self.write_distributor(distributor, drop)
             return True
         except Exception as e:
             print(f"Error dropping table: {e}")
@@ -293,27 +577,27 @@ class SQLiteDB:
         Update an existing supported project by distributor
         """
         try:
-            self.config_cursor.execute(
-                """UPDATE supported_projects
-                SET name = ?, token_mint = ?, dev_wallet = ?, last_sig = ?
-                WHERE distributor = ?""",
-                (
-                    updated_project.get("name"),
-                    updated_project.get("token_mint"),
-                    updated_project.get("dev_wallet", ""),
-                    updated_project.get("last_sig", ""),
-                    updated_project.get("distributor")
-                )
+            self.writer.execute(
+                self.CONFIG_DB_PATH,
+                lambda cursor: cursor.execute(
+                    """UPDATE supported_projects
+                    SET name = ?, token_mint = ?, dev_wallet = ?, last_sig = ?
+                    WHERE distributor = ?""",
+                    (
+                        updated_project.get("name"),
+                        updated_project.get("token_mint"),
+                        updated_project.get("dev_wallet", ""),
+                        updated_project.get("last_sig", ""),
+                        updated_project.get("distributor")
+                    )
+                ),
             )
 
-            self.config_connection.commit()
-
             print(f"Successfully updated supported project: {updated_project.get('name')}")
             return True
 
         except Exception as e:
             print(f"Error updating supported project: {e}")
-            self.config_connection.rollback()
             raise
 
     def insert_supported_project(self, project):
@@ -321,18 +605,20 @@ class SQLiteDB:
         Insert a supported project into the supported_projects table
         """
         try:
-            self.config_cursor.execute(
-                """INSERT INTO supported_projects (name, distributor, token_mint, dev_wallet, last_sig)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (
-                    project.get("name"),
-                    project.get("distributor"),
-                    project.get("token_mint"),
-                    project.get("dev_wallet", ""),
-                    project.get("last_sig", ""),
+            self.writer.execute(
+                self.CONFIG_DB_PATH,
+                lambda cursor: cursor.execute(
+                    """INSERT INTO supported_projects (name, distributor, token_mint, dev_wallet, last_sig)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (
+                        project.get("name"),
+                        project.get("distributor"),
+                        project.get("token_mint"),
+                        project.get("dev_wallet", ""),
+                        project.get("last_sig", ""),
+                    ),
                 ),
             )
-            self.config_connection.commit()
             print(
                 f"Successfully inserted supported project: {project.get('name')}"
             )
@@ -340,7 +626,6 @@ class SQLiteDB:
 
         except Exception as e:
             print(f"Error inserting supported project: {e}")
-            self.config_connection.rollback()
             raise
 
     def upsert_supported_project(self, project):
@@ -443,16 +728,18 @@ class SQLiteDB:
             return True
 
         try:
-            self.config_cursor.execute(
-                """INSERT INTO known_tokens (symbol, name, mint, decimals) VALUES (?, ?, ?, ?)""",
-                (
-                    token.get("symbol"),
-                    token.get("name"),
-                    token.get("mint"),
-                    token.get("decimals", ""),
+            self.writer.execute(
+                self.CONFIG_DB_PATH,
+                lambda cursor: cursor.execute(
+                    """INSERT INTO known_tokens (symbol, name, mint, decimals) VALUES (?, ?, ?, ?)""",
+                    (
+                        token.get("symbol"),
+                        token.get("name"),
+                        token.get("mint"),
+                        token.get("decimals", ""),
+                    ),
                 ),
             )
-            self.config_connection.commit()
             print(
                 f"Successfully inserted known token: {token.get('symbol')}"
             )
@@ -460,61 +747,106 @@ class SQLiteDB:
 
         except Exception as e:
             print(f"Error inserting known token: {e}")
-            self.config_connection.rollback()
             raise
 
     ##########################################################
     #                 Transactions Functions                 #
     ##########################################################
-    def get_transactions(self, distributor, offset, batch_size=1000):
+    def get_transactions(self, distributor, after_id=0, batch_size=1000):
         """
-        Generator that yields batches with resume capability.
+        Generator that yields batches of temp transactions with the id of the last row in the batch. Pages with
+        WHERE id > ? so every batch is a seek on the primary key, the last id is also the resume cursor.
         """
         connection, cursor = self.get_distributors_db(distributor)
+        addresses = AddressBook()
         try:
-            current_offset = offset
-            query = """SELECT fee_payer, signature, slot, timestamp, token_transfers, native_transfers
+            last_id = after_id or 0
+            query = """SELECT id, fee_payer, signature, slot, timestamp, token_transfers, native_transfers
                         FROM temp_transactions
+                        WHERE id > ?
                         ORDER BY id ASC
-                        LIMIT ? OFFSET ?"""
+                        LIMIT ?"""
 
             while True:
-                cursor.execute(query, (batch_size, current_offset))
+                cursor.execute(query, (last_id, batch_size))
                 results = cursor.fetchall()
 
                 if not results:
                     # No more data to process - successful completion
                     break
 
-                # Parse JSON strings back to Python objects
-                transactions = []
-                for row in results:
-                    tx = {
-                        "fee_payer": row[0],
-                        "signature": row[1],
-                        "slot": row[2],
-                        "timestamp": row[3],
-                        "token_transfers": json.loads(row[4]) if row[4] else [],
-                        "native_transfers": json.loads(row[5]) if row[5] else [],
-                    }
-                    transactions.append(tx)
+                last_id = results[-1][0]
 
-                # Yield the batch and current offset
-                yield transactions, current_offset
+                # Pick up the addresses written since the last batch
+                addresses.refresh(cursor)
 
-                current_offset += batch_size
+                # Yield the batch and the last id
+                yield self.decode_transaction_rows((row[1:] for row in results), addresses), last_id
 
         except Exception as e:
             print(f"Error retrieving temp transactions batch: {e}")
-            return None, current_offset
+            raise
+
+    def get_transaction_id_ranges(self, distributor, after_id=0, chunk_size=5000):
+        """
+        Generator that splits the temp transactions after after_id into (first_id, last_id) ranges of
+        chunk_size rows, used to hand out work to the process pool. Every lookup is fetched completely
+        so no read lock is held between ranges while the transfers are written
+        """
+        connection, cursor = self.get_distributors_db(distributor)
+        last_id = after_id or 0
+
+        while True:
+            # Last id of the next chunk, the rowid index makes this a short scan
+            cursor.execute(
+                """SELECT MIN(id), MAX(id) FROM (
+                       SELECT id FROM temp_transactions WHERE id > ? ORDER BY id ASC LIMIT ?
+                   )""",
+                (last_id, chunk_size),
+            )
+            first_id, range_end = cursor.fetchall()[0]
+
+            if first_id is None:
+                return
+
+            yield first_id, range_end
+            last_id = range_end
+
+    @staticmethod
+    def get_transactions_in_range(cursor, first_id, last_id, addresses=None):
+        """
+        Reads and decodes the temp transactions with ids between first_id and last_id. Takes a cursor so
+        process pool workers can use their own read only connection, and their own AddressBook so it
+        doesn't have to be read again for every range
+        """
+        cursor.execute(
+            """SELECT fee_payer, signature, slot, timestamp, token_transfers, native_transfers
+               FROM temp_transactions
+               WHERE id BETWEEN ? AND ?
+               ORDER BY id ASC""",
+            (first_id, last_id),
+        )
+        rows = cursor.fetchall()
+
+        addresses = addresses or AddressBook()
+        addresses.refresh(cursor)
+
+        return SQLiteDB.decode_transaction_rows(rows, addresses)
+
+    @staticmethod
+    def decode_transaction_rows(rows, addresses=None):
+        """
+        Wraps temp transaction rows in TempTransaction, the transfer payloads are decoded when they are read
+        """
+        return [TempTransaction(*row, addresses) for row in rows]
 
-    def get_transactions_count(self, distributor):
+    def get_transactions_count(self, distributor, after_id=0):
         """
-        Get the total count of temporary transactions in the temp_transactions table
+        Get the count of temporary transactions in the temp_transactions table after an id
         """
         connection, cursor = self.get_distributors_db(distributor)
         try:
-            cursor.execute("SELECT COUNT(*) FROM temp_transactions")
+            cursor.execute("SELECT COUNT(*) FROM temp_transactions WHERE id > ?", (after_id or 0,))
             result = cursor.fetchone()
             return result[0] if result else 0
 
@@ -522,24 +854,53 @@ class SQLiteDB:
             print(f"Error getting temp transactions count: {e}")
             return 0
 
-    def insert_transactions_batch(self, distributor, batch, batch_size=5000):
+    def get_address_book(self, distributor):
         """
-        Insert a batch of temporary transactions into the temp_transactions table.
-        Optimized for performance with larger batch sizes and better SQLite settings.
+        The writers AddressBook for the distributors temp_addresses, only called in the writer thread. It is
+        dropped whenever the writer rolls back a transaction on the db, the ids it handed out since the last
+        commit are gone then and the next book reads the ones that are left from the table
         """
-        if not batch:
-            return True
+        addresses = self.address_books.get(distributor)
 
-        connection, cursor = self.get_distributors_db(distributor)
+        if addresses is None:
+            addresses = self.address_books[distributor] = AddressBook()
+            self.writer.on_rollback(
+                self.get_distributor_db_path(distributor), lambda: self.address_books.pop(distributor, None)
+            )
 
-        try:
-            # Set SQLite performance optimizations
-            cursor.execute("PRAGMA journal_mode = MEMORY")
-            cursor.execute("PRAGMA cache_size = 10000")
+        return addresses
 
-            # Begin explicit transaction
-            cursor.execute("BEGIN TRANSACTION")
+    def insert_transactions_batch(self, distributor, batch, batch_size=5000, page_cursor=None):
+        """
+        Insert a batch of temporary transactions into the temp_transactions table.
+        Optimized for performance with larger batch sizes, use begin_bulk_load for the SQLite settings.
+        When a page_cursor is passed the fetch_txs checkpoint is saved in the same transaction.
+        The transfers are stored in the TEMP_TX_ENCODING/TEMP_TX_COMPRESSION format
+        """
+        encoding, compression = self.payload_encoding, self.payload_compression
+
+        if not batch:
+            return True
 
+        # One transaction for the whole batch, in bulk load mode it joins the open bulk transaction
+        def write(cursor):
+            # The struct payloads point at the addresses in temp_addresses
+            addresses = self.get_address_book(distributor) if encoding == "struct" else None
+
+            def encode(transfers):
+                if addresses is not None:
+                    addresses.get_ids(cursor, transfers)
+                return encode_transfers(transfers, encoding, compression, addresses)
+
+            try:
+                insert_chunks(cursor, encode)
+            except Exception:
+                # The new address ids were rolled back with the write
+                if addresses is not None:
+                    addresses.reset()
+                raise
+
+        def insert_chunks(cursor, encode):
             # Process in larger batches
             for i in range(0, len(batch), batch_size):
                 batch_chunk = batch[i : i + batch_size]
@@ -551,8 +912,8 @@ class SQLiteDB:
                         tx.get("signature", ""),
                         tx.get("slot", 0),
                         tx.get("timestamp", 0),
-                        json.dumps(tx.get("token_transfers", [])),
-                        json.dumps(tx.get("native_transfers", [])),
+                        encode(tx.get("token_transfers")),
+                        encode(tx.get("native_transfers")),
                     )
                     for tx in batch_chunk
                 ]
@@ -565,306 +926,410 @@ class SQLiteDB:
                     data_to_insert,
                 )
 
-            # Commit the entire transaction at once
-            self.distributor_connection.commit()
-            # print(f"Successfully inserted {len(batch)} temporary transactions")
+            if page_cursor is not None:
+                self.write_init_checkpoint(cursor, "fetch_txs", page_cursor=page_cursor)
+
+        try:
+            self.write_distributor(distributor, write, rows=len(batch))
             return True
 
         except Exception as e:
             print(f"Error inserting temp transactions batch: {e}")
-            self.distributor_connection.rollback()
             return False
 
     ##########################################################
     #                    Transfer Functions                  #
     ##########################################################
-    def get_transfers(self, distributor, offset, batch_size=1000):
+    def get_transfers(self, distributor, after_id=0, batch_size=1000):
         """
-        Generator that yields batches with resume capability.
+        Generator that yields batches of transfers with the id of the last row in the batch. Pages with
+        WHERE id > ? so every batch is a seek on the primary key, the last id is also the resume cursor.
         """
         connection, cursor = self.get_distributors_db(distributor)
 
         try:
-            current_offset = offset
-            query = """SELECT signature, slot, timestamp, amount, token, wallet_address, distributor
-                        FROM transfers
-                        ORDER BY id ASC
-                        LIMIT ? OFFSET ?"""
+            last_id = after_id or 0
+            query = """SELECT t.id, x.signature, x.slot, x.timestamp, t.amount, k.token, w.address
+                        FROM transfers t
+                        JOIN txs x ON x.id = t.tx_id
+                        JOIN wallets w ON w.id = t.wallet_id
+                        JOIN tokens k ON k.id = t.token_id
+                        WHERE t.id > ?
+                        ORDER BY t.id ASC
+                        LIMIT ?"""
 
             while True:
-                cursor.execute(query, (batch_size, current_offset))
+                cursor.execute(query, (last_id, batch_size))
                 results = cursor.fetchall()
 
                 if not results:
                     # No more data to process - successful completion
                     break
 
-                # Parse JSON strings back to Python objects
+                last_id = results[-1][0]
+
                 transfers = []
                 for row in results:
                     tx = {
-                        "signature": row[0],
-                        "slot": row[1],
-                        "timestamp": row[2],
-                        "amount": row[3],
-                        "token": row[4],
-                        "wallet_address": row[5],
-                        "distributor": row[6]
+                        "signature": row[1],
+                        "slot": row[2],
+                        "timestamp": row[3],
+                        "amount": row[4],
+                        "token": row[5],
+                        "wallet_address": row[6],
+                        "distributor": distributor
                     }
                     transfers.append(tx)
 
-                # Yield the batch and current offset
-                yield transfers, current_offset
-
-                current_offset += batch_size
+                # Yield the batch and the last id
+                yield transfers, last_id
 
         except Exception as e:
-            print(f"Error retrieving temp transactions batch: {e}")
-            return None, current_offset
+            print(f"Error retrieving transfers batch: {e}")
+            raise
 
-    def get_transfers_count(self, distributor):
+    def get_transfer_columns(self, distributor, after_id=0, batch_size=50000):
         """
-        Get the total count of temporary transfers in the transfers table
+        Generator that yields batches of transfers as columns (wallets, distributor, tokens, amounts) for the
+        vectorized aggregation. Only the columns needed for the totals are read and no per row dicts are built
         """
         connection, cursor = self.get_distributors_db(distributor)
+
         try:
-            cursor.execute("SELECT COUNT(*) FROM transfers")
-            result = cursor.fetchone()
-            return result[0] if result else 0
+            last_id = after_id or 0
+            query = """SELECT t.id, w.address, t.token_id, t.amount
+                        FROM transfers t
+                        JOIN wallets w ON w.id = t.wallet_id
+                        WHERE t.id > ?
+                        ORDER BY t.id ASC
+                        LIMIT ?"""
+
+            while True:
+                cursor.execute(query, (last_id, batch_size))
+                results = cursor.fetchall()
+
+                if not results:
+                    break
+
+                # Transpose the rows into columns, the first one is the ids
+                ids, wallet_column, token_ids, amount_column = zip(*results)
+                last_id = ids[-1]
+
+                # There are only a few tokens so they are swapped in here instead of joined on every row, and the
+                # distributor isn't stored since every row in the db has the same one
+                tokens = self.get_tokens(cursor)
+                columns = (wallet_column, distributor, [tokens[i] for i in token_ids], amount_column)
+
+                # Yield the columns, the last id and number of rows
+                yield columns, last_id, len(results)
 
         except Exception as e:
-            print(f"Error getting transfers count for {distributor}: {e}")
-            return 0
+            print(f"Error retrieving transfer columns batch: {e}")
+            raise
 
-    def insert_transfer_batch(self, distributor, batch, batch_size=5000):
+    def get_wallet_totals(self, distributor, lower=None, upper=None, start_after=None, batch_size=5000):
         """
-        Insert a batch of transfers into the transfers table of the distributor db. This will
-        be used to store the transfers by distributor from the transfers in the config db transfers table
+        Generator that sums the transfers by wallet and token inside SQLite and yields batches of
+        (wallet_address, token, total_amount) rows ordered by wallet. lower/upper limit the wallets to a
+        shard and start_after resumes after a wallet. Batches always end on a wallet boundary so the last
+        wallet in a batch can be saved as the resume point
         """
         connection, cursor = self.get_distributors_db(distributor)
 
         try:
-            # Process in batches to avoid memory issues with large datasets
-            for i in range(0, len(batch), batch_size):
-                batch_chunk = batch[i : i + batch_size]
-
-                # Prepare data for insertion
-                data_to_insert = []
-                for transfer in batch_chunk:
-                    data_to_insert.append(
-                        (
-                            transfer.get("signature", ""),
-                            transfer.get("slot", 0),
-                            transfer.get("timestamp", 0),
-                            transfer.get("amount", 0.0),
-                            transfer.get("token", ""),
-                            transfer.get("wallet_address", ""),
-                            transfer.get("distributor", ""),
-                        )
-                    )
+            limit = batch_size
 
-                # Insert batch
-                cursor.executemany(
-                    """INSERT INTO transfers
-                       (signature, slot, timestamp, amount, token, wallet_address, distributor)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    data_to_insert,
+            while True:
+                conditions = []
+                params = []
+                if lower is not None:
+                    conditions.append("w.address >= ?")
+                    params.append(lower)
+                if upper is not None:
+                    conditions.append("w.address < ?")
+                    params.append(upper)
+                if start_after is not None:
+                    conditions.append("w.address > ?")
+                    params.append(start_after)
+
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+                # Walks the wallets in address order and seeks idx_transfers_wallet_token for each one, so each
+                # page is a seek and one pass over the index with no sort. Every page is its own query so no
+                # read lock is held while the caller writes
+                cursor.execute(
+                    f"""SELECT w.address, t.token_id, SUM(t.amount)
+                        FROM wallets w
+                        JOIN transfers t ON t.wallet_id = w.id
+                        {where}
+                        GROUP BY w.address, t.token_id
+                        ORDER BY w.address, t.token_id
+                        LIMIT ?""",
+                    params + [limit],
                 )
+                results = cursor.fetchall()
 
-            connection.commit()
-            # print(f"Successfully inserted {len(batch)} transfers")
-            return True
+                # Token names are swapped in for the ids on the grouped rows
+                tokens = self.get_tokens(cursor)
+                results = [(wallet, tokens[token_id], total) for wallet, token_id, total in results]
+
+                if not results:
+                    break
+
+                # Last page, everything left is complete
+                if len(results) < limit:
+                    yield results
+                    break
+
+                # Hold back the last wallet since the rest of its tokens can be on the next page
+                last_wallet = results[-1][0]
+                cut = len(results)
+                while cut and results[cut - 1][0] == last_wallet:
+                    cut -= 1
+
+                # A single wallet filled the page, fetch a bigger one
+                if cut == 0:
+                    limit *= 2
+                    continue
+
+                yield results[:cut]
+                start_after = results[cut - 1][0]
+                limit = batch_size
 
         except Exception as e:
-            print(f"Error inserting transfer batch: {e}")
-            connection.rollback()
-            return False
+            print(f"Error retrieving wallet totals: {e}")
+            raise
 
-    def delete_duplicate_transfers(self, distributor):
+    @staticmethod
+    def get_tokens(cursor):
+        """ The tokens table of a distributors db as {id: token} """
+        cursor.execute("SELECT id, token FROM tokens")
+        return dict(cursor.fetchall())
+
+    def create_wallet_totals_index(self, distributor):
         """
-        Delete duplicate records from the transfers table based on the unique constraint
-        (wallet_address, distributor, signature, slot, timestamp, token, amount)
+        Covering index for get_wallet_totals so the GROUP BY never has to touch the table or sort
+        """
+        self.write_distributor(
+            distributor,
+            lambda cursor: cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transfers_wallet_token ON transfers(wallet_id, token_id, amount)"
+            ),
+        )
+
+    def get_transfers_count(self, distributor, after_id=0):
+        """
+        Get the count of transfers in the transfers table after an id
         """
         connection, cursor = self.get_distributors_db(distributor)
         try:
-            # First, let's check if there are duplicates
-            cursor.execute("""
-                SELECT wallet_address, distributor, signature, slot, timestamp, token, amount, COUNT(*) as count
-                FROM transfers
-                GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
-                HAVING COUNT(*) > 1
-            """)
+            cursor.execute("SELECT COUNT(*) FROM transfers WHERE id > ?", (after_id or 0,))
+            result = cursor.fetchone()
+            return result[0] if result else 0
 
-            duplicates = cursor.fetchall()
+        except Exception as e:
+            print(f"Error getting transfers count for {distributor}: {e}")
+            return 0
 
-            if not duplicates:
-                print("No duplicates found in transfers table")
-                return True
+    def insert_transfer_batch(self, distributor, batch, row_cursor=None):
+        """
+        Insert a TransferBatch into the transfers table of the distributor db. This will
+        be used to store the transfers by distributor from the transfers in the config db transfers table.
+        When a row_cursor is passed the process_txs checkpoint is saved in the same transaction.
+        Transfers already in the table are skipped by the unique index so re-running a batch is safe.
+        Returns the inserted and skipped counts, or False if the batch couldn't be saved
+        """
+        def write(cursor):
+            # Ids for the transactions, wallets and tokens of the batch, new ones are added
+            tx_ids = self.get_ids(
+                cursor,
+                "txs",
+                "signature",
+                batch.signatures,
+                "INSERT OR IGNORE INTO txs (signature, slot, timestamp) VALUES (?, ?, ?)",
+                zip(batch.signatures, batch.slots, batch.timestamps),
+            )
+            wallet_ids = self.get_ids(cursor, "wallets", "address", batch.wallets)
+            token_ids = self.get_ids(cursor, "tokens", "token", [token or "" for token in batch.tokens])
 
-            print(f"Found {len(duplicates)} groups of duplicate records")
+            signatures = batch.signatures
+            cursor.executemany(
+                """INSERT OR IGNORE INTO transfers (tx_id, wallet_id, token_id, amount) VALUES (?, ?, ?, ?)""",
+                (
+                    (tx_ids[signatures[tx]], wallet_ids[wallet], token_ids[token or ""], amount)
+                    for tx, wallet, token, amount in zip(batch.tx_index, batch.wallets, batch.tokens, batch.amounts)
+                ),
+            )
+            inserted = cursor.rowcount
 
-            # Delete duplicates, keeping only the first occurrence (lowest id)
-            cursor.execute("""
-                DELETE FROM transfers
-                WHERE id NOT IN (
-                    SELECT MIN(id)
-                    FROM transfers
-                    GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
-                )
-            """)
+            if row_cursor is not None:
+                self.write_init_checkpoint(cursor, "process_txs", row_cursor=row_cursor)
 
-            deleted_count = cursor.rowcount
-            connection.commit()
+            return inserted
 
-            print(f"Successfully deleted {deleted_count} duplicate records from transfers table")
-            return True
+        try:
+            inserted = self.write_distributor(distributor, write, rows=len(batch))
+            return {"inserted": inserted, "skipped": len(batch) - inserted}
 
         except Exception as e:
-            print(f"Error deleting duplicates: {e}")
-            connection.rollback()
+            print(f"Error inserting transfer batch: {e}")
             return False
 
+    @staticmethod
+    def get_ids(cursor, table, column, values, insert=None, rows=None):
+        """
+        Returns {value: id} for the values from one of the wallets, tokens or txs tables of a distributors db,
+        values that aren't there yet are added first. insert and rows are for tables with more columns than
+        the value, the default insert only sets the value
+        """
+        values = list(dict.fromkeys(values))
+
+        cursor.executemany(
+            insert or f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)",
+            rows if rows is not None else ((value,) for value in values),
+        )
+
+        # Looked up in chunks to stay under the SQLite variable limit
+        ids = {}
+        for i in range(0, len(values), 500):
+            chunk = values[i : i + 500]
+            cursor.execute(
+                f"SELECT {column}, id FROM {table} WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            ids.update(cursor.fetchall())
+
+        return ids
+
+    @staticmethod
+    def delete_duplicates(cursor):
+        """
+        Delete duplicate records from the temp transfers table based on the unique constraint
+        (wallet_address, distributor, signature, slot, timestamp, token, amount)
+        """
+        # First, let's check if there are duplicates
+        cursor.execute("""
+            SELECT wallet_address, distributor, signature, slot, timestamp, token, amount, COUNT(*) as count
+            FROM transfers
+            GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
+            HAVING COUNT(*) > 1
+        """)
+
+        duplicates = cursor.fetchall()
+
+        if not duplicates:
+            print("No duplicates found in transfers table")
+            return
+
+        print(f"Found {len(duplicates)} groups of duplicate records")
+
+        # Delete duplicates, keeping only the first occurrence (lowest id)
+        cursor.execute("""
+            DELETE FROM transfers
+            WHERE id NOT IN (
+                SELECT MIN(id)
+                FROM transfers
+                GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
+            )
+        """)
+
+        print(f"Successfully deleted {cursor.rowcount} duplicate records from transfers table")
+
     ##########################################################
     #                 Temp Transfer Functions                #
     ##########################################################
-    def get_temp_transfers(self, offset, batch_size=1000):
+    def get_temp_transfers(self, after_id=0, batch_size=1000):
         """
-        Generator that yields batches with resume capability.
+        Generator that yields batches of temp transfers with the id of the last row in the batch.
         """
         try:
-            current_offset = offset
-            query = """SELECT signature, slot, timestamp, amount, token, wallet_address, distributor
+            last_id = after_id or 0
+            query = """SELECT id, signature, slot, timestamp, amount, token, wallet_address, distributor
                         FROM transfers
+                        WHERE id > ?
                         ORDER BY id ASC
-                        LIMIT ? OFFSET ?"""
+                        LIMIT ?"""
 
             while True:
-                self.temp_transfers_cursor.execute(query, (batch_size, current_offset))
-                results = self.temp_transfers_cursor.fetchall()
+                with self.temp_transfers_lock:
+                    self.temp_transfers_cursor.execute(query, (last_id, batch_size))
+                    results = self.temp_transfers_cursor.fetchall()
 
                 if not results:
                     # No more data to process - successful completion
                     break
 
-                # Parse JSON strings back to Python objects
+                last_id = results[-1][0]
+
                 transfers = []
                 for row in results:
                     tx = {
-                        "signature": row[0],
-                        "slot": row[1],
-                        "timestamp": row[2],
-                        "amount": row[3],
-                        "token": row[4],
-                        "wallet_address": row[5],
-                        "distributor": row[6]
+                        "signature": row[1],
+                        "slot": row[2],
+                        "timestamp": row[3],
+                        "amount": row[4],
+                        "token": row[5],
+                        "wallet_address": row[6],
+                        "distributor": row[7]
                     }
                     transfers.append(tx)
 
-                # Yield the batch and current offset
-                yield transfers, current_offset
-
-                current_offset += batch_size
+                # Yield the batch and the last id
+                yield transfers, last_id
 
         except Exception as e:
             print(f"Error retrieving temp transactions batch: {e}")
-            return None, current_offset
+            return None, last_id
 
     def get_temp_transfers_count(self):
         """
         Get the total count of temporary transfers in the transfers table
         """
         try:
-            self.temp_transfers_cursor.execute("SELECT COUNT(*) FROM transfers")
-            result = self.temp_transfers_cursor.fetchone()
+            with self.temp_transfers_lock:
+                self.temp_transfers_cursor.execute("SELECT COUNT(*) FROM transfers")
+                result = self.temp_transfers_cursor.fetchone()
             return result[0] if result else 0
 
         except Exception as e:
             print(f"Error getting temp transactions count: {e}")
             return 0
 
-    def insert_temp_transfers_batch(self, batch, batch_size=5000):
+    def insert_temp_transfers_batch(self, batch):
         """
-        Insert a batch of temp transfers config db. Later this will be pulled and placed in
-        the proper db on the local backup. This table will store many distributors
+        Insert a TransferBatch into the temp transfers config db. Later this will be pulled and placed in
+        the proper db on the local backup. This table will store many distributors. Duplicates are skipped
+        and the inserted and skipped counts are returned, or False if the batch couldn't be saved
         """
-        try:
-            # Process in batches to avoid memory issues with large datasets
-            for i in range(0, len(batch), batch_size):
-                batch_chunk = batch[i : i + batch_size]
-
-                # Prepare data for insertion
-                data_to_insert = []
-                for transfer in batch_chunk:
-                    data_to_insert.append(
-                        (
-                            transfer.get("signature", ""),
-                            transfer.get("slot", 0),
-                            transfer.get("timestamp", 0),
-                            transfer.get("amount", 0.0),
-                            transfer.get("token", ""),
-                            transfer.get("wallet_address", ""),
-                            transfer.get("distributor", ""),
-                        )
-                    )
-
-                # Insert batch
-                self.temp_transfers_cursor_cursor.executemany(
-                    """INSERT INTO transfers
-                       (signature, slot, timestamp, amount, token, wallet_address, distributor)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    data_to_insert,
-                )
+        def write(cursor):
+            # The rows are streamed straight from the TransferBatch columns
+            cursor.executemany(
+                """INSERT OR IGNORE INTO transfers
+                   (signature, slot, timestamp, amount, token, wallet_address, distributor)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                batch.rows(),
+            )
+            return cursor.rowcount
 
-            self.temp_transfers_connection.commit()
-            # print(f"Successfully inserted {len(batch)} transfers")
-            return True
+        try:
+            # Batches from the polling threads that arrive together are committed together by the writer
+            inserted = self.writer.execute(self.TEMP_TRANSFERS_DB_PATH, write, rows=len(batch))
+            return {"inserted": inserted, "skipped": len(batch) - inserted}
 
         except Exception as e:
             print(f"Error inserting transfer batch: {e}")
-            self.temp_transfers_connection.rollback()
             return False
 
     def delete_duplicate_temp_transfers(self):
         """
-        Delete duplicate records from the transfers table based on the unique constraint
-        (wallet_address, distributor, signature, slot, timestamp, token, amount)
+        Delete duplicate records from the temp transfers table. Only needed once for tables created before
+        the unique index, new rows can't be duplicates
         """
         try:
-            # First, let's check if there are duplicates
-            self.temp_transfers_cursor.execute("""
-                SELECT wallet_address, distributor, signature, slot, timestamp, token, amount, COUNT(*) as count
-                FROM transfers
-                GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
-                HAVING COUNT(*) > 1
-            """)
-
-            duplicates = self.temp_transfers_cursor.fetchall()
-
-            if not duplicates:
-                print("No duplicates found in transfers table")
-                return True
-
-            print(f"Found {len(duplicates)} groups of duplicate records")
-
-            # Delete duplicates, keeping only the first occurrence (lowest id)
-            self.temp_transfers_cursor.execute("""
-                DELETE FROM transfers
-                WHERE id NOT IN (
-                    SELECT MIN(id)
-                    FROM transfers
-                    GROUP BY wallet_address, distributor, signature, slot, timestamp, token, amount
-                )
-            """)
-
-            deleted_count = cursor.rowcount
-            self.temp_transfers_connection.commit()
-
-            print(f"Successfully deleted {deleted_count} duplicate records from transfers table")
+            self.writer.execute(self.TEMP_TRANSFERS_DB_PATH, self.delete_duplicates)
             return True
 
         except Exception as e:
             print(f"Error deleting duplicates: {e}")
-            self.temp_transfers_connection.rollback()
             return False
 
     def delete_all_transfers(self):
@@ -877,50 +1342,192 @@ class SQLiteDB:
     ##########################################################
     #                     Wallets Functions                  #
     ##########################################################
-    def get_wallets(self):
-        pass
+    def get_wallets(self, after=None, batch_size=1000):
+        """
+        Generator that yields batches of wallets in the same shape as the wallets collection documents, ordered
+        by wallet address. Pages on the wallet address so after can be used to resume
+        """
+        cursor = self.config_connection.cursor()
+
+        try:
+            while True:
+                cursor.execute(
+                    """SELECT DISTINCT wallet_address FROM wallets WHERE wallet_address > ?
+                       ORDER BY wallet_address ASC LIMIT ?""",
+                    (after or "", batch_size),
+                )
+                addresses = [row[0] for row in cursor.fetchall()]
+
+                if not addresses:
+                    break
+
+                cursor.execute(
+                    """SELECT wallet_address, distributor, token, total_amount FROM wallets
+                       WHERE wallet_address BETWEEN ? AND ?
+                       ORDER BY wallet_address ASC""",
+                    (addresses[0], addresses[-1]),
+                )
+                yield list(self.rows_to_wallets(cursor.fetchall()).values())
+
+                after = addresses[-1]
+
+        except Exception as e:
+            print(f"Error getting wallets: {e}")
+            raise
 
     def get_wallet_data(self, wallet_address):
-        pass
+        """
+        Gets a wallet with the totals for all of its distributors and tokens, the same as the document in the
+        wallets collection. Returns None for wallets that haven't received anything
+        """
+        try:
+            # Own cursor since this is called from the API while the poller uses the config connection
+            cursor = self.config_connection.cursor()
+            cursor.execute(
+                """SELECT wallet_address, distributor, token, total_amount FROM wallets WHERE wallet_address = ?""",
+                (wallet_address,),
+            )
+            return self.rows_to_wallets(cursor.fetchall()).get(wallet_address)
 
-    def get_wallets_count(self):
-        pass
+        except Exception as e:
+            print(f"Error getting wallet {wallet_address}: {e}")
+            raise
 
-    def insert_wallet_batch(self, wallets, batch_size=1000):
+    def get_wallets_count(self):
         """
-        Insert or update wallet information in the wallets table
+        Gets the number of wallets with rewards
         """
         try:
-            for wallet in wallets_data:
-                wallet_address = wallet.get("wallet_address", "")
-                distributors = wallet.get("distributors", "")
+            cursor = self.config_connection.cursor()
+            cursor.execute("SELECT COUNT(DISTINCT wallet_address) FROM wallets")
+            result = cursor.fetchone()
+            return result[0] if result else 0
+
+        except Exception as e:
+            print(f"Error getting wallets count: {e}")
+            raise
+
+    @staticmethod
+    def rows_to_wallets(rows):
+        """
+        Turns (wallet_address, distributor, token, total_amount) rows into wallet documents by address
+        """
+        wallets = {}
+        for wallet_address, distributor, token, total_amount in rows:
+            wallet = wallets.setdefault(wallet_address, {"wallet_address": wallet_address, "distributors": {}})
+            tokens = wallet["distributors"].setdefault(distributor, {"tokens": {}})["tokens"]
+            tokens[token] = {"total_amount": total_amount}
+
+        return wallets
+
+    def apply_wallet_rewards(self, batches, batch_ids=None):
+        """
+        Adds RewardsBuffer batches to the wallet totals once. Batches in the reward_batches ledger are skipped
+        and the new ones are recorded in the same transaction as their increments. batch_ids limits it to the
+        batches MongoDB kept. Returns the number of wallets updated or False on error
+        """
+        if batch_ids is None:
+            batch_ids = list(batches)
+
+        now = int(time.time())
 
-                # Check if wallet already exists
-                self.config_cursor.execute(
-                    """SELECT id FROM wallets WHERE wallet_address = ?""",
-                    (wallet_address,),
+        def write(cursor):
+            # Batches in the ledger were applied by an earlier flush
+            applied = set()
+            for i in range(0, len(batch_ids), 500):
+                chunk = batch_ids[i : i + 500]
+                cursor.execute(
+                    f"SELECT batch_id FROM reward_batches WHERE batch_id IN ({','.join('?' * len(chunk))})", chunk
                 )
-                existing = self.config_cursor.fetchone()
+                applied.update(row[0] for row in cursor.fetchall())
 
-                if existing:
-                    # Update existing wallet
-                    self.config_cursor.execute(
-                        """UPDATE wallets SET distributors = ? WHERE wallet_address = ?""",
-                        (distributors, wallet_address),
-                    )
-                else:
-                    # Insert new wallet
-                    self.config_cursor.execute(
-                        """INSERT INTO wallets (wallet_address, distributors) VALUES (?, ?)""",
-                        (wallet_address, distributors),
-                    )
+            new_ids = [batch_id for batch_id in batch_ids if batch_id not in applied]
+
+            wallets = {}
+            for batch_id in new_ids:
+                merge_wallet_rewards(wallets, batches[batch_id]["wallets"])
+
+            cursor.executemany(
+                """INSERT INTO wallets (wallet_address, distributor, token, total_amount) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(wallet_address, distributor, token) DO UPDATE SET
+                       total_amount = total_amount + excluded.total_amount,
+                       updated_at = CURRENT_TIMESTAMP""",
+                (
+                    (wallet_address, distributor, token, token_data["total_amount"])
+                    for wallet_address, wallet_data in wallets.items()
+                    for distributor, distributor_data in wallet_data["distributors"].items()
+                    for token, token_data in distributor_data["tokens"].items()
+                ),
+            )
+            cursor.executemany(
+                "INSERT INTO reward_batches (batch_id, applied_at) VALUES (?, ?)",
+                ((batch_id, now) for batch_id in new_ids),
+            )
+
+            # Replays only come from the last few polls, the same window MongoDB keeps its ledger for
+            cursor.execute("DELETE FROM reward_batches WHERE applied_at < ?", (now - self.REWARD_BATCH_TTL,))
+
+            return len(wallets)
+
+        try:
+            return self.writer.execute(self.CONFIG_DB_PATH, write)
+
+        except Exception as e:
+            print(f"Error applying wallet reward batches: {e}")
+            return False
+
+    def insert_reward_batches(self, batch_ids, batch_size=10000):
+        """
+        Records batch ids as applied without touching the totals, used with insert_wallet_batch when the
+        totals are copied from MongoDB
+        """
+        now = int(time.time())
+
+        def write(chunk):
+            return lambda cursor: cursor.executemany(
+                "INSERT OR IGNORE INTO reward_batches (batch_id, applied_at) VALUES (?, ?)",
+                ((batch_id, now) for batch_id in chunk),
+            )
 
-            self.config_connection.commit()
-            print(f"Successfully processed {len(wallets_data)} wallets")
+        try:
+            for i in range(0, len(batch_ids), batch_size):
+                self.writer.execute(self.CONFIG_DB_PATH, write(batch_ids[i : i + batch_size]))
+            return True
+
+        except Exception as e:
+            print(f"Error inserting reward batches: {e}")
+            return False
+
+    def insert_wallet_batch(self, wallets, batch_size=1000):
+        """
+        Insert or update wallet documents from the wallets collection. The totals are set to the ones in the
+        documents, used to copy MongoDB into the local store
+        """
+        def write(rows):
+            return lambda cursor: cursor.executemany(
+                """INSERT INTO wallets (wallet_address, distributor, token, total_amount) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(wallet_address, distributor, token) DO UPDATE SET
+                       total_amount = excluded.total_amount,
+                       updated_at = CURRENT_TIMESTAMP""",
+                rows,
+            )
+
+        try:
+            for i in range(0, len(wallets), batch_size):
+                rows = [
+                    (wallet.get("wallet_address", ""), distributor, token, token_data.get("total_amount", 0))
+                    for wallet in wallets[i : i + batch_size]
+                    for distributor, distributor_data in (wallet.get("distributors") or {}).items()
+                    for token, token_data in (distributor_data.get("tokens") or {}).items()
+                ]
+                self.writer.execute(self.CONFIG_DB_PATH, write(rows))
+
+            print(f"Successfully processed {len(wallets)} wallets")
+            return True
 
         except Exception as e:
             print(f"Error inserting/updating wallets: {e}")
-            self.config_connection.rollback()
+            return False
 
     ##########################################################
     #                 Last Signature Functions               #
@@ -948,8 +1555,7 @@ class SQLiteDB:
         """
         Update the 'before' signature in temp_txs_last_sigs table.
         """
-        connection, cursor = self.get_distributors_db(distributor)
-        try:
+        def write(cursor):
             cursor.execute(
                 """UPDATE temp_txs_last_sigs SET before = ? WHERE id = 1""", (new_sig,)
             )
@@ -961,19 +1567,18 @@ class SQLiteDB:
                     (new_sig,),
                 )
 
-            connection.commit()
+        try:
+            self.write_distributor(distributor, write)
             return True
         except Exception as e:
             print(f"Error updating temp_txs before signature: {e}")
-            connection.rollback()
             return False
 
     def update_temp_txs_last_sig(self, distributor, new_sig):
         """
         Update the 'last_sig' signature in temp_txs_last_sigs table
         """
-        connection, cursor = self.get_distributors_db(distributor)
-        try:
+        def write(cursor):
             cursor.execute(
                 """UPDATE temp_txs_last_sigs SET last_sig = ? WHERE id = 1""",
                 (new_sig,),
@@ -986,13 +1591,81 @@ class SQLiteDB:
                     (new_sig,),
                 )
 
-            connection.commit()
+        try:
+            self.write_distributor(distributor, write)
             return True
         except Exception as e:
             print(f"Error updating temp_txs last signature: {e}")
-            connection.rollback()
             return False
 
+    ##########################################################
+    #               Initializer Checkpoint Functions         #
+    ##########################################################
+    def get_init_checkpoint(self, distributor, stage):
+        """
+        Get the saved checkpoint for an initializer stage
+        """
+        connection, cursor = self.get_distributors_db(distributor)
+        try:
+            cursor.execute(
+                """SELECT page_cursor, row_cursor, completed FROM init_checkpoints WHERE stage = ?""",
+                (stage,),
+            )
+            result = cursor.fetchone()
+
+            if result:
+                return {
+                    "stage": stage,
+                    "page_cursor": result[0],
+                    "row_cursor": result[1] or 0,
+                    "completed": bool(result[2]),
+                }
+            return {"stage": stage, "page_cursor": None, "row_cursor": 0, "completed": False}
+
+        except Exception as e:
+            print(f"Error getting init checkpoint for {stage}: {e}")
+            raise
+
+    def save_init_checkpoint(self, distributor, stage, page_cursor=None, row_cursor=None, completed=None):
+        """
+        Save the checkpoint for an initializer stage, values left as None are kept as they are. A completed
+        stage is always committed right away, even in bulk load mode, since the next stage reads with the
+        read only connections
+        """
+        try:
+            self.write_distributor(
+                distributor, lambda cursor: self.write_init_checkpoint(cursor, stage, page_cursor, row_cursor, completed)
+            )
+
+            if completed:
+                self.flush_bulk_load(distributor)
+            return True
+        except Exception as e:
+            print(f"Error saving init checkpoint for {stage}: {e}")
+            return False
+
+    def write_init_checkpoint(self, cursor, stage, page_cursor=None, row_cursor=None, completed=None):
+        """
+        Upserts a checkpoint row without committing so it can be part of a bigger transaction
+        """
+        cursor.execute(
+            """INSERT INTO init_checkpoints (stage, page_cursor, row_cursor, completed)
+               VALUES (?, ?, COALESCE(?, 0), COALESCE(?, 0))
+               ON CONFLICT(stage) DO UPDATE SET
+                   page_cursor = COALESCE(excluded.page_cursor, page_cursor),
+                   row_cursor = COALESCE(?, row_cursor),
+                   completed = COALESCE(?, completed),
+                   updated_at = CURRENT_TIMESTAMP""",
+            (
+                stage,
+                page_cursor,
+                row_cursor,
+                None if completed is None else int(completed),
+                row_cursor,
+                None if completed is None else int(completed),
+            ),
+        )
+
 if __name__ == "__main__":
     b = SQLiteDB("HHBkrmzwY7TbDG3G5C4D52LPPd8JEs5oiKWHaPxksqvd")
 
@@ -0,0 +1,309 @@
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SQLiteWriter:
+    """
+    Background thread that does every write to the SQLite dbs. Writes are queued as functions that get a cursor,
+    the thread takes everything that is waiting in the queue (up to max_batch writes) and runs the writes for
+    the same db in one transaction, each write in its own savepoint so a failed write only rolls back itself.
+    Callers block until their transaction is committed. With one writer per process and the dbs in WAL mode
+    the read only connections never wait on a write and the writes never see "database is locked"
+    """
+
+    def __init__(self, max_batch=256, max_open=64):
+        self.jobs = queue.Queue()
+        self.max_batch = max_batch
+        self.max_open = max_open
+
+        # Write connections by db path, only touched by the writer thread
+        self.connections = OrderedDict()
+
+        # Dbs in bulk load mode, their transaction stays open until commit_rows rows have been written. failed
+        # holds the error once that transaction had to be rolled back
+        self.bulk_loads = {}
+
+        # Called in the writer thread when the whole transaction for a db is rolled back, by path. For state
+        # kept next to the db, like the temp_addresses ids, that has to forget the uncommitted writes
+        self.rollback_callbacks = {}
+
+        self.stats = {"writes": 0, "failed_writes": 0, "transactions": 0}
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name="sqlite-writer", daemon=True)
+        self.thread.start()
+
+    ##########################################################
+    #                     Queueing Writes                    #
+    ##########################################################
+    def execute(self, path, write, rows=0):
+        """
+        Runs write(cursor) against the db at path in the writer thread and returns what it returned once the
+        transaction is committed, exceptions from the write are raised here. rows counts towards commit_rows
+        in bulk load mode
+        """
+        return self.submit(path, write, rows).result()
+
+    def submit(self, path, write, rows=0, transaction=True):
+        """
+        Queues a write and returns a Future for its result. Writes with transaction=False get the connection
+        instead of a cursor and run outside of any transaction, they are used for pragmas and WAL checkpoints
+        """
+        if self.closed:
+            raise RuntimeError("The SQLite writer has been closed")
+
+        future = Future()
+        self.jobs.put((path, write, rows, transaction, future))
+        return future
+
+    def close(self):
+        """ Finishes the queued writes, commits and closes the write connections and stops the thread """
+        if self.closed:
+            return
+
+        self.closed = True
+        self.jobs.put(None)
+        self.thread.join()
+
+    def on_rollback(self, path, callback):
+        """ Sets the function called in the writer thread whenever the open transaction for the db is rolled back """
+        self.rollback_callbacks[path] = callback
+
+    def get_stats(self):
+        """ Returns the number of writes and the transactions they were committed in """
+        return dict(self.stats)
+
+    ##########################################################
+    #                     Bulk Load Mode                     #
+    ##########################################################
+    def begin_bulk_load(self, path, commit_rows=100000, cache_mb=256):
+        """
+        Keeps the transaction for the db open until commit_rows rows have been written, with synchronous OFF
+        and a bigger page cache. The results of the writes are returned before they are committed, so if that
+        transaction is rolled back every write after it fails until end_bulk_load and the caller starts again
+        from what it last committed
+        """
+        def begin(connection):
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute(f"PRAGMA cache_size = {-cache_mb * 1024}")
+            self.bulk_loads[path] = {"commit_rows": commit_rows, "pending_rows": 0, "failed": None}
+
+        self.submit(path, begin, transaction=False).result()
+
+    def flush(self, path):
+        """
+        Commits the open bulk load transaction for the db, every non transaction write commits it first. Raises
+        if the bulk load was rolled back
+        """
+        self.submit(path, lambda connection: self.check_bulk_load(path), transaction=False).result()
+
+    def check_bulk_load(self, path):
+        """ Raises if the bulk load transaction for the db was rolled back since begin_bulk_load """
+        bulk = self.bulk_loads.get(path)
+        if bulk is not None and bulk["failed"] is not None:
+            raise RuntimeError(
+                f"The bulk load for {path} was rolled back ({bulk['failed']}), the writes since the last commit are lost"
+            )
+
+    def fail_bulk_load(self, path, error):
+        """ Marks the bulk load for the db as rolled back, the results of its uncommitted writes were already returned """
+        bulk = self.bulk_loads.get(path)
+        if bulk is not None:
+            bulk["failed"] = error
+            bulk["pending_rows"] = 0
+
+    def end_bulk_load(self, path):
+        """ Commits what is pending, folds the WAL back into the db and puts the connection settings back """
+        def end(connection):
+            bulk = self.bulk_loads.pop(path, None)
+            if bulk is None:
+                return False
+
+            if bulk["failed"] is not None:
+                print(f"Ending the bulk load for {path} that was rolled back: {bulk['failed']}")
+
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA cache_size = -16000")
+            return True
+
+        return self.submit(path, end, transaction=False).result()
+
+    ##########################################################
+    #                      Writer Thread                     #
+    ##########################################################
+    def run(self):
+        """ Takes the queued writes in batches until close is called """
+        stopping = False
+
+        while not stopping:
+            batch = [self.jobs.get()]
+
+            # Everything else that is already waiting goes in the same batch
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stopping = True
+                batch = [job for job in batch if job is not None]
+
+            self.run_batch(batch)
+
+        for path, connection in self.connections.items():
+            try:
+                if connection.in_transaction:
+                    connection.execute("COMMIT")
+                connection.close()
+            except Exception as e:
+                print(f"Error closing SQLite write connection for {path}: {e}")
+
+        self.connections.clear()
+
+    def run_batch(self, batch):
+        """
+        Runs a batch of writes. Transaction writes for a db share one transaction that is committed at the
+        end of the batch, or before a non transaction write for the same db
+        """
+        # Finished writes waiting on the commit of their db, by path
+        pending = {}
+
+        for path, write, rows, transaction, future in batch:
+            try:
+                connection = self.get_connection(path)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+
+            if not transaction:
+                self.commit(path, connection, pending)
+                try:
+                    future.set_result(write(connection))
+                except Exception as e:
+                    future.set_exception(e)
+                continue
+
+            self.stats["writes"] += 1
+
+            try:
+                # Nothing more goes into a bulk load that lost writes it already returned
+                self.check_bulk_load(path)
+                if not connection.in_transaction:
+                    connection.execute("BEGIN")
+                connection.execute("SAVEPOINT write")
+            except Exception as e:
+                self.stats["failed_writes"] += 1
+                future.set_exception(e)
+                continue
+
+            try:
+                result = write(connection.cursor())
+                connection.execute("RELEASE write")
+            except Exception as e:
+                self.stats["failed_writes"] += 1
+                future.set_exception(e)
+                self.rollback_write(path, connection, pending)
+                continue
+
+            pending.setdefault(path, []).append((future, result))
+
+            bulk = self.bulk_loads.get(path)
+            if bulk is not None:
+                bulk["pending_rows"] += rows
+
+        for path, futures in list(pending.items()):
+            bulk = self.bulk_loads.get(path)
+
+            # In bulk load mode the transaction stays open until enough rows are waiting
+            if bulk is not None and bulk["pending_rows"] < bulk["commit_rows"]:
+                for future, result in pending.pop(path):
+                    future.set_result(result)
+                continue
+
+            self.commit(path, self.connections[path], pending)
+
+    def rollback_write(self, path, connection, pending):
+        """
+        Rolls back the savepoint of a failed write. If that isn't possible the whole transaction is rolled back
+        and the other writes waiting on it fail too
+        """
+        try:
+            connection.execute("ROLLBACK TO write")
+            connection.execute("RELEASE write")
+        except Exception as e:
+            print(f"Error rolling back SQLite write for {path}, rolling back the transaction: {e}")
+            self.rollback_transaction(path, connection, e)
+            for future, result in pending.pop(path, []):
+                future.set_exception(e)
+
+    def commit(self, path, connection, pending):
+        """ Commits the open transaction for the db and returns the results of the writes that were in it """
+        futures = pending.pop(path, [])
+
+        try:
+            if connection.in_transaction:
+                connection.execute("COMMIT")
+                self.stats["transactions"] += 1
+
+            bulk = self.bulk_loads.get(path)
+            if bulk is not None:
+                bulk["pending_rows"] = 0
+
+        except Exception as e:
+            print(f"Error committing SQLite writes for {path}: {e}")
+            self.rollback_transaction(path, connection, e)
+            for future, result in futures:
+                future.set_exception(e)
+            return
+
+        for future, result in futures:
+            future.set_result(result)
+
+    def rollback_transaction(self, path, connection, error):
+        """ Rolls back the whole open transaction for the db and lets everything that depended on it know """
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+
+        self.fail_bulk_load(path, error)
+
+        callback = self.rollback_callbacks.get(path)
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error running the SQLite rollback callback for {path}: {e}")
+
+    def get_connection(self, path):
+        """
+        Returns the write connection for a db, new ones are put in WAL mode. The least recently used
+        connection is closed once more than max_open are open
+        """
+        connection = self.connections.get(path)
+
+        if connection is not None:
+            self.connections.move_to_end(path)
+            return connection
+
+        # Transactions are handled here so the connection is in autocommit mode
+        connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA cache_size = -16000")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        self.connections[path] = connection
+
+        for key in list(self.connections):
+            if len(self.connections) <= self.max_open:
+                break
+
+            if key == path or key in self.bulk_loads or self.connections[key].in_transaction:
+                continue
+
+            self.connections.pop(key).close()
+
+        return connection
@@ -0,0 +1,208 @@
+import json
+import struct
+import zlib
+
+# Optional encoders, the struct encoding and zlib are always there
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The first byte of a binary payload says how it was written, encoding in the high bits and compression in the low
+ENCODINGS = {"struct": 0x10, "msgpack": 0x20}
+COMPRESSIONS = {"none": 0x00, "zlib": 0x01, "zstd": 0x02}
+
+# Header of a struct payload, (row width, number of rows)
+HEADER = struct.Struct("<BI")
+
+# A native transfer row is (wallet id, amount) and a token transfer row adds the mint id
+ROW_FORMATS = {2: struct.Struct("<Id"), 3: struct.Struct("<IdI")}
+
+_zstd_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def get_payload_format(encoding, compression):
+    """
+    Checks the encoding and compression names and falls back to what is installed, json keeps the old
+    JSON text payloads
+    """
+    if encoding == "msgpack" and msgpack is None:
+        print("msgpack isn't installed, using the struct encoding for the temp transaction payloads")
+        encoding = "struct"
+
+    if compression == "zstd" and zstandard is None:
+        print("zstandard isn't installed, using zlib for the temp transaction payloads")
+        compression = "zlib"
+
+    if encoding != "json" and encoding not in ENCODINGS:
+        raise ValueError(f"Unknown temp transaction payload encoding: {encoding}")
+
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown temp transaction payload compression: {compression}")
+
+    return encoding, compression
+
+
+class AddressBook:
+    """
+    The wallet and mint addresses in the temp_addresses table of a distributors db by id. The struct payloads
+    store these ids instead of the 44 character addresses, a wallet that gets paid in thousands of
+    transactions is stored once. The writer keeps its own book since it sees its uncommitted ids
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.addresses = [None]
+
+    def refresh(self, cursor):
+        """ Reads the addresses added since the last refresh """
+        cursor.execute(
+            "SELECT id, address FROM temp_addresses WHERE id >= ? ORDER BY id ASC", (len(self.addresses),)
+        )
+        for address_id, address in cursor.fetchall():
+            self.addresses.append(address)
+            self.ids[address] = address_id
+
+    def get_ids(self, cursor, transfers):
+        """ Makes sure every address in the transfers has an id, new ones are added to temp_addresses """
+        if not transfers or isinstance(transfers[0], dict):
+            return
+
+        if len(self.addresses) == 1:
+            self.refresh(cursor)
+
+        for row in transfers:
+            for address in row[::2]:
+                if address not in self.ids:
+                    cursor.execute("INSERT INTO temp_addresses (address) VALUES (?)", (address,))
+                    self.ids[address] = cursor.lastrowid
+                    self.addresses.append(address)
+
+    def reset(self):
+        """ Forgets everything, used when a write is rolled back and its new ids with it """
+        self.ids = {}
+        self.addresses = [None]
+
+
+def encode_transfers(transfers, encoding="struct", compression="none", addresses=None):
+    """
+    Encodes a list of projected transfers, [wallet, amount] or [wallet, amount, mint] rows, for the temp
+    transactions table. The struct encoding needs the writers AddressBook with ids for every address in the
+    transfers. Empty lists are stored as NULL and transfers that haven't been projected are kept as JSON text
+    """
+    if not transfers:
+        return None
+
+    if encoding == "json" or isinstance(transfers[0], dict):
+        return json.dumps(transfers, separators=(",", ":"))
+
+    if encoding == "msgpack":
+        body = msgpack.packb(transfers)
+    else:
+        body = pack_transfers(transfers, addresses.ids)
+
+    if compression == "zlib":
+        body = zlib.compress(body, 1)
+    elif compression == "zstd":
+        body = _zstd_compressor.compress(body)
+
+    return bytes((ENCODINGS[encoding] | COMPRESSIONS[compression],)) + body
+
+
+def decode_transfers(payload, addresses=None):
+    """
+    Decodes a temp transactions payload back to the list of transfers, struct payloads need an AddressBook
+    that has been refreshed since they were written. Text payloads are the old JSON and may still hold the
+    full Helius objects
+    """
+    if not payload:
+        return []
+
+    if isinstance(payload, str):
+        return json.loads(payload)
+
+    tag = payload[0]
+    body = payload[1:]
+
+    compression = tag & 0x0F
+    if compression == COMPRESSIONS["zlib"]:
+        body = zlib.decompress(body)
+    elif compression == COMPRESSIONS["zstd"]:
+        body = _zstd_decompressor.decompress(body)
+
+    if tag & 0xF0 == ENCODINGS["msgpack"]:
+        return msgpack.unpackb(body)
+
+    return unpack_transfers(body, addresses.addresses)
+
+
+def pack_transfers(transfers, ids):
+    """ Fixed struct layout, a header and then a row of address ids and a double amount per transfer """
+    width = len(transfers[0])
+    row_format = ROW_FORMATS[width]
+
+    if width == 2:
+        rows = [row_format.pack(ids[wallet], amount or 0) for wallet, amount in transfers]
+    else:
+        rows = [row_format.pack(ids[wallet], amount or 0, ids[mint]) for wallet, amount, mint in transfers]
+
+    return HEADER.pack(width, len(rows)) + b"".join(rows)
+
+
+def unpack_transfers(body, addresses):
+    """ Reads the pack_transfers layout back to [wallet, amount] or [wallet, amount, mint] lists """
+    width, row_count = HEADER.unpack_from(body)
+    rows = ROW_FORMATS[width].iter_unpack(body[HEADER.size :])
+
+    if width == 2:
+        return [[addresses[wallet], amount] for wallet, amount in rows]
+
+    return [[addresses[wallet], amount, addresses[mint]] for wallet, amount, mint in rows]
+
+
+class TempTransaction:
+    """
+    A row of the temp transactions table. It is read like the transaction dicts (tx["signature"],
+    tx.get("native_transfers")) but the transfer payloads are only decoded the first time they are read
+    """
+
+    __slots__ = ("fee_payer", "signature", "slot", "timestamp", "_token_transfers", "_native_transfers", "_addresses")
+
+    PAYLOADS = {"token_transfers": "_token_transfers", "native_transfers": "_native_transfers"}
+
+    def __init__(self, fee_payer, signature, slot, timestamp, token_transfers, native_transfers, addresses=None):
+        self.fee_payer = fee_payer
+        self.signature = signature
+        self.slot = slot
+        self.timestamp = timestamp
+
+        # Raw payloads until they are decoded
+        self._token_transfers = token_transfers
+        self._native_transfers = native_transfers
+        self._addresses = addresses
+
+    def __getitem__(self, key):
+        payload = self.PAYLOADS.get(key)
+        if payload is None:
+            if key.startswith("_") or key not in self.__slots__:
+                raise KeyError(key)
+            return getattr(self, key)
+
+        value = getattr(self, payload)
+        if not isinstance(value, list):
+            value = decode_transfers(value, self._addresses)
+            setattr(self, payload, value)
+
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
@@ -5,12 +5,19 @@ CREATE TABLE IF NOT EXISTS temp_transactions(
     signature TEXT,
     slot INTEGER,
     timestamp INTEGER,
-    token_transfers TEXT,
-    native_transfers TEXT,
+    token_transfers BLOB,
+    native_transfers BLOB,
     created_at TEXT DEFAULT CURRENT_TIMESTAMP
 )
 """
 
+temp_addresses = """
+CREATE TABLE IF NOT EXISTS temp_addresses(
+    id INTEGER PRIMARY KEY,
+    address TEXT UNIQUE
+)
+"""
+
 temp_txs_last_sigs = """
 CREATE TABLE IF NOT EXISTS temp_txs_last_sigs(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -21,6 +28,16 @@ CREATE TABLE IF NOT EXISTS temp_txs_last_sigs(
 )
 """
 
+init_checkpoints = """
+CREATE TABLE IF NOT EXISTS init_checkpoints(
+    stage TEXT PRIMARY KEY,
+    page_cursor TEXT,
+    row_cursor INTEGER DEFAULT 0,
+    completed INTEGER DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
 transfers = """
 CREATE TABLE IF NOT EXISTS transfers(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,15 +52,75 @@ CREATE TABLE IF NOT EXISTS transfers(
 )
 """
 
-wallets = """
+# Natural key of a transfer, created with the transfers table so duplicates are ignored on insert
+transfers_unique_index = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transfers_unique
+ON transfers(wallet_address, distributor, signature, slot, timestamp, token, amount)
+"""
+
+# Distributor dbs store every wallet, token and transaction once and the transfers point at them by id.
+# The distributor isn't stored at all since every row in the file has the same one
+distributor_wallets = """
 CREATE TABLE IF NOT EXISTS wallets(
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    wallet_address TEXT NOT NULL,
-    distributors TEXT,
+    id INTEGER PRIMARY KEY,
+    address TEXT NOT NULL UNIQUE
+)
+"""
+
+distributor_tokens = """
+CREATE TABLE IF NOT EXISTS tokens(
+    id INTEGER PRIMARY KEY,
+    token TEXT NOT NULL UNIQUE
+)
+"""
+
+distributor_txs = """
+CREATE TABLE IF NOT EXISTS txs(
+    id INTEGER PRIMARY KEY,
+    signature TEXT NOT NULL UNIQUE,
+    slot INTEGER,
+    timestamp INTEGER,
     created_at TEXT DEFAULT CURRENT_TIMESTAMP
 )
 """
 
+distributor_transfers = """
+CREATE TABLE IF NOT EXISTS transfers(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tx_id INTEGER NOT NULL,
+    wallet_id INTEGER NOT NULL,
+    token_id INTEGER NOT NULL,
+    amount REAL
+)
+"""
+
+# Natural key of a distributor transfer, the transaction stands in for the signature, slot and timestamp
+distributor_transfers_unique_index = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transfers_unique
+ON transfers(tx_id, wallet_id, token_id, amount)
+"""
+
+# Reward totals of every wallet by distributor and token, the local copy of the wallets collection
+wallets = """
+CREATE TABLE IF NOT EXISTS wallets(
+    wallet_address TEXT NOT NULL,
+    distributor TEXT NOT NULL,
+    token TEXT NOT NULL,
+    total_amount REAL NOT NULL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (wallet_address, distributor, token)
+) WITHOUT ROWID
+"""
+
+# Reward batches already added to the wallet totals, written in the same transaction as their increments so
+# a batch that is applied again is skipped
+reward_batches = """
+CREATE TABLE IF NOT EXISTS reward_batches(
+    batch_id TEXT PRIMARY KEY,
+    applied_at INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
 supported_projects = """
 CREATE TABLE IF NOT EXISTS supported_projects(
     id INTEGER PRIMARY KEY AUTOINCREMENT,
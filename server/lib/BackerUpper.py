@@ -102,12 +102,31 @@ class BackerUpper:
             print(f"Could not backup transfers: {e}")
             raise
 
-    def backup_wallets(self, wallets):
+    def backup_wallets(self, wallets=None):
         """
-        Updates the locla SQLiteDB wallets with incoming wallets data from production
+        Updates the locla SQLiteDB wallets with incoming wallets data from production. Without a list of
+        wallets the whole wallets collection is copied in batches
         """
         try:
-            pass
+            print("Starting backup of wallets...")
+
+            batches = [wallets] if wallets is not None else self.mongo.get_rewards_wallet_batches()
+
+            total = 0
+            for batch in batches:
+                success = self.sqlite.insert_wallet_batch(batch)
+
+                if success is not True:
+                    return False
+
+                total += len(batch)
+
+            print(f"\nBackup Summary:")
+            print(f"- MongoDB Wallets: {total}")
+            print(f"- SQLiteDB Wallets: {self.sqlite.get_wallets_count()}")
+
+            return True
+
         except Exception as e:
             print(f"Could not backup wallets: {e}")
             return
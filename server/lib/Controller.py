@@ -2,12 +2,18 @@ import asyncio
 import requests
 import os
 import json
+import time
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 from dotenv import load_dotenv
 from db.MongoDB import MongoDB
 from db.SQLiteDB import SQLiteDB
-from utils.utils import process_distributor_transfers, aggregate_transfers, timer
-from utils.helius import get_token_metadata, get_new_distributor_transactions
+from db.RewardsBuffer import RewardsBuffer
+from utils.utils import process_distributor_transactions, process_distributor_transfers, aggregate_transfer_columns, get_batch_id, timer
+from utils.helius import get_new_distributor_transactions
+from utils.token_registry import TokenRegistry
+from utils.scheduler import PollScheduler
 
 load_dotenv()
 
@@ -15,74 +21,311 @@ class Controller:
 
     # TODO Need to add the sqlite databse to write transfers to
 
-    def __init__(self):
+    def __init__(self, max_workers=None):
         """Initialize the FetchData class with db instance and known_tokens list"""
-        self.db = self.get_db_instance()
+        self.db, self.sqlite_db = self.get_db_instance()
 
-        self.known_tokens = self.get_known_tokens_from_db()
+        # Max number of distributors polled at the same time
+        self.max_workers = max_workers or int(os.getenv("POLL_CONCURRENCY", 4))
 
-        # Create a dictionary for O(1) lookups
-        self.known_tokens_dict = {
-            str(token.get("mint")).lower(): token.get("symbol")
-            for token in self.known_tokens
-        }
+        # Resolves token mints to symbols, shared by all of the polling workers
+        self.token_registry = TokenRegistry(self.db)
+
+        print(f"Loaded {len(self.token_registry)} known tokens")
+
+        # Decides which distributors are due to be polled
+        self.scheduler = self.create_scheduler()
+
+        # Where /rewards reads from. "mongo", "sqlite" for the local wallet totals, or "standby" to read MongoDB
+        # and fall back to the local totals when it errors or takes longer than the timeout
+        self.rewards_source = os.getenv("REWARDS_SOURCE", "mongo")
+        if self.rewards_source not in ("mongo", "sqlite", "standby"):
+            print(f"Unknown REWARDS_SOURCE {self.rewards_source}, reading rewards from MongoDB")
+            self.rewards_source = "mongo"
+
+        self.rewards_timeout = int(os.getenv("REWARDS_STANDBY_TIMEOUT_MS", 500)) / 1000
+        self.rewards_executor = ThreadPoolExecutor(max_workers=4) if self.rewards_source == "standby" else None
+
+        # Merges the wallet reward increments of the polling workers and writes them every few seconds, a flush
+        # interval of 0 writes every batch right away
+        self.rewards_buffer = RewardsBuffer(
+            self.write_wallet_rewards,
+            max_pending=int(os.getenv("REWARDS_BUFFER_MAX_WALLETS", 10000)),
+            flush_interval=float(os.getenv("REWARDS_BUFFER_FLUSH_SECONDS", 5)),
+        )
 
-        # Cache for unknown tokens to avoid duplicate API calls
-        self.unknown_token_cache = {}
+        # The webhook and the poller can get the same transactions, a distributor is applied by one at a time
+        self.distributor_locks = {}
+        self.distributor_locks_lock = threading.Lock()
 
-        print(f"Loaded {len(self.known_tokens)} known tokens")
+    def create_scheduler(self):
+        """
+        Creates the poll scheduler. Distributors start at five minutes(300 seconds) and adapt to their activity.
+        When Helius webhooks push new transactions the polling only fills gaps so it starts at once an hour
+        """
+        if os.getenv("HELIUS_WEBHOOK_SECRET"):
+            base_interval = int(os.getenv("WEBHOOK_POLL_INTERVAL_SECONDS", 3600))
+        else:
+            base_interval = int(os.getenv("POLL_INTERVAL_SECONDS", 300))
+
+        return PollScheduler(
+            base_interval=base_interval,
+            min_interval=int(os.getenv("POLL_MIN_INTERVAL_SECONDS", base_interval // 5)),
+            max_interval=int(os.getenv("POLL_MAX_INTERVAL_SECONDS", base_interval * 6)),
+            request_budget=int(os.getenv("POLL_REQUEST_BUDGET", 200)),
+        )
 
     def begin_polling(self):
         """
-        Runs the update distributors function every five minutes(300 seconds) using the timer utility to check for new transactions
+        Checks for due distributors every tick using the timer utility and polls them for new transactions
+        """
+        tick = int(os.getenv("POLL_TICK_SECONDS", min(30, self.scheduler.min_interval)))
+
+        print(f"Checking for due distributors every {tick} seconds")
+        timer(self.run_scheduled_polls, tick)
+
+    def run_scheduled_polls(self):
+        """
+        Polls the distributors that are due and feeds the results back to the scheduler
+        """
+        projects = self.get_supported_projects_from_db() or []
+        self.scheduler.sync([project.get("distributor") for project in projects])
+
+        due = self.scheduler.get_due()
+        if not due:
+            return None
+
+        summary = self.update_distributors_transactions(due)
+
+        for result in summary["distributors"]:
+            self.scheduler.record(
+                result["distributor"], result["txs"], result["duration"], success=result["success"]
+            )
+
+        return summary
+
+    def get_poll_status(self):
+        """
+        Returns the current poll interval and lag for every distributor
+        """
+        return self.scheduler.get_status()
+
+    def close_connections(self):
+        """
+        Writes the buffered wallet rewards, closes the SQLite connections on shutdown and prints the rewards
+        buffer and distributor connection cache stats
+        """
+        self.rewards_buffer.close()
+        buffer_stats = self.rewards_buffer.get_stats()
+        print(
+            f"Wallet rewards buffer: {buffer_stats['added']} updates written as {buffer_stats['written']} "
+            f"({buffer_stats['coalescing_ratio']:.1f}x coalescing) in {buffer_stats['flushes']} flushes, "
+            f"{buffer_stats['avg_flush_ms']:.1f}ms avg flush, {buffer_stats['max_flush_ms']:.1f}ms max, "
+            f"{buffer_stats['replayed']} replayed batches dropped, {buffer_stats['pending']} left unwritten"
+        )
+
+        stats = self.sqlite_db.get_connection_stats()
+        print(
+            f"SQLite distributor connections: {stats['opened']} opened, {stats['evicted']} evicted, "
+            f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)"
+        )
+        if self.rewards_executor is not None:
+            self.rewards_executor.shutdown(wait=False)
+
+        self.sqlite_db.close_connections()
+
+    def sync_wallet_rewards(self):
+        """
+        Copies the wallets collection and the reward batch ledger into the local wallet totals when they are
+        empty, after that the totals are kept up to date as the rewards are aggregated
         """
-        timer(self.update_distributors_transactions, 300)
+        if self.sqlite_db.get_wallets_count():
+            return True
+
+        print("Local wallet totals are empty, copying them from MongoDB")
+        try:
+            copied = 0
+            for wallets in self.db.get_rewards_wallet_batches():
+                if self.sqlite_db.insert_wallet_batch(wallets) is not True:
+                    return False
+                copied += len(wallets)
+
+            # The batches in the copied totals are already applied
+            for batch_ids in self.db.get_reward_batch_ids():
+                if self.sqlite_db.insert_reward_batches(batch_ids) is not True:
+                    return False
+
+            print(f"Copied {copied} wallets to the local wallet totals")
+            return True
+
+        except Exception as e:
+            print(f"Error copying the wallets from MongoDB: {e}")
+            return False
 
     ##########################################################
     #           Get Recent Transactions for Projects         #
     ##########################################################
-    def update_distributors_transactions(self):
-        """This will loop through each supported project and get any new transfers"""
-        projects = self.get_supported_projects_from_db()
+    def update_distributors_transactions(self, distributors=None):
+        """
+        Polls the given distributors, or every supported project, for new transfers. Distributors are polled concurrently
+        by a bounded thread pool and a summary of each distributors duration and the total cycle time is printed
+        """
+        if distributors is None:
+            distributors = [project.get("distributor") for project in self.get_supported_projects_from_db() or []]
+
+        cycle_start = time.time()
+        summary = []
 
-        for project in projects:
-            distributor = project.get("distributor")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.poll_distributor, distributor): distributor
+                for distributor in distributors
+            }
 
-            self.fetch_and_process_new_distributor_transactions(distributor)
+            for future in as_completed(futures):
+                summary.append(future.result())
+
+        cycle_time = time.time() - cycle_start
+
+        # Print the cycle summary
+        print(f"Update complete. Polled {len(summary)} distributors in {cycle_time:.2f}s")
+        buffer_stats = self.rewards_buffer.get_stats()
+        print(
+            f"  Wallet rewards buffer: {buffer_stats['pending']} wallets pending, "
+            f"{buffer_stats['coalescing_ratio']:.1f}x coalescing, {buffer_stats['avg_flush_ms']:.1f}ms avg flush"
+        )
+        for result in sorted(summary, key=lambda r: r["duration"], reverse=True):
+            status = "ok" if result["success"] else "failed"
+            print(
+                f"  {result['distributor']}: {result['duration']:.2f}s "
+                f"txs: {result['txs']} transfers: {result['transfers']} ({status})"
+            )
 
-        print("Update complete")
+        return {"cycle_time": cycle_time, "distributors": summary}
+
+    def poll_distributor(self, distributor):
+        """
+        Runs the fetch for a single distributor and times it. Errors are caught here so one
+        distributor can't take down the rest of the cycle
+        """
+        start = time.time()
+        result = {"distributor": distributor, "txs": 0, "transfers": 0, "success": True}
+
+        try:
+            counts = self.fetch_and_process_new_distributor_transactions(distributor)
+            result.update(counts)
+        except Exception as e:
+            print(f"Error polling distributor {distributor}: {e}")
+            result["success"] = False
+
+        result["duration"] = time.time() - start
+        return result
 
     def fetch_and_process_new_distributor_transactions(self, distributor):
         """
-        Gets a list of transactions starting from last signature from the distributor_transfers collection
+        Gets a list of transactions starting from last signature from the distributor_transfers collection.
+        The new last signature is saved once the rewards of every batch have been written, so a poll that
+        fails or a crash before the flush fetches the same transactions again
         """
+        tx_count = 0
+        transfer_count = 0
 
         # Get the last tx signature so we can start from the at point
         last_sig = self.db.get_newest_tx_signature_for_distributor(distributor)
-        updated_sig = False
+        newest_sig = None
 
         # Get the all of the transactions starting from the last signature by calling the distributor_transfer_generator
         for transaction_batch in get_new_distributor_transactions(
             distributor, last_sig
         ):
 
-            # Save the new sig if we haven't already
-            if not updated_sig:
-                # Update the projects last signature
-                self.db.update_newest_tx_signature_for_distributor(
-                    distributor, transaction_batch.get("last_sig")
-                )
-                updated_sig = (
-                    True  # Set to true so we don't keep updating the same value
-                )
+            # The newest signature comes with the first batch
+            if newest_sig is None:
+                newest_sig = transaction_batch.get("last_sig")
+
+            counts = self.apply_distributor_transactions(distributor, transaction_batch.get("txs"))
+            tx_count += counts["txs"]
+            transfer_count += counts["transfers"]
+
+        # Only reached when the pages went all the way back to last_sig, a Helius error mid way raises out of
+        # the loop. Update the projects last signature after the buffered rewards are written
+        if newest_sig and newest_sig != last_sig:
+            self.rewards_buffer.add_callback(
+                lambda: self.db.update_newest_tx_signature_for_distributor(distributor, newest_sig)
+            )
+
+        return {"txs": tx_count, "transfers": transfer_count}
+
+    def ingest_webhook_transactions(self, transactions):
+        """
+        Applies the enhanced transactions pushed by a Helius webhook. Each transaction is matched to the
+        supported distributor that paid for or sent it, anything else is ignored
+        """
+        distributors = {project.get("distributor") for project in self.get_supported_projects_from_db() or []}
+
+        # Group the transactions by distributor
+        grouped = {}
+        for tx in transactions:
+            # Only transfers are picked up, the same as when polling
+            if tx.get("type", "TRANSFER") != "TRANSFER":
+                continue
+
+            senders = {tx.get("feePayer")}
+            senders.update(tf.get("fromUserAccount") for tf in tx.get("nativeTransfers") or [])
+            senders.update(tf.get("fromUserAccount") for tf in tx.get("tokenTransfers") or [])
+
+            for distributor in senders & distributors:
+                grouped.setdefault(distributor, []).append(tx)
+
+        result = {"received": len(transactions), "txs": 0, "skipped": 0, "transfers": 0}
+        for distributor, distributor_txs in grouped.items():
+            counts = self.apply_distributor_transactions(
+                distributor, process_distributor_transactions(distributor_txs)
+            )
+            result["txs"] += counts["txs"]
+            result["skipped"] += counts["skipped"]
+            result["transfers"] += counts["transfers"]
+
+        return result
+
+    def apply_distributor_transactions(self, distributor, transactions):
+        """
+        Extracts the transfers and updates the wallets for transactions that haven't been seen yet. Signatures
+        that are already applied or waiting in the rewards buffer are skipped, the ledger in MongoDB catches
+        the ones another writer applies in the meantime
+        """
+        with self.get_distributor_lock(distributor):
+            signatures = [tx.get("signature") for tx in transactions]
+            seen = self.db.get_processed_signatures(distributor, signatures)
+            seen |= self.rewards_buffer.get_pending_signatures(signatures)
+
+            new_transactions = []
+            for tx in transactions:
+                if tx.get("signature") not in seen:
+                    seen.add(tx.get("signature"))
+                    new_transactions.append(tx)
+
+            transfer_count = 0
 
             # Extract the transfers from the transactions and insert them into the db
             for transfer_batch in self.extract_transfers_from_distributor_transactions(
-                transaction_batch.get("txs"), distributor
+                new_transactions, distributor
             ):
 
                 # Update wallets with new rewards amounts
                 self.aggregate_rewards(transfer_batch)
+                transfer_count += len(transfer_batch)
+
+        return {
+            "txs": len(new_transactions),
+            "skipped": len(transactions) - len(new_transactions),
+            "transfers": transfer_count,
+        }
+
+    def get_distributor_lock(self, distributor):
+        """ Returns the lock for applying a distributors transactions """
+        with self.distributor_locks_lock:
+            return self.distributor_locks.setdefault(distributor, threading.Lock())
 
     def extract_transfers_from_distributor_transactions(
         self, transactions, distributor, batch_size=1000
@@ -98,12 +341,16 @@ class Controller:
             batch_num = (i // batch_size) + 1
 
             # Get the transfers
-            processed_batch = process_distributor_transfers(self, batch, distributor)
+            processed_batch = process_distributor_transfers(self.token_registry, batch, distributor)
 
-            # Insert into database and get what was actually inserted
-            success = self.sqlite_db.insert_temp_transfers_batch(
+            # Keep a local copy of the transfers for the backup
+            result = self.sqlite_db.insert_temp_transfers_batch(
                 processed_batch
             )
+            if result is False:
+                print(f"Failed to save transfer batch {batch_num} for {distributor} to the temp transfers db")
+            elif result["skipped"]:
+                print(f"Skipped {result['skipped']} duplicate transfers in batch {batch_num} for {distributor}")
 
             total_docs += len(processed_batch)
 
@@ -111,69 +358,43 @@ class Controller:
                 f"Transfer Batch {batch_num}/{total_batches}. Total Docs: {total_docs}"
             )
 
-            # Only yield the transfers that were actually inserted
-            yield inserted_docs
+            yield processed_batch
 
-    def aggregate_rewards(self, transfers, batch_size=1000):
+    def aggregate_rewards(self, transfer_batch):
         """
-        Given a list of project transfer transactions extract each transfer from native and token transfer lists and insert it into the DB
+        Adds up the rewards in a TransferBatch for each wallet and adds them to the rewards buffer, which
+        updates the wallets on MongoDB when it flushes. The batch id comes from the signatures in the batch
+        so the same transactions are only ever applied once. Returns the number of wallets in the batch
         """
-        total_inserted = 0
-        error_count = 0
-        total_batches = (len(transfers) + batch_size - 1) // batch_size
-
-        # Loop through each transaction and get the transfers from the native and token transfer lists
-        # then insert them into the DB
-        for i in range(0, len(transfers), batch_size):
-            batch = transfers[i : i + batch_size]
-            batch_num = (i // batch_size) + 1
-
-            aggregated_batch = aggregate_transfers(batch)
-            updated = self.db.insert_wallet_rewards(aggregated_batch)
-            total_inserted += updated
-
-    ##########################################################
-    #                          Helpers                       #
-    ##########################################################
-    def get_and_add_token_metadata(self, mint_address):
-        """
-        Fetches token metadata, adds it to the list of known tokens in DB, and returns the symbol of the token added
-        """
-        try:
-            # Make helius call to get the metadata
-            token_document = get_token_metadata(mint_address)
-
-            # Add it to the database
-            self.db.insert_known_token(token_document)
+        if not len(transfer_batch):
+            return 0
+
+        aggregated_batch = aggregate_transfer_columns(*transfer_batch.columns())
+        self.rewards_buffer.add(
+            get_batch_id(transfer_batch.distributor, transfer_batch.signatures),
+            aggregated_batch,
+            distributor=transfer_batch.distributor,
+            signatures=transfer_batch.signatures,
+        )
 
-            # Update our local caches
-            symbol = token_document["symbol"]
-            self.known_tokens_dict[mint_address.lower()] = symbol
-            return symbol
-        except Exception as e:
-            print(f"Error when trying to get_and_add_token_metadata {e}")
-            return token_document["symbol"]
+        return len(aggregated_batch)
 
-    def get_token_symbol(self, mint_address):
+    def write_wallet_rewards(self, batches):
         """
-        Checks if the mint address is in the known list of tokens, if it isn't then we get the token metadata and instert it into the DB
+        Writes a flush of the rewards buffer to MongoDB and the same batches to the local wallet totals. Both
+        keep a ledger of the batches they applied so a flush that is retried after either of them failed only
+        adds the batches that are missing
         """
-        # Normalize the mint
-        mint_lower = mint_address.lower()
-
-        # Check known tokens dictionary
-        if mint_lower in self.known_tokens_dict:
-            return self.known_tokens_dict[mint_lower]
+        result = self.db.apply_wallet_rewards(batches)
 
-        # Check unknown token cache to avoid duplicate API calls
-        if mint_lower in self.unknown_token_cache:
-            return self.unknown_token_cache[mint_lower]
+        # Batches MongoDB dropped as duplicates of another writer are left out of the local totals too
+        if self.sqlite_db.apply_wallet_rewards(batches, result["applied"] + result["replayed"]) is False:
+            raise Exception("Could not write the wallet rewards to the local wallet totals")
 
-        # Fetch from API and cache result
-        symbol = self.get_and_add_token_metadata(mint_address)
-        self.unknown_token_cache[mint_lower] = symbol
+        if result["replayed"]:
+            print(f"Skipped {len(result['replayed'])} wallet reward batches that were already applied")
 
-        return symbol
+        return result["updated"]
 
     ##########################################################
     #                      MongoDB Getters                   #
@@ -205,7 +426,29 @@ class Controller:
         )
 
     def get_rewards_with_wallet_address_from_db(self, wallet_address):
-        return self.db.get_wallet_rewards(wallet_address)
+        """
+        Gets the rewards for a wallet from the REWARDS_SOURCE, in standby mode the local totals answer when
+        MongoDB fails or is slow
+        """
+        if self.rewards_source == "sqlite":
+            return self.sqlite_db.get_wallet_data(wallet_address)
+
+        if self.rewards_source == "mongo":
+            return self.db.get_wallet_rewards(wallet_address)
+
+        try:
+            wallet = self.rewards_executor.submit(self.db.get_wallet_rewards, wallet_address).result(
+                timeout=self.rewards_timeout
+            )
+        except TimeoutError:
+            print(f"MongoDB took longer than {self.rewards_timeout}s for {wallet_address}, using the local totals")
+            wallet = None
+
+        # get_wallet_rewards returns None for errors as well as unknown wallets
+        if wallet is None:
+            return self.sqlite_db.get_wallet_data(wallet_address)
+
+        return wallet
 
     def get_all_transfers_for_distributor_from_db(self, distributor):
         return self.db.get_all_transfers_for_distributor(distributor)
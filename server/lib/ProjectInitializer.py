@@ -1,43 +1,90 @@
 import os
 import json
 import time
+import queue
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
-from ..db.MongoDB import MongoDB
-from ..db.SQLiteDB import SQLiteDB
-from ..utils.helius import get_historical_transactions_for_distributor, get_token_metadata
-from ..utils.utils import process_distributor_transfers, aggregate_transfers
+from db.MongoDB import MongoDB
+from db.SQLiteDB import SQLiteDB
+from db.RewardsBuffer import RewardsBuffer
+from db.payload_codec import AddressBook
+from utils.helius import get_historical_transactions_for_distributor
+from utils.token_registry import TokenRegistry
+from utils.rate_governor import PRIORITY_BACKFILL
+from utils.utils import (
+    process_distributor_transfers,
+    extract_distributor_transfers,
+    aggregate_transfer_columns,
+    wallet_totals_to_rewards,
+    get_wallet_prefix_ranges,
+)
 
 load_dotenv()
 
+# Read only connection to the distributors db and the temp transaction addresses for each process pool worker
+_worker_cursor = None
+_worker_addresses = None
+
+def init_transform_worker(db_path):
+    """ Opens the process pool workers read only connection """
+    global _worker_cursor, _worker_addresses
+    _worker_cursor = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True).cursor()
+    _worker_addresses = AddressBook()
+
+def transform_transaction_range(distributor, first_id, last_id):
+    """
+    Process pool task that decodes the temp transactions in an id range and extracts their transfers.
+    Returns the TransferBatch with mint addresses as the spl tokens, the mints and the number of rows read
+    """
+    transactions = SQLiteDB.get_transactions_in_range(_worker_cursor, first_id, last_id, _worker_addresses)
+    batch, mints = extract_distributor_transfers(transactions, distributor)
+    return batch, mints, len(transactions)
+
 class ProjectInitializer:
     """
     This class contains functions to initialize new projects by getting all of the transfer transactions
     and then processes them and saves them to their applicable storage locations
     """
 
-    def __init__(self, project):
+    # The stages run in this order and each one saves a checkpoint in the distributors db
+    STAGES = ["fetch_txs", "process_txs", "insert_project", "aggregate_rewards"]
+
+    # Number of errors in a row before a stage gives up
+    MAX_ERRORS = 5
+
+    def __init__(self, project, pipelined=True, queue_size=8, aggregation=None, shards=None, process_workers=None, bulk_load=None):
         self.project = project
         self.distributor = project.get("distributor")
 
-        # Get DB instances
-        self.mongo_db, self.sqlite_db = self.get_db_connections()
+        # When pipelined the Helius fetches and the SQLite writes run in separate stages
+        # connected by a bounded queue so the network and the disk are busy at the same time
+        self.pipelined = pipelined
+        self.queue_size = queue_size
 
-        # Get known tokens
-        self.known_tokens = self.mongo_db.get_known_tokens()
+        # "sql" sums the rewards inside the distributors db, "columns" reads every transfer row into python.
+        # With more than one shard the wallets are split by address prefix and upserted in parallel
+        self.aggregation = aggregation or os.getenv("INIT_AGGREGATION_MODE", "sql")
+        self.shards = shards or int(os.getenv("INIT_AGGREGATION_SHARDS", 1))
 
-        # Create a dictionary for O(1) lookups
-        self.known_tokens_dict = {
-            str(token.get("mint")).lower(): token.get("symbol")
-            for token in self.known_tokens
-        }
+        # With more than one worker the temp transactions are decoded and transformed in a process pool.
+        # The pool is opt in and capped at the cpu count, on a single cpu it only adds pickling overhead
+        # so process_txs stays in process
+        self.process_workers = min(process_workers or int(os.getenv("INIT_PROCESS_WORKERS", 1)), os.cpu_count() or 1)
 
-        # Cache for unknown tokens to avoid duplicate API calls
-        self.unknown_token_cache = {}
+        # Loads the distributors db in bulk load mode until the indexes are built, see SQLiteDB.begin_bulk_load
+        if bulk_load is None:
+            bulk_load = os.getenv("INIT_BULK_LOAD", "true").lower() in ("1", "true", "yes")
+        self.bulk_load = bulk_load
 
-        # Holds the offset value in case the funtion is get txs/transfers function is called recusivly
-        self.txs_offset = 0
-        self.transfers_offset = 0
+        # Get DB instances
+        self.mongo_db, self.sqlite_db = self.get_db_connections()
+
+        # Resolves token mints to symbols, lookups give way to the live poller
+        self.token_registry = TokenRegistry(self.mongo_db, priority=PRIORITY_BACKFILL)
 
     def initalize_new_project(self):
         """
@@ -47,282 +94,625 @@ class ProjectInitializer:
         and combines the native and token transfers and then saves them to the transfers table.
         From there we remove any duplicates, create indexes for the db, and drop the temp tables, and inserts
         the project into the supported projects collection/db. After that the transfers are processed
-        by the aggregator function which adds all of the amounts for each wallet and inserts the wallets rewards to MongoDB
+        by the aggregator function which adds all of the amounts for each wallet and inserts the wallets rewards to MongoDB.
+
+        Every stage saves a checkpoint (page cursor, row cursor) to the distributors db as it goes so if the
+        initializer crashes or gets killed running it again picks up at the stage and row where it stopped
         """
+        stage_functions = {
+            # Get all of the projects transfer transactions
+            # This can take hours depending on how long
+            "fetch_txs": self.get_initial_txs_pipelined if self.pipelined else self.get_initial_txs,
+
+            # Processes the transactions removing unnessesary fields and creates an object
+            # for each transfer and saves it to the transfers table
+            "process_txs": self.process_initial_txs_parallel if self.process_workers > 1 else self.process_initial_txs,
+
+            # Remove duplicate transfers, create indexes, drop temp tables,
+            # and insert project into supported projects collection/db
+            "insert_project": self.insert_and_clean_project,
+
+            # Aggregates all of the rewards for each wallet in the transfers db and
+            # inserts them to the MongoDB
+            "aggregate_rewards": self.aggregate_rewards_from_transfers,
+        }
+
+        self.sqlite_db.create_checkpoint_table(self.distributor)
+
+        # Bulk load until insert_project has built the indexes, it ends the bulk load itself
+        if self.bulk_load and not self.sqlite_db.get_init_checkpoint(self.distributor, "insert_project")["completed"]:
+            self.sqlite_db.create_distributor_tables(self.distributor)
+            self.sqlite_db.begin_bulk_load(self.distributor)
+
+        try:
+            for stage in self.STAGES:
+                checkpoint = self.sqlite_db.get_init_checkpoint(self.distributor, stage)
+
+                if checkpoint["completed"]:
+                    print(f"Stage '{stage}' already completed, skipping...")
+                    continue
+
+                print(f"Running stage '{stage}' (page cursor: {checkpoint['page_cursor']}, row cursor: {checkpoint['row_cursor']})")
+                success = stage_functions[stage](checkpoint)
 
-        # Get all of the projects transfer transactions
-        # This can take hours depending on how long
-        success = self.get_initial_txs()
-        if success is False:
-            return
-
-        # Processes the transactions removing unnessesary fields and creates an object
-        # for each transfer and saves it to the transfers table
-        success = self.process_initial_txs()
-        if success is False:
-            return
-
-        # Remove duplicate transfers, create indexes, drop temp tables,
-        # and insert project into supported projects collection/db
-        success = self.insert_and_clean_project()
-        if success is False:
-            return
-
-        # Aggregates all of the rewards for each wallet in the transfers db and
-        # inserts them to the MongoDB
-        success = self.aggregate_rewards_from_transfers()
-        if success is False:
-            return
+                if success is not True:
+                    print(f"Stage '{stage}' failed. Run the initializer again to resume from the last checkpoint")
+                    return False
+
+                # A bulk load that was rolled back fails here, the stage runs again from its last committed checkpoint
+                if not self.sqlite_db.save_init_checkpoint(self.distributor, stage, completed=True):
+                    print(f"Stage '{stage}' could not be checkpointed. Run the initializer again to resume from the last checkpoint")
+                    return False
+
+        finally:
+            # Commits whatever the checkpoints have recorded if a stage failed part way
+            self.sqlite_db.end_bulk_load(self.distributor)
 
         print("New project successfully initialized")
+        return True
 
     ##########################################################
     #            Functions For Getting Initial Data          #
     ##########################################################
-    def get_initial_txs(self, finished_count=0, error_count=0):
+    def get_fetch_cursor(self, checkpoint):
         """
-        Get all historical transactions for a distributor and save them to file.
-        Handles retries for both 404 errors and 'finished' false positives.
+        Returns the before signature to start fetching from and the newest signature if it has been saved
         """
-        print(f"Starting to fetch transactions for distributor: {self.distributor}")
+        before, newest = self.sqlite_db.get_temp_txs_last_sigs(self.distributor)
 
-        # Create the tables for the distributor
-        self.sqlite_db.create_distributor_tables(self.distributor)
+        # Older runs kept the page cursor in temp_txs_last_sigs
+        return checkpoint["page_cursor"] or before or None, newest
 
-        # Get the last sigs
-        before, newest = self.sqlite_db.get_temp_txs_last_sigs(self.distributor)
+    def fetch_tx_batches(self, before, fetch_result, stop_event=None):
+        """
+        Generator over every transaction batch for the distributor starting at the before signature. The
+        Helius generator retries a failed page itself so a 404 just counts towards the error limit while we
+        keep consuming it and the partial batch it holds is kept. Helius sometimes returns no transactions
+        as a false positive when the txs are from a long time ago so we need 5 'finished' signals in a row
+        before actually stopping. Setting the stop_event ends it between pages and during the backoffs
+        """
+        finished_count = 0
+        error_count = 0
 
-        # Check if we have already updated our the first unitl tx sig
-        if newest:
-            updated_sig = True
-        else:
-            updated_sig = False
+        while finished_count < 5:
+            for txs_batch in get_historical_transactions_for_distributor(self.distributor, before, stop_event=stop_event):
 
-        # Stop if we are over 5
-        if error_count >= 5:
-            print(f"5 concurrent errors in a row! Quitting couldn't get data for project starting at {before}")
-            return False
+                if stop_event is not None and stop_event.is_set():
+                    return
 
-        # Stop if we have hit the finished count
-        if finished_count >= 5:
-            print("Received 5 'finished' signals in a row. All transactions fetched.")
-            return True
+                # 404 is returned if the fetch fails in which case we will increment the error counter
+                # if the error counter has 5 concurrent errors then something is wrong and we stop
+                if txs_batch == 404:
+                    error_count += 1
+                    print(f"Error occurred, incrementing error count. Current count: {error_count}")
+                    if error_count >= self.MAX_ERRORS:
+                        print(f"5 concurrent errors in a row! Quitting couldn't get data for project starting at {before}")
+                        fetch_result["success"] = False
+                        return
+                    if self.backoff(stop_event, 10):
+                        return
+                    continue
+
+                # We only want concurrent counts so getting data resets it
+                error_count = 0
 
-        # This will get all of the transfer txs for a given distributor
-        for txs_batch in get_historical_transactions_for_distributor(self.distributor, before):
+                if txs_batch.get("txs"):
+                    # Reset finished count if we get actual data
+                    if not txs_batch.get("finished"):
+                        finished_count = 0
 
-            # 404 is returned if the fetch fails in which case we will increment the error counter
-            # if the error counter has 5 concurrent errors then something is wrong and we stop the program
-            # otherwise if we get data again the error_counter is reset
-            if txs_batch == 404:
-                print(f"Error occurred, incrementing error count. Current count: {error_count + 1}")
-                error_count += 1
-                time.sleep(10)
-                # Call the function again starting at the last saved point
-                return self.get_initial_txs(finished_count, error_count)
+                    before = txs_batch.get("before")
+                    yield txs_batch
 
+            # The generator also ends early when we are stopping
+            if stop_event is not None and stop_event.is_set():
+                return
 
-            # Finished comes back when helius can't find any more transactions. Sometimes this
-            # is a false positive because it times out if the txs are from a long time ago. Here
-            # we will ensure that we get 5 'finished' responses in a row before actually stopping
-            if txs_batch.get("finished"):
-                finished_count += 1
-                print(f"Received 'finished' signal. Count: {finished_count}")
-                time.sleep(10)
-                # Call the function again starting at the last saved point
-                return self.get_initial_txs(finished_count, error_count)
+            finished_count += 1
+            print(f"Received 'finished' signal. Count: {finished_count}")
+            if finished_count < 5 and self.backoff(stop_event, 10):
+                return
 
-            else:
-                # Reset finished count if we get actual data
-                finished_count = 0
+        print("Received 5 'finished' signals in a row. All transactions fetched.")
 
-            # Save transactions to file
-            if txs_batch.get("txs"):
-                success = self.sqlite_db.insert_transactions_batch(self.distributor, txs_batch.get("txs"))
+    @staticmethod
+    def backoff(stop_event, delay):
+        """ Sleeps for the delay, returns True as soon as the stop_event is set so the caller can bail out """
+        if stop_event is None:
+            time.sleep(delay)
+            return False
+        return stop_event.wait(delay)
 
-                # False means data didn't get saved and we should retry and increment the error counter
-                if success is False:
-                    error_count += 1
-                    time.sleep(10)
-                    return self.get_initial_txs(finished_count, error_count)
+    def write_tx_batch(self, txs_batch, state):
+        """
+        Saves a batch of transactions and the page cursor in one transaction, retrying the write a few times
+        """
+        error_count = 0
+        while True:
+            success = self.sqlite_db.insert_transactions_batch(
+                self.distributor, txs_batch.get("txs"), page_cursor=txs_batch.get("before")
+            )
+            if success is not False:
+                break
 
-                # Save the new sig if we haven't already
-                if not updated_sig:
-                    # Update the projects last signature
-                    self.sqlite_db.update_temp_txs_last_sig(self.distributor, txs_batch.get('last_sig'))
-                    updated_sig = True
+            error_count += 1
+            if error_count >= self.MAX_ERRORS:
+                print(f"5 concurrent write errors in a row! Stopping at {txs_batch.get('before')}")
+                return False
+            time.sleep(10)
 
-                # Update the before sig in cache
-                self.sqlite_db.update_temp_txs_before_sig(self.distributor, txs_batch.get("before"))
+        # Save the new sig if we haven't already
+        if not state["updated_sig"]:
+            self.sqlite_db.update_temp_txs_last_sig(self.distributor, txs_batch.get("last_sig"))
+            state["updated_sig"] = True
 
-                # If we reach this point we need to reset the error counter because
-                # we only want concurrent counts and if we get data it resets
-                error_count = 0
+        return True
 
-        # Make sure we check if the finished count was hit
-        if finished_count < 5:
-            finished_count += 1
-            time.sleep(10)
-            return self.get_initial_txs(finished_count, error_count)
+    def get_initial_txs(self, checkpoint):
+        """
+        Get all historical transactions for a distributor and save them to the temp transactions table.
+        Handles retries for both 404 errors and 'finished' false positives.
+        """
+        print(f"Starting to fetch transactions for distributor: {self.distributor}")
+
+        # Create the tables for the distributor
+        self.sqlite_db.create_distributor_tables(self.distributor)
 
-    def process_initial_txs(self, error_count=0):
+        before, newest = self.get_fetch_cursor(checkpoint)
+        state = {"updated_sig": bool(newest)}
+        fetch_result = {"success": True}
+
+        # This will get all of the transfer txs for a given distributor
+        for txs_batch in self.fetch_tx_batches(before, fetch_result):
+            if not self.write_tx_batch(txs_batch, state):
+                return False
+
+        return fetch_result["success"]
+
+    def get_initial_txs_pipelined(self, checkpoint):
         """
-        Process initial transactions using batched approach with resume capability
+        Producer/consumer version of get_initial_txs. A fetcher thread pages through Helius and pushes
+        the batches into a bounded queue while this thread writes them to SQLite and advances the
+        page cursor. Queue depth and throughput are printed so the queue size can be tuned.
+        An error in the fetcher is raised again here so a fetch that died part way never looks complete
         """
-        # Stop if we hit max amount of concurrent errors
-        if error_count >= 5:
-            print(f"Maximum error count ({error_count}) reached. Stopping processing at offset {self.txs_offset}.")
-            self.txs_offset = 0
+        print(f"Starting pipelined fetch of transactions for distributor: {self.distributor}")
+
+        # Create the tables for the distributor
+        self.sqlite_db.create_distributor_tables(self.distributor)
+
+        before, newest = self.get_fetch_cursor(checkpoint)
+
+        # Bounded queue so the fetcher can only run queue_size batches ahead of the writer
+        txs_queue = queue.Queue(maxsize=self.queue_size)
+        stop_event = threading.Event()
+        fetch_result = {"success": True, "error": None}
+
+        def put_batch(item):
+            """ Blocks until there is room in the queue unless the writer has stopped """
+            while not stop_event.is_set():
+                try:
+                    txs_queue.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
             return False
 
-        # Get total count for progress tracking
-        total_count = self.sqlite_db.get_transactions_count(self.distributor)
-        processed_count = self.txs_offset
+        def fetcher(before):
+            """ Producer stage that keeps pages in flight and pushes them through the queue """
+            try:
+                for txs_batch in self.fetch_tx_batches(before, fetch_result, stop_event):
+                    if not put_batch(txs_batch):
+                        return
 
-        print(f"Starting to process {total_count} transactions from offset {self.txs_offset}")
+            except Exception as e:
+                print(f"Error in the transaction fetcher: {e}")
+                fetch_result["success"] = False
+                fetch_result["error"] = e
+
+            finally:
+                # Sentinel tells the writer there is nothing else coming
+                put_batch(None)
+
+        fetcher_thread = threading.Thread(target=fetcher, args=(before,), daemon=True)
+        fetcher_thread.start()
+
+        state = {"updated_sig": bool(newest)}
+        total_txs = 0
+        batch_count = 0
+        start_time = time.time()
 
         try:
-            # Use the generator
-            for transactions, current_offset in self.sqlite_db.get_transactions(self.distributor, self.txs_offset):
+            while True:
+                txs_batch = txs_queue.get()
+
+                # The fetcher is done, if it died the stream is short so don't treat it as complete
+                if txs_batch is None:
+                    if fetch_result["error"] is not None:
+                        raise fetch_result["error"]
+                    break
+
+                # The page cursor only moves once the batch is committed so a restart resumes from here
+                if not self.write_tx_batch(txs_batch, state):
+                    return False
+
+                # Report the throughput and queue depth so the queue size can be tuned
+                batch_count += 1
+                total_txs += len(txs_batch.get("txs"))
+                elapsed = time.time() - start_time
+                rate = total_txs / elapsed if elapsed > 0 else 0
+                print(
+                    f"Wrote batch {batch_count}. Transactions: {total_txs} ({rate:.1f} tx/s) "
+                    f"Queue depth: {txs_queue.qsize()}/{self.queue_size}"
+                )
+
+        finally:
+            # Unblock and stop the fetcher if we are leaving early
+            stop_event.set()
+            fetcher_thread.join()
+
+        elapsed = time.time() - start_time
+        rate = total_txs / elapsed if elapsed > 0 else 0
+        print(f"Pipelined fetch complete. Transactions: {total_txs} in {elapsed:.1f}s ({rate:.1f} tx/s)")
+
+        return fetch_result["success"]
+
+    def process_initial_txs(self, checkpoint):
+        """
+        Process initial transactions using batched approach. The row cursor is the id of the last temp
+        transaction processed and it is saved in the same transaction as each batch of transfers so a
+        restart resumes at the exact row
+        """
+        last_id = checkpoint["row_cursor"]
+        error_count = 0
+        skipped_count = 0
 
-                if transactions is None:
-                    error_count += 1
-                    print(f"Failed to get temp transactions. Error count: {error_count}")
-                    time.sleep(10)
-                    return self.process_initial_txs(error_count)
+        # Get counts for progress tracking
+        total_count = self.sqlite_db.get_transactions_count(self.distributor)
+        done_count = total_count - self.sqlite_db.get_transactions_count(self.distributor, after_id=last_id)
 
-                # Process the batch
-                processed_batch = process_distributor_transfers(self, transactions, self.distributor)
+        print(f"Starting to process {total_count} transactions after id {last_id}")
 
-                # Insert the processed transfers to the local db
-                success = self.sqlite_db.insert_transfer_batch(self.distributor, processed_batch)
+        while True:
+            try:
+                for transactions, batch_last_id in self.sqlite_db.get_transactions(self.distributor, last_id):
 
-                # Try again with the last offset if it didn't save successfully
-                if success is False:
-                    error_count += 1
-                    print(f"Failed to insert batch. Error count: {error_count}")
-                    time.sleep(10)
-                    # Recursive call with error count - but be careful about infinite recursion
-                    return self.process_initial_txs(error_count)
+                    # Process the batch
+                    processed_batch = process_distributor_transfers(self.token_registry, transactions, self.distributor)
 
-                # Update the offset in cache for resume capability
-                self.txs_offset = current_offset + len(transactions)
+                    # Insert the processed transfers to the local db
+                    result = self.sqlite_db.insert_transfer_batch(self.distributor, processed_batch, row_cursor=batch_last_id)
 
-                # Reset error count on successful processing
-                error_count = 0
+                    # Retry from the last id if it didn't save successfully
+                    if result is False:
+                        raise Exception(f"Failed to insert transfers batch after id {last_id}")
 
-                # Update progress
-                processed_count += len(transactions)
-                progress = (processed_count / total_count) * 100
-                print(f"Progress: {processed_count}/{total_count} ({progress:.1f}%)")
+                    last_id = batch_last_id
+                    done_count += len(transactions)
+                    skipped_count += result["skipped"]
 
-            print("Successfully processed all transactions")
-            self.txs_offset = 0
-            return True
+                    # Reset error count on successful processing
+                    error_count = 0
+
+                    # Update progress
+                    progress = (done_count / total_count) * 100 if total_count else 100
+                    print(f"Progress: {done_count}/{total_count} ({progress:.1f}%) Duplicates skipped: {skipped_count}")
+
+                print("Successfully processed all transactions")
+                return True
+
+            except Exception as e:
+                error_count += 1
+                print(f"Error processing transactions: {e}. Error count: {error_count}")
+
+                # Stop if we hit max amount of concurrent errors
+                if error_count >= self.MAX_ERRORS:
+                    print(f"Maximum errors reached. Stopping processing after id {last_id}.")
+                    return False
 
-        except Exception as e:
-            print(f"Error processing transactions: {e}")
-            error_count += 1
-            if error_count < 5:
-                print(f"Retrying... Error count: {error_count}")
                 time.sleep(10)
-                return self.process_initial_txs(error_count)
-            else:
-                print(f"Maximum errors reached. Stopping processing at offset {self.txs_offset}.")
-                self.txs_offset = 0
-                return False
 
-    def insert_and_clean_project(self):
+    def process_initial_txs_parallel(self, checkpoint, chunk_size=5000):
+        """
+        Parallel version of process_initial_txs. The temp transactions are split into id ranges that are
+        decoded and transformed in a process pool while this process is the single writer. Results are written
+        in id order so the row cursor means the same thing as in process_initial_txs. The workers return the
+        mints they saw and the symbols are resolved here so every worker shares the same token registry
+        """
+        last_id = checkpoint["row_cursor"]
+        error_count = 0
+        skipped_count = 0
+
+        # Get counts for progress tracking
+        total_count = self.sqlite_db.get_transactions_count(self.distributor)
+        done_count = total_count - self.sqlite_db.get_transactions_count(self.distributor, after_id=last_id)
+        db_path = self.sqlite_db.get_distributor_db_path(self.distributor)
+
+        print(f"Starting to process {total_count} transactions after id {last_id} with {self.process_workers} workers")
+
+        while True:
+            start = time.perf_counter()
+            processed = 0
+
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    initializer=init_transform_worker,
+                    initargs=(db_path,),
+                ) as executor:
+                    ranges = self.sqlite_db.get_transaction_id_ranges(self.distributor, last_id, chunk_size)
+
+                    # Keep two ranges per worker in flight so the pool never waits on the writer
+                    pending = deque()
+                    for first_id, range_end in ranges:
+                        pending.append(
+                            (executor.submit(transform_transaction_range, self.distributor, first_id, range_end), range_end)
+                        )
+                        if len(pending) >= self.process_workers * 2:
+                            break
+
+                    while pending:
+                        future, range_end = pending.popleft()
+                        batch, mints, row_count = future.result()
+
+                        next_range = next(ranges, None)
+                        if next_range is not None:
+                            pending.append(
+                                (executor.submit(transform_transaction_range, self.distributor, *next_range), next_range[1])
+                            )
+
+                        # Resolve the token symbols for the whole range at once
+                        self.token_registry.resolve_mints(mints)
+                        batch.map_tokens(self.token_registry.get_token_symbols(mints))
+
+                        # Insert the processed transfers to the local db
+                        result = self.sqlite_db.insert_transfer_batch(self.distributor, batch, row_cursor=range_end)
+
+                        # Retry from the last id if it didn't save successfully
+                        if result is False:
+                            raise Exception(f"Failed to insert transfers batch after id {last_id}")
+
+                        last_id = range_end
+                        done_count += row_count
+                        skipped_count += result["skipped"]
+                        processed += row_count
+
+                        # Reset error count on successful processing
+                        error_count = 0
+
+                        # Update progress
+                        elapsed = time.perf_counter() - start
+                        rate = processed / elapsed if elapsed > 0 else 0
+                        progress = (done_count / total_count) * 100 if total_count else 100
+                        print(f"Progress: {done_count}/{total_count} ({progress:.1f}%) {rate:.0f} tx/s Duplicates skipped: {skipped_count}")
+
+                print("Successfully processed all transactions")
+                return True
+
+            except Exception as e:
+                error_count += 1
+                print(f"Error processing transactions: {e}. Error count: {error_count}")
+
+                # Stop if we hit max amount of concurrent errors
+                if error_count >= self.MAX_ERRORS:
+                    print(f"Maximum errors reached. Stopping processing after id {last_id}.")
+                    return False
+
+                time.sleep(10)
+
+    def insert_and_clean_project(self, checkpoint):
         """
         This inserts the project into both the sqlite database and the mongodb then removes the temp tables
         """
-        before, newest = self.sqlite_db.get_temp_txs_last_sigs(self.distributor)
+        # The newest sig lives in a temp table so keep it in the checkpoint before the temp tables get dropped
+        newest = checkpoint["page_cursor"]
+        if not newest:
+            before, newest = self.sqlite_db.get_temp_txs_last_sigs(self.distributor)
+            self.sqlite_db.save_init_checkpoint(self.distributor, "insert_project", page_cursor=newest)
 
         # Set the newest sig as last_sig for the unitl helius param
         self.project["last_sig"] = newest
         print(self.project)
-        # Write the project to the local db
-        sucess = self.sqlite_db.insert_supported_project(self.project)
+
+        # Write the project to the local db, upsert so a resumed run doesn't fail on the existing row
+        success = self.sqlite_db.upsert_supported_project(self.project)
 
         # Make sure the insert was successful
-        if sucess is not True:
+        if success is not True:
             return False
 
         # Write the project to the mongo db
-        sucess = self.mongo_db.insert_supported_project(self.project)
+        success = self.mongo_db.insert_supported_project(self.project)
 
         # Make sure the insert was successful
-        if sucess is not True:
+        if success is not True:
             return False
 
         # Next we should delete any duplicate transfers, create indexes, and drop the temp tables
         success = self.sqlite_db.clean_and_remove_temp_data(self.distributor)
-        if sucess is not True:
+        if success is not True:
             return False
 
         return True
 
-    def aggregate_rewards_from_transfers(self, error_count=0):
+    def aggregate_rewards_from_transfers(self, checkpoint):
         """
-        Process for aggregating rewards from transfers and saves the results to the mongoDB
+        Aggregates the rewards for every wallet in the transfers db and saves them to MongoDB using the
+        configured aggregation mode
         """
-        # Stop if we hit max amount of concurrent errors
-        if error_count >= 5:
-            print(f"Maximum error count ({error_count}) reached. Stopping processing at offset {self.transfers_offset}.")
-            self.transfers_offset = 0
-            return False
+        # A run that already started in one mode has to finish in it or wallets would be counted twice
+        if checkpoint["row_cursor"]:
+            return self.aggregate_rewards_from_transfer_rows(checkpoint)
 
-        # Get total count for progress tracking
-        total_count = self.sqlite_db.get_transfers_count(self.distributor)
-        processed_count = self.transfers_offset
-        updated = 0
+        if checkpoint["page_cursor"] or self.aggregation == "sql":
+            return self.aggregate_rewards_in_sqlite(checkpoint)
 
-        print(f"Starting to process {total_count} transactions from offset {self.transfers_offset}")
-
-        try:
-            # Use the generator
-            for transfers, current_offset in self.sqlite_db.get_transfers(self.distributor, self.transfers_offset):
+        return self.aggregate_rewards_from_transfer_rows(checkpoint)
 
-                # Make sure we have transactions
-                if transfers is None:
-                    error_count += 1
-                    print(f"Failed to get transfers from SQLite. Error count: {error_count}")
-                    time.sleep(10)
-                    return self.aggregate_rewards_from_transfers(error_count)
+    def aggregate_rewards_in_sqlite(self, checkpoint):
+        """
+        Sums the rewards by wallet and token with a GROUP BY inside the distributors db and streams the totals
+        into the MongoDB upserts. Each wallet prefix shard runs in its own thread with its own checkpoint
+        """
+        # Keep the shard count of a run that already started so the shard checkpoints line up
+        if checkpoint["page_cursor"]:
+            shards = int(checkpoint["page_cursor"].split(":")[1])
+        else:
+            shards = self.shards
+            self.sqlite_db.save_init_checkpoint(self.distributor, "aggregate_rewards", page_cursor=f"shards:{shards}")
 
-                # Add up the totals for each wallet address
-                aggregated_transfers = aggregate_transfers(transfers)
+        # Covering index so the GROUP BY is one ordered pass over the index
+        self.sqlite_db.create_wallet_totals_index(self.distributor)
 
-                # Use the aggregated transfers to update the wallets collection on MongoDB
-                updated = self.mongo_db.insert_wallet_rewards(aggregated_transfers)
-                updated += updated
+        ranges = get_wallet_prefix_ranges(shards)
+        print(f"Aggregating rewards in SQLite with {len(ranges)} shard(s)")
 
-                # Update the offset
-                self.transfers_offset = current_offset + len(aggregated_transfers)
+        if len(ranges) == 1:
+            return self.aggregate_wallet_range(*ranges[0])
 
-                # Reset error count on successful processing
-                error_count = 0
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            results = list(executor.map(lambda bounds: self.aggregate_wallet_range(*bounds), ranges))
 
-                # Update progress
-                processed_count += len(transfers)
-                progress = (processed_count / total_count) * 100
-                print(f"Progress: {processed_count}/{total_count} Wallets Updated: {updated} ({progress:.1f}%)")
+        return all(result is True for result in results)
 
-            print("Successfully aggregated rewards and inserted them into the local db")
-            self.transfers_offset = 0
+    def aggregate_wallet_range(self, lower, upper):
+        """
+        Upserts the SQLite wallet totals for the wallets between lower and upper. The last wallet written
+        is saved as the shard's page cursor after each MongoDB batch
+        """
+        stage = f"aggregate_rewards:{lower or ''}-{upper or ''}"
+        checkpoint = self.sqlite_db.get_init_checkpoint(self.distributor, stage)
+        if checkpoint["completed"]:
             return True
 
-        except Exception as e:
-            print(f"Error processing transactions: {e}")
-            error_count += 1
-            if error_count < 5:
-                print(f"Retrying... Error count: {error_count}")
+        start_after = checkpoint["page_cursor"]
+        error_count = 0
+        total_updated = 0
+
+        while True:
+            try:
+                for totals in self.sqlite_db.get_wallet_totals(self.distributor, lower, upper, start_after):
+
+                    # Use the totals to update the wallets collection on MongoDB and the local wallet totals. The
+                    # batch is named by its wallet range so a batch written before a crash is skipped on resume
+                    batch_id = f"init:{self.distributor}:{stage}:{start_after or ''}-{totals[-1][0]}"
+                    wallets = wallet_totals_to_rewards(totals, self.distributor)
+                    updated = self.write_wallet_rewards(
+                        {batch_id: {"wallets": wallets, "distributor": self.distributor, "signatures": []}}
+                    )
+                    total_updated += updated
+
+                    # Batches end on a wallet so the last one is where to resume
+                    start_after = totals[-1][0]
+                    self.sqlite_db.save_init_checkpoint(self.distributor, stage, page_cursor=start_after)
+
+                    # Reset error count on successful processing
+                    error_count = 0
+
+                    print(f"Shard {stage}: Wallets Updated: {total_updated} (last wallet {start_after})")
+
+                self.sqlite_db.save_init_checkpoint(self.distributor, stage, completed=True)
+                print(f"Shard {stage} finished, {total_updated} wallets updated")
+                return True
+
+            except Exception as e:
+                error_count += 1
+                print(f"Error aggregating wallet totals for {stage}: {e}. Error count: {error_count}")
+
+                # Stop if we hit max amount of concurrent errors
+                if error_count >= self.MAX_ERRORS:
+                    print(f"Maximum errors reached. Stopping {stage} after wallet {start_after}.")
+                    return False
+
                 time.sleep(10)
-                return self.aggregate_rewards_from_transfers(error_count)
-            else:
-                print(f"Maximum errors reached. Stopping processing. {self.transfers_offset}")
-                self.transfers_offset = 0
-                return False
+
+    def aggregate_rewards_from_transfer_rows(self, checkpoint):
+        """
+        Process for aggregating rewards from transfers and saves the results to the mongoDB. The batches go
+        through a RewardsBuffer so a wallet paid in many batches is written once per flush. The row cursor
+        is the id of the last transfer aggregated and it is saved once its batch has been flushed to MongoDB
+        """
+        last_id = checkpoint["row_cursor"]
+        error_count = 0
+        total_updated = 0
+
+        # Get counts for progress tracking
+        total_count = self.sqlite_db.get_transfers_count(self.distributor)
+        done_count = total_count - self.sqlite_db.get_transfers_count(self.distributor, after_id=last_id)
+
+        print(f"Starting to process {total_count} transfers after id {last_id}")
+
+        def save_checkpoint(row_cursor):
+            return lambda: self.sqlite_db.save_init_checkpoint(self.distributor, "aggregate_rewards", row_cursor=row_cursor)
+
+        rewards_buffer = RewardsBuffer(
+            self.write_wallet_rewards,
+            max_pending=int(os.getenv("REWARDS_BUFFER_MAX_WALLETS", 10000)),
+            flush_interval=float(os.getenv("REWARDS_BUFFER_FLUSH_SECONDS", 5)),
+        )
+
+        try:
+            while True:
+                try:
+                    for columns, batch_last_id, row_count in self.sqlite_db.get_transfer_columns(self.distributor, last_id):
+
+                        # Add up the totals for each wallet address with the vectorized grouped sum
+                        aggregated_transfers = aggregate_transfer_columns(*columns)
+
+                        # The cursor is the last transfer row, not a wallet. Whatever is in the buffer is always
+                        # the rows between the saved checkpoint and last_id so a retry carries on from last_id.
+                        # The batch is named by its row range so one written before a crash is skipped on resume
+                        batch_id = f"init:{self.distributor}:rows:{last_id}-{batch_last_id}"
+                        last_id = batch_last_id
+                        rewards_buffer.add(
+                            batch_id, aggregated_transfers, distributor=self.distributor, callback=save_checkpoint(last_id)
+                        )
+                        total_updated += len(aggregated_transfers)
+                        done_count += row_count
+
+                        # Reset error count on successful processing
+                        error_count = 0
+
+                        # Update progress
+                        progress = (done_count / total_count) * 100 if total_count else 100
+                        print(f"Progress: {done_count}/{total_count} Wallets Updated: {total_updated} ({progress:.1f}%)")
+
+                    # Everything has to be written before the stage is completed
+                    if not rewards_buffer.flush():
+                        raise Exception("Could not write the buffered wallet rewards")
+
+                    buffer_stats = rewards_buffer.get_stats()
+                    print(
+                        f"Successfully aggregated rewards and inserted them into the local db, "
+                        f"{buffer_stats['coalescing_ratio']:.1f}x coalescing over {buffer_stats['flushes']} flushes"
+                    )
+                    return True
+
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error aggregating transfers: {e}. Error count: {error_count}")
+
+                    # Stop if we hit max amount of concurrent errors
+                    if error_count >= self.MAX_ERRORS:
+                        print(f"Maximum errors reached. Stopping processing after id {last_id}.")
+                        return False
+
+                    time.sleep(10)
+
+        finally:
+            rewards_buffer.close()
+
+    def write_wallet_rewards(self, batches):
+        """
+        Updates the wallets collection on MongoDB and the local wallet totals with batches of aggregated
+        rewards. Batches already in their reward batch ledgers are skipped
+        """
+        result = self.mongo_db.apply_wallet_rewards(batches)
+
+        if self.sqlite_db.apply_wallet_rewards(batches, result["applied"] + result["replayed"]) is False:
+            raise Exception("Could not write the wallet rewards to the local wallet totals")
+
+        return result["updated"]
 
     ##########################################################
     #                          Helpers                       #
@@ -343,43 +733,3 @@ class ProjectInitializer:
             raise
 
         return mongo_db, sqlite_db
-
-    def get_and_add_token_metadata(self, mint_address):
-        """
-        Fetches token metadata, adds it to the list of known tokens in DB, and returns the symbol of the token added
-        """
-        try:
-            # Make helius call to get the metadata
-            token_document = get_token_metadata(mint_address)
-
-            # Add it to the database
-            self.mongo_db.insert_known_token(token_document)
-
-            # Update our local caches
-            symbol = token_document["symbol"]
-            self.known_tokens_dict[mint_address.lower()] = symbol
-            return symbol
-        except Exception as e:
-            print(f"Error when trying to get_and_add_token_metadata {e}")
-            return token_document["symbol"]
-
-    def get_token_symbol(self, mint_address):
-        """
-        Checks if the mint address is in the known list of tokens, if it isn't then we get the token metadata and instert it into the DB
-        """
-        # Normalize the mint
-        mint_lower = mint_address.lower()
-
-        # Check known tokens dictionary
-        if mint_lower in self.known_tokens_dict:
-            return self.known_tokens_dict[mint_lower]
-
-        # Check unknown token cache to avoid duplicate API calls
-        if mint_lower in self.unknown_token_cache:
-            return self.unknown_token_cache[mint_lower]
-
-        # Fetch from API and cache result
-        symbol = self.get_and_add_token_metadata(mint_address)
-        self.unknown_token_cache[mint_lower] = symbol
-
-        return symbol
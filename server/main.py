@@ -6,11 +6,11 @@ from contextlib import asynccontextmanager
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
-from routes import system_config, wallet_rewards
+from routes import system_config, wallet_rewards, webhooks
 from routes.models import RootResponse
 from lib.Controller import Controller
 from limiter import limiter
-from routes.dependency import set_controller, remove_controller
+from routes.dependency import set_controller, get_controller, remove_controller
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -20,6 +20,9 @@ def initialize_program():
     try:
         # Get and instance of the Controller which is used to read from DB
         controller = Controller()
+
+        # The local wallet totals have to be filled before polling adds to them
+        controller.sync_wallet_rewards()
         controller.begin_polling()
 
         # Add controller to dependencies
@@ -38,7 +41,8 @@ async def lifespan(app: FastAPI):
     yield
     print("Shutting down the API...")
 
-    # Unset the dependency variable
+    # Close the db connections before unsetting the dependency variable
+    get_controller().close_connections()
     remove_controller()
 
 # Initialize the app
@@ -57,6 +61,7 @@ app.add_middleware(SlowAPIMiddleware)
 # Add the routes to the app
 app.include_router(wallet_rewards.router, prefix="/rewards", tags=["rewards"])
 app.include_router(system_config.router, tags=["system"])
+app.include_router(webhooks.router, prefix="/webhooks", tags=["webhooks"])
 
 @app.get("/", response_model=RootResponse)
 @limiter.limit("30/minute")
@@ -68,6 +73,7 @@ async def root(request: Request):
         "endpoints": {
             "status": "/health",
             "supported_projects": "/supported_projects",
+            "poll_status": "/poll_status",
             "wallet_rewards": "/rewards/{wallet_address}",
             "docs": "/docs",
         },
@@ -45,3 +45,20 @@ class WalletTransfer(BaseModel):
     token: str
     wallet_address: str
     distributor: str
+
+# Model for the webhook route response
+class WebhookResponse(BaseModel):
+    received: int
+    txs: int
+    skipped: int
+    transfers: int
+
+# Model for a distributors entry in the poll status route response
+class PollStatus(BaseModel):
+    distributor: str
+    interval: float
+    next_due_in: float
+    lag: float
+    staleness: Optional[float] = None
+    last_txs: int
+    last_duration: float
@@ -3,7 +3,7 @@ from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List
 from lib.Controller import Controller
 from .dependency import get_controller
-from .models import HealthResponse, SupportedProject
+from .models import HealthResponse, SupportedProject, PollStatus
 from limiter import limiter
 
 # Initialize the router
@@ -20,6 +20,17 @@ async def get_supported_projects(request: Request, controller: Controller = Depe
             status_code=500, detail=f"Error getting supported projects"
         )
 
+@router.get("/poll_status", response_model=List[PollStatus])
+@limiter.limit("10/minute")
+async def get_poll_status(request: Request, controller: Controller = Depends(get_controller)):
+    """Gets the current poll interval and lag for each distributor"""
+    try:
+        return controller.get_poll_status()
+    except:
+        raise HTTPException(
+            status_code=500, detail=f"Error getting poll status"
+        )
+
 @router.get("/health", response_model=HealthResponse)
 @limiter.limit("15/minute")
 async def health_check(request: Request):
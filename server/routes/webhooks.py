@@ -0,0 +1,41 @@
+import os
+import hmac
+from fastapi import APIRouter, HTTPException, Depends, Request
+from starlette.concurrency import run_in_threadpool
+from lib.Controller import Controller
+from .dependency import get_controller
+from .models import WebhookResponse
+
+# Initialize the router
+router = APIRouter()
+
+@router.post("/helius", response_model=WebhookResponse)
+async def helius_webhook(request: Request, controller: Controller = Depends(get_controller)):
+    """Receives enhanced transaction payloads pushed by a Helius webhook"""
+    secret = os.getenv("HELIUS_WEBHOOK_SECRET")
+
+    # Webhooks are off unless a shared secret is configured
+    if not secret:
+        raise HTTPException(status_code=503, detail="Webhooks are not enabled")
+
+    # Helius sends the configured auth header value back in the Authorization header
+    auth_header = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth_header.encode(), secret.encode()):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
+    try:
+        transactions = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    if not isinstance(transactions, list):
+        raise HTTPException(status_code=400, detail="Expected a list of transactions")
+
+    # The controller does blocking DB and RPC calls so keep it off the event loop
+    try:
+        return await run_in_threadpool(controller.ingest_webhook_transactions, transactions)
+    except Exception as e:
+        print(f"Error ingesting webhook transactions: {e}")
+        raise HTTPException(
+            status_code=500, detail="Error ingesting webhook transactions"
+        )
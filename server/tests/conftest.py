@@ -0,0 +1,39 @@
+import os
+import sys
+import pytest
+
+# The server modules import each other from the server directory, the same as when the API is run from it
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+@pytest.fixture
+def backup_dir(tmp_path, monkeypatch):
+    """ Runs the test in an empty directory with the backup folders the SQLite dbs go in """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("backup/transfers")
+    return tmp_path
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """ Points MongoDB at an in memory mongomock client """
+    mongomock = pytest.importorskip("mongomock")
+    import db.MongoDB
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db.MongoDB, "MongoClient", lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.fixture
+def controller(backup_dir, mongo_client, monkeypatch):
+    """ A Controller on mongomock and a temp SQLite dir, the rewards buffer only flushes when told to """
+    monkeypatch.setenv("REWARDS_BUFFER_FLUSH_SECONDS", "3600")
+    monkeypatch.delenv("REWARDS_SOURCE", raising=False)
+    from lib.Controller import Controller
+
+    controller = Controller()
+    controller.sqlite_db.create_config_tables()
+    controller.sqlite_db.create_config_indexes()
+    yield controller
+    controller.close_connections()
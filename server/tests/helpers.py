@@ -0,0 +1,24 @@
+def make_transactions(distributor, count, start=0, wallets=20):
+    """ Processed transactions that each pay two wallets in sol """
+    return [
+        {
+            "signature": f"sig{number:06d}",
+            "slot": number,
+            "timestamp": number,
+            "native_transfers": [
+                [f"wallet{number % wallets:03d}", 1_000_000_000],
+                [f"wallet{(number + 1) % wallets:03d}", 500_000_000],
+            ],
+            "token_transfers": [],
+        }
+        for number in range(start, start + count)
+    ]
+
+
+def expected_totals(transactions):
+    """ The sol total of every wallet paid by the transactions """
+    totals = {}
+    for tx in transactions:
+        for wallet_address, amount in tx["native_transfers"]:
+            totals[wallet_address] = totals.get(wallet_address, 0) + amount / 1e9
+    return totals
@@ -0,0 +1,42 @@
+import random
+import pytest
+from utils import utils
+from utils.utils import aggregate_transfers, aggregate_transfer_columns
+
+
+def make_columns(count, seed=1):
+    rng = random.Random(seed)
+    wallets = [f"wallet{rng.randrange(50):03d}" for _ in range(count)]
+    distributors = [rng.choice(["distributor1", "distributor2"]) for _ in range(count)]
+    tokens = [rng.choice(["sol", "USDC", "BONK"]) for _ in range(count)]
+    amounts = [rng.randrange(1, 1000) / 8 for _ in range(count)]
+    return wallets, distributors, tokens, amounts
+
+
+def to_dicts(wallets, distributors, tokens, amounts):
+    return [
+        {"wallet_address": w, "distributor": d, "token": t, "amount": a}
+        for w, d, t, a in zip(wallets, distributors, tokens, amounts)
+    ]
+
+
+@pytest.mark.parametrize("min_rows", [0, 10**9])
+def test_both_paths_match_aggregate_transfers(monkeypatch, min_rows):
+    # 0 always takes the numpy grouped sum, 10**9 always the one pass sum
+    monkeypatch.setattr(utils, "VECTORIZE_MIN_ROWS", min_rows)
+    columns = make_columns(2000)
+
+    assert aggregate_transfer_columns(*columns) == aggregate_transfers(to_dicts(*columns))
+
+
+@pytest.mark.parametrize("min_rows", [0, 10**9])
+def test_one_distributor_for_the_batch(monkeypatch, min_rows):
+    monkeypatch.setattr(utils, "VECTORIZE_MIN_ROWS", min_rows)
+    wallets, _, tokens, amounts = make_columns(500)
+
+    expected = aggregate_transfers(to_dicts(wallets, ["distributor1"] * len(wallets), tokens, amounts))
+    assert aggregate_transfer_columns(wallets, "distributor1", tokens, amounts) == expected
+
+
+def test_empty_batch():
+    assert aggregate_transfer_columns([], "distributor1", [], []) == {}
@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+import requests
+import lib.ProjectInitializer
+from db.SQLiteDB import SQLiteDB
+from lib.ProjectInitializer import ProjectInitializer
+from utils.helius_client import HeliusClient
+from helpers import make_transactions
+
+DISTRIBUTOR = "distributor1"
+
+
+@pytest.fixture
+def initializer(backup_dir):
+    """ ProjectInitializer with just what the fetch stage needs, no MongoDB """
+    sqlite_db = SQLiteDB()
+    sqlite_db.create_checkpoint_table(DISTRIBUTOR)
+
+    initializer = ProjectInitializer.__new__(ProjectInitializer)
+    initializer.distributor = DISTRIBUTOR
+    initializer.sqlite_db = sqlite_db
+    initializer.queue_size = 2
+    yield initializer
+    sqlite_db.close_connections()
+
+
+def make_page(start):
+    return {"txs": make_transactions(DISTRIBUTOR, 10, start), "before": f"sig{start + 9:06d}", "last_sig": "sig000000"}
+
+
+def run_fetch(initializer):
+    checkpoint = initializer.sqlite_db.get_init_checkpoint(DISTRIBUTOR, "fetch_txs")
+    return initializer.get_initial_txs_pipelined(checkpoint)
+
+
+def test_fetcher_error_is_raised_in_the_writer(initializer, monkeypatch):
+    def pages(distributor, before, stop_event=None):
+        yield make_page(0)
+        raise RuntimeError("helius is down")
+
+    monkeypatch.setattr(lib.ProjectInitializer, "get_historical_transactions_for_distributor", pages)
+
+    with pytest.raises(RuntimeError, match="helius is down"):
+        run_fetch(initializer)
+
+    # The page that made it through is still saved with its cursor
+    assert initializer.sqlite_db.get_transactions_count(DISTRIBUTOR) == 10
+    assert initializer.sqlite_db.get_init_checkpoint(DISTRIBUTOR, "fetch_txs")["page_cursor"] == "sig000009"
+
+
+def test_failed_write_doesnt_wait_for_the_fetcher_backoff(initializer, monkeypatch):
+    backing_off = threading.Event()
+
+    def pages(distributor, before, stop_event=None):
+        yield make_page(0)
+        backing_off.set()
+        while True:
+            yield 404
+
+    monkeypatch.setattr(lib.ProjectInitializer, "get_historical_transactions_for_distributor", pages)
+
+    # The write fails once the fetcher is already in its 10 second backoff
+    monkeypatch.setattr(initializer, "write_tx_batch", lambda txs_batch, state: not backing_off.wait(2))
+
+    start = time.perf_counter()
+    assert run_fetch(initializer) is False
+    assert time.perf_counter() - start < 5
+
+
+def test_stop_event_cuts_the_client_backoff_short(monkeypatch):
+    client = HeliusClient()
+    monkeypatch.setattr(client, "get_retry_delay", lambda attempt, response=None: 60)
+    calls = []
+
+    def request(*args, **kwargs):
+        calls.append(1)
+        response = requests.Response()
+        response.status_code = 503
+        return response
+
+    monkeypatch.setattr(client.session, "request", request)
+    stop_event = threading.Event()
+    threading.Timer(0.1, stop_event.set).start()
+
+    start = time.perf_counter()
+    response = client.get("http://helius.test", stop_event=stop_event)
+
+    assert response.status_code == 503
+    assert calls == [1]
+    assert time.perf_counter() - start < 5
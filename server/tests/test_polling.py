@@ -0,0 +1,57 @@
+import pytest
+import lib.Controller
+from utils import helius
+from helpers import make_transactions
+
+DISTRIBUTOR = "distributor1"
+
+
+def add_project(controller, last_sig):
+    controller.db.insert_supported_project(
+        {"name": "test", "distributor": DISTRIBUTOR, "token_mint": "mint", "dev_wallet": "dev", "last_sig": last_sig}
+    )
+
+
+def test_failed_pagination_keeps_last_sig(controller, monkeypatch):
+    add_project(controller, "old")
+
+    def pages(distributor, until):
+        # One page comes back, then Helius fails before the rest are fetched
+        yield {"txs": make_transactions(DISTRIBUTOR, 10), "last_sig": "newest"}
+        raise RuntimeError("helius is down")
+
+    monkeypatch.setattr(lib.Controller, "get_new_distributor_transactions", pages)
+
+    assert controller.poll_distributor(DISTRIBUTOR)["success"] is False
+    assert controller.rewards_buffer.flush()
+    assert controller.db.get_newest_tx_signature_for_distributor(DISTRIBUTOR) == "old"
+
+
+def test_completed_pagination_moves_last_sig_after_flush(controller, monkeypatch):
+    add_project(controller, "old")
+
+    def pages(distributor, until):
+        yield {"txs": make_transactions(DISTRIBUTOR, 10), "last_sig": "newest"}
+        yield {"txs": make_transactions(DISTRIBUTOR, 10, start=10), "last_sig": "newest"}
+
+    monkeypatch.setattr(lib.Controller, "get_new_distributor_transactions", pages)
+
+    result = controller.poll_distributor(DISTRIBUTOR)
+    assert result["success"] is True
+    assert result["txs"] == 20
+
+    # The checkpoint waits for the rewards to be written
+    assert controller.db.get_newest_tx_signature_for_distributor(DISTRIBUTOR) == "old"
+    assert controller.rewards_buffer.flush()
+    assert controller.db.get_newest_tx_signature_for_distributor(DISTRIBUTOR) == "newest"
+
+
+def test_helius_generator_raises_on_error(monkeypatch):
+    class FailingClient:
+        def get(self, url, params=None, priority=None):
+            raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(helius, "get_helius_client", lambda: FailingClient())
+
+    with pytest.raises(RuntimeError):
+        list(helius.get_new_distributor_transactions(DISTRIBUTOR, "old"))
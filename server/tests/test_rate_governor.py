@@ -0,0 +1,55 @@
+import threading
+import time
+from utils import rate_governor
+from utils.rate_governor import RateGovernor, PRIORITY_LIVE, PRIORITY_BACKFILL
+
+
+def acquire_in_thread(governor, priority, timeout):
+    """ Runs acquire in a thread and returns whether it got through before the timeout """
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (governor.acquire(priority), done.set()), daemon=True)
+    thread.start()
+    return done.wait(timeout)
+
+
+def test_backfill_acquires_at_min_rate():
+    governor = RateGovernor(max_rate=10, min_rate=1)
+
+    # Five 429s take the rate down to min_rate
+    for _ in range(5):
+        governor.record_response(429, 0.1)
+    assert governor.get_stats()["rate"] == 1.0
+
+    # Empty the bucket so backfill has to wait for it to refill
+    governor.acquire(PRIORITY_LIVE)
+
+    assert acquire_in_thread(governor, PRIORITY_BACKFILL, timeout=3)
+    assert governor.get_stats()["backfill_requests"] == 1
+
+
+def test_backfill_leaves_reserve_for_live(monkeypatch):
+    # Freeze the clock so the bucket doesn't refill while the test runs
+    now = time.monotonic()
+    monkeypatch.setattr(rate_governor.time, "monotonic", lambda: now)
+
+    governor = RateGovernor(max_rate=10, min_rate=1, live_reserve=0.5)
+    governor.tokens = 3.0
+
+    # Backfill needs 1 + 9 * 0.5 tokens, live only needs one
+    assert not acquire_in_thread(governor, PRIORITY_BACKFILL, timeout=0.2)
+    assert acquire_in_thread(governor, PRIORITY_LIVE, timeout=0.2)
+
+
+def test_rate_limit_halves_and_recovers():
+    governor = RateGovernor(max_rate=10, min_rate=2)
+
+    governor.record_response(429, 0.1)
+    assert governor.rate == 5.0
+
+    for _ in range(10):
+        governor.record_response(429, 0.1)
+    assert governor.rate == 2.0
+
+    for _ in range(100):
+        governor.record_response(200, 0.1)
+    assert governor.rate == 10.0
@@ -0,0 +1,237 @@
+import pytest
+from pymongo.errors import BulkWriteError
+from db.MongoDB import MongoDB
+from db.RewardsBuffer import RewardsBuffer
+from helpers import make_transactions, expected_totals
+
+DISTRIBUTOR = "distributor1"
+
+
+def make_batch(distributor, signatures, wallets):
+    """ A RewardsBuffer batch paying each wallet its amount in sol """
+    return {
+        "wallets": {
+            wallet_address: {"distributors": {distributor: {"tokens": {"sol": {"total_amount": amount}}}}}
+            for wallet_address, amount in wallets.items()
+        },
+        "distributor": distributor,
+        "signatures": list(signatures),
+    }
+
+
+def get_sol_total(mongo_db, wallet_address, distributor=DISTRIBUTOR):
+    wallet = mongo_db.get_wallet_rewards(wallet_address)
+    if not wallet:
+        return 0
+    return wallet["distributors"][distributor]["tokens"]["sol"]["total_amount"]
+
+
+def get_all_totals(controller, wallets):
+    """ The sol totals of the wallets in MongoDB and in the local SQLite totals """
+    mongo = {}
+    local = {}
+    for wallet_address in wallets:
+        mongo[wallet_address] = get_sol_total(controller.db, wallet_address)
+        wallet = controller.sqlite_db.get_wallet_data(wallet_address)
+        local[wallet_address] = wallet["distributors"][DISTRIBUTOR]["tokens"]["sol"]["total_amount"] if wallet else 0
+    return mongo, local
+
+
+def assert_totals(controller, transactions):
+    expected = expected_totals(transactions)
+    mongo, local = get_all_totals(controller, expected)
+    assert mongo == pytest.approx(expected)
+    assert local == pytest.approx(expected)
+
+
+class FailingCollection:
+    """ Passes everything through to the collection except bulk_write, which fails like a rejected write """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, *args, **kwargs):
+        raise BulkWriteError({"writeErrors": [{"index": 0, "code": 2, "errmsg": "bad value"}], "nModified": 0})
+
+
+@pytest.fixture
+def mongo_db(mongo_client):
+    mongo_db = MongoDB(mongo_url="mongodb://localhost")
+    mongo_db.create_indexes()
+    return mongo_db
+
+
+def test_failed_write_keeps_batches_out_of_the_ledger(mongo_db, monkeypatch):
+    collection = mongo_db.get_wallet_rewards_collection()
+    monkeypatch.setattr(mongo_db, "get_wallet_rewards_collection", lambda: FailingCollection(collection))
+
+    buffer = RewardsBuffer(lambda batches: mongo_db.apply_wallet_rewards(batches)["updated"], flush_interval=3600)
+    buffer.add("batch1", make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0})["wallets"], DISTRIBUTOR, ["sig1"])
+
+    assert buffer.flush() is False
+    assert mongo_db._db.reward_batches.count_documents({"status": {"$ne": "pending"}}) == 0
+    assert mongo_db._db.processed_signatures.count_documents({}) == 0
+    assert "batch1" in buffer.batches
+
+    # The retry goes through once the collection is back
+    monkeypatch.setattr(mongo_db, "get_wallet_rewards_collection", lambda: collection)
+    assert buffer.close() is True
+    assert get_sol_total(mongo_db, "wallet1") == 1.0
+    assert list(mongo_db._db.reward_batches.find({}, {"status": 1})) == [{"_id": "batch1", "status": "applied"}]
+
+
+class PartialCollection(FailingCollection):
+    """ Applies the first ops of a bulk_write and fails the rest, like an unordered write that dies part way """
+
+    def __init__(self, collection, applied_ops):
+        super().__init__(collection)
+        self.applied_ops = applied_ops
+
+    def bulk_write(self, bulk_ops, **kwargs):
+        self.collection.bulk_write(bulk_ops[: self.applied_ops], **kwargs)
+        raise BulkWriteError(
+            {"writeErrors": [{"index": self.applied_ops, "code": 2, "errmsg": "bad value"}], "nModified": self.applied_ops}
+        )
+
+
+@pytest.mark.parametrize("layout", ["nested", "flat"])
+def test_retry_after_partial_write_doesnt_double_count(mongo_db, monkeypatch, layout):
+    mongo_db.wallet_rewards_layout = layout
+    collection = mongo_db.get_wallet_rewards_collection()
+    batches = {
+        "batch1": make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0, "wallet2": 2.0, "wallet3": 3.0}),
+        "batch2": make_batch(DISTRIBUTOR, ["sig2"], {"wallet1": 10.0, "wallet4": 4.0}),
+    }
+
+    # batch1 creates and increments wallet1 and creates wallet2 before the write fails
+    monkeypatch.setattr(mongo_db, "get_wallet_rewards_collection", lambda: PartialCollection(collection, 3))
+    with pytest.raises(BulkWriteError):
+        mongo_db.apply_wallet_rewards(batches)
+    assert get_sol_total(mongo_db, "wallet1") == 1.0
+
+    monkeypatch.setattr(mongo_db, "get_wallet_rewards_collection", lambda: collection)
+    result = mongo_db.apply_wallet_rewards(batches)
+
+    assert result["applied"] == ["batch1", "batch2"]
+    assert {wallet: get_sol_total(mongo_db, wallet) for wallet in ["wallet1", "wallet2", "wallet3", "wallet4"]} == {
+        "wallet1": 11.0,
+        "wallet2": 2.0,
+        "wallet3": 3.0,
+        "wallet4": 4.0,
+    }
+
+    # Nothing is left marked and both batches are replays now
+    assert collection.count_documents({"applying_batches": {"$ne": []}}) == 0
+    assert mongo_db.apply_wallet_rewards(batches)["replayed"] == ["batch1", "batch2"]
+
+
+def test_replayed_batch_is_applied_once(mongo_db):
+    batches = {"batch1": make_batch(DISTRIBUTOR, ["sig1", "sig2"], {"wallet1": 1.0, "wallet2": 2.0})}
+
+    assert mongo_db.apply_wallet_rewards(batches)["applied"] == ["batch1"]
+    result = mongo_db.apply_wallet_rewards(batches)
+
+    assert result["applied"] == []
+    assert result["replayed"] == ["batch1"]
+    assert get_sol_total(mongo_db, "wallet1") == 1.0
+    assert get_sol_total(mongo_db, "wallet2") == 2.0
+
+
+def test_batch_with_processed_signature_is_dropped(mongo_db):
+    mongo_db.apply_wallet_rewards({"batch1": make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0})})
+
+    # Another writer batched sig1 with a new signature, under a different id
+    result = mongo_db.apply_wallet_rewards({"batch2": make_batch(DISTRIBUTOR, ["sig1", "sig2"], {"wallet1": 5.0})})
+
+    assert result["dropped"] == ["batch2"]
+    assert get_sol_total(mongo_db, "wallet1") == 1.0
+    assert mongo_db.get_processed_signatures(DISTRIBUTOR, ["sig1", "sig2"]) == {"sig1"}
+
+
+def test_pending_replay_is_dropped_by_the_buffer():
+    written = []
+    buffer = RewardsBuffer(lambda batches: written.append(sorted(batches)) or len(batches), flush_interval=3600)
+
+    batch = make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0})
+    buffer.add("batch1", batch["wallets"], DISTRIBUTOR, batch["signatures"])
+    buffer.add("batch1", batch["wallets"], DISTRIBUTOR, batch["signatures"])
+
+    assert buffer.get_pending_signatures(["sig1", "sig2"]) == {"sig1"}
+    assert buffer.close() is True
+    assert written == [["batch1"]]
+    assert buffer.get_stats()["replayed"] == 1
+
+
+def test_callbacks_run_after_their_write_succeeds():
+    events = []
+    failures = [RuntimeError("write failed")]
+
+    def write(batches):
+        if failures:
+            events.append("failed write")
+            raise failures.pop()
+        events.append("write")
+        return len(batches)
+
+    buffer = RewardsBuffer(write, flush_interval=3600)
+    batch = make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0})
+    buffer.add("batch1", batch["wallets"], DISTRIBUTOR, batch["signatures"], lambda: events.append("callback"))
+
+    assert buffer.flush() is False
+    assert events == ["failed write"]
+
+    assert buffer.flush() is True
+    assert events == ["failed write", "write", "callback"]
+
+
+def test_local_totals_skip_replayed_batches(controller):
+    batches = {
+        "batch1": make_batch(DISTRIBUTOR, ["sig1"], {"wallet1": 1.0}),
+        "batch2": make_batch(DISTRIBUTOR, ["sig2"], {"wallet1": 2.0}),
+    }
+
+    # Only the batches MongoDB kept are added
+    assert controller.sqlite_db.apply_wallet_rewards(batches, ["batch1"]) == 1
+    assert controller.sqlite_db.apply_wallet_rewards(batches) == 1
+    assert controller.sqlite_db.apply_wallet_rewards(batches) == 0
+
+    assert get_all_totals(controller, ["wallet1"])[1] == {"wallet1": 3.0}
+
+
+def test_applied_and_pending_signatures_are_skipped(controller):
+    transactions = make_transactions(DISTRIBUTOR, 40)
+
+    assert controller.apply_distributor_transactions(DISTRIBUTOR, transactions[:30])["txs"] == 30
+
+    # Still pending in the buffer
+    assert controller.apply_distributor_transactions(DISTRIBUTOR, transactions[20:40])["skipped"] == 10
+    assert controller.rewards_buffer.flush()
+
+    # Already in processed_signatures
+    assert controller.apply_distributor_transactions(DISTRIBUTOR, transactions)["skipped"] == 40
+    assert controller.rewards_buffer.flush()
+
+    assert_totals(controller, transactions)
+
+
+def test_retry_after_local_write_fails_only_adds_what_is_missing(controller, monkeypatch):
+    transactions = make_transactions(DISTRIBUTOR, 30)
+    apply_wallet_rewards = controller.sqlite_db.apply_wallet_rewards
+    calls = []
+
+    def fail_once(*args, **kwargs):
+        calls.append(1)
+        return False if len(calls) == 1 else apply_wallet_rewards(*args, **kwargs)
+
+    # MongoDB commits the batch, then the local totals fail
+    monkeypatch.setattr(controller.sqlite_db, "apply_wallet_rewards", fail_once)
+    controller.apply_distributor_transactions(DISTRIBUTOR, transactions)
+    assert controller.rewards_buffer.flush() is False
+
+    # The retry is a replay for MongoDB and the first write for SQLite
+    assert controller.rewards_buffer.flush() is True
+    assert len(calls) == 2
+    assert_totals(controller, transactions)
@@ -0,0 +1,50 @@
+import threading
+from db.RewardsBuffer import RewardsBuffer
+
+
+def make_wallets(distributor, wallets):
+    return {
+        wallet_address: {"distributors": {distributor: {"tokens": {"sol": {"total_amount": amount}}}}}
+        for wallet_address, amount in wallets.items()
+    }
+
+
+def test_failing_callback_doesnt_stop_the_others():
+    ran = []
+
+    def failing_callback():
+        raise ValueError("checkpoint failed")
+
+    buffer = RewardsBuffer(lambda batches: len(batches), flush_interval=3600)
+    buffer.add("batch1", make_wallets("distributor1", {"wallet1": 1.0}), "distributor1", ["sig1"], failing_callback)
+    buffer.add("batch2", make_wallets("distributor1", {"wallet2": 1.0}), "distributor1", ["sig2"], lambda: ran.append(2))
+
+    assert buffer.close() is True
+    assert ran == [2]
+
+
+def test_flush_thread_survives_a_failing_flush(monkeypatch):
+    flushed = threading.Event()
+    calls = []
+
+    buffer = RewardsBuffer(lambda batches: len(batches), flush_interval=3600)
+
+    def flush():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("flush failed")
+        flushed.set()
+        return True
+
+    # Restart the thread on a short interval with the failing flush
+    buffer.stop_event.set()
+    buffer.thread.join()
+    buffer.stop_event.clear()
+    buffer.flush_interval = 0.01
+    monkeypatch.setattr(buffer, "flush", flush)
+    buffer.thread = threading.Thread(target=buffer.run, daemon=True)
+    buffer.thread.start()
+
+    assert flushed.wait(2)
+    assert buffer.thread.is_alive()
+    buffer.close()
@@ -0,0 +1,83 @@
+import pytest
+from db.SQLiteDB import SQLiteDB
+from utils.utils import extract_distributor_transfers
+from helpers import make_transactions
+
+DISTRIBUTOR = "distributor1"
+
+
+@pytest.fixture
+def sqlite_db(backup_dir):
+    sqlite_db = SQLiteDB()
+    sqlite_db.create_distributor_tables(DISTRIBUTOR)
+    yield sqlite_db
+    sqlite_db.close_connections()
+
+
+@pytest.fixture
+def transactions(sqlite_db):
+    transactions = make_transactions(DISTRIBUTOR, 50)
+    for tx in transactions:
+        tx["fee_payer"] = DISTRIBUTOR
+    assert sqlite_db.insert_transactions_batch(DISTRIBUTOR, transactions)
+    return transactions
+
+
+def page_signatures(pages):
+    """ The signatures and last ids of every page """
+    signatures = []
+    last_ids = []
+    for batch, last_id in pages:
+        signatures.extend(tx["signature"] for tx in batch)
+        last_ids.append(last_id)
+    return signatures, last_ids
+
+
+def test_transactions_page_by_id(sqlite_db, transactions):
+    signatures, last_ids = page_signatures(sqlite_db.get_transactions(DISTRIBUTOR, batch_size=7))
+
+    assert signatures == [tx["signature"] for tx in transactions]
+    assert last_ids == sorted(set(last_ids))
+    assert len(last_ids) == 8
+
+    # Resuming from a cursor carries on right after it
+    resumed, _ = page_signatures(sqlite_db.get_transactions(DISTRIBUTOR, after_id=last_ids[2], batch_size=7))
+    assert resumed == signatures[21:]
+    assert sqlite_db.get_transactions_count(DISTRIBUTOR, after_id=last_ids[2]) == 29
+
+
+def test_transactions_page_over_gaps_in_ids(sqlite_db, transactions):
+    # Rows deleted in the middle leave gaps that OFFSET paging would have counted
+    sqlite_db.write_distributor(DISTRIBUTOR, lambda cursor: cursor.execute("DELETE FROM temp_transactions WHERE id % 3 = 0"))
+
+    signatures, _ = page_signatures(sqlite_db.get_transactions(DISTRIBUTOR, batch_size=4))
+    assert signatures == [tx["signature"] for i, tx in enumerate(transactions) if (i + 1) % 3]
+
+
+def test_transaction_id_ranges_cover_every_row(sqlite_db, transactions):
+    ranges = list(sqlite_db.get_transaction_id_ranges(DISTRIBUTOR, chunk_size=15))
+    assert ranges == [(1, 15), (16, 30), (31, 45), (46, 50)]
+    assert list(sqlite_db.get_transaction_id_ranges(DISTRIBUTOR, after_id=45, chunk_size=15)) == [(46, 50)]
+
+
+def test_transfers_page_by_id(sqlite_db, transactions):
+    batch, mints = extract_distributor_transfers(transactions, DISTRIBUTOR)
+    batch.map_tokens({})
+    assert sqlite_db.insert_transfer_batch(DISTRIBUTOR, batch) is not False
+
+    transfers = []
+    last_ids = []
+    for page, last_id in sqlite_db.get_transfers(DISTRIBUTOR, batch_size=9):
+        transfers.extend(page)
+        last_ids.append(last_id)
+
+    assert len(transfers) == 100
+    assert last_ids == sorted(set(last_ids))
+    assert [transfer["signature"] for transfer in transfers[::2]] == [tx["signature"] for tx in transactions]
+
+    # The columns page the same rows and resume from the same cursor
+    rows = 0
+    for columns, last_id, count in sqlite_db.get_transfer_columns(DISTRIBUTOR, after_id=last_ids[0], batch_size=13):
+        assert len(columns[0]) == count
+        rows += count
+    assert rows == 100 - 9
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import pytest
+from db.SQLiteWriter import SQLiteWriter
+
+
+@pytest.fixture
+def writer():
+    writer = SQLiteWriter()
+    yield writer
+    writer.close()
+
+
+@pytest.fixture
+def path(tmp_path, writer):
+    path = str(tmp_path / "test.db")
+    writer.execute(path, lambda cursor: cursor.execute("CREATE TABLE rows (id INTEGER PRIMARY KEY)"))
+    return path
+
+
+def insert(row_id):
+    return lambda cursor: cursor.execute("INSERT INTO rows (id) VALUES (?)", (row_id,)).rowcount
+
+
+def fail(cursor):
+    raise ValueError("write failed")
+
+
+def fail_without_savepoint(cursor):
+    # Releasing the savepoint first means it can't be rolled back to, so the whole transaction is
+    cursor.execute("RELEASE write")
+    raise ValueError("write failed")
+
+
+def get_rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute("SELECT id FROM rows ORDER BY id")]
+    finally:
+        connection.close()
+
+
+def submit_together(writer, path, writes):
+    """ Holds the writer thread until every write is queued so they run as one batch """
+    release = threading.Event()
+    writer.submit(path, lambda connection: release.wait(), transaction=False)
+    futures = [writer.submit(path, write) for write in writes]
+    release.set()
+    return futures
+
+
+def test_failed_write_only_rolls_back_its_savepoint(writer, path):
+    futures = submit_together(writer, path, [insert(1), fail, insert(2)])
+
+    assert futures[0].result() == 1
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert futures[2].result() == 1
+
+    assert get_rows(path) == [1, 2]
+    assert writer.get_stats()["failed_writes"] == 1
+
+
+def test_failed_rollback_fails_the_whole_transaction(writer, path):
+    futures = submit_together(writer, path, [insert(1), fail_without_savepoint, insert(2)])
+
+    for future in futures[:2]:
+        with pytest.raises(Exception):
+            future.result()
+
+    # The write after the rollback starts a new transaction
+    assert futures[2].result() == 1
+    assert get_rows(path) == [2]
+
+
+def test_rolled_back_bulk_load_fails_every_later_write(writer, path):
+    writer.begin_bulk_load(path, commit_rows=1000)
+
+    # Returned before it is committed
+    assert writer.execute(path, insert(1), rows=1) == 1
+
+    with pytest.raises(Exception):
+        writer.execute(path, fail_without_savepoint)
+
+    with pytest.raises(RuntimeError):
+        writer.execute(path, insert(2), rows=1)
+    with pytest.raises(RuntimeError):
+        writer.flush(path)
+
+    assert writer.end_bulk_load(path) is True
+    assert writer.execute(path, insert(3)) == 1
+    assert get_rows(path) == [3]
+
+
+def test_bulk_load_commits_every_commit_rows(writer, path):
+    writer.begin_bulk_load(path, commit_rows=2)
+
+    writer.execute(path, insert(1), rows=1)
+    assert get_rows(path) == []
+
+    writer.execute(path, insert(2), rows=1)
+    assert get_rows(path) == [1, 2]
+
+    writer.execute(path, insert(3), rows=1)
+    writer.flush(path)
+    assert get_rows(path) == [1, 2, 3]
+    assert writer.end_bulk_load(path) is True
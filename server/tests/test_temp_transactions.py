@@ -0,0 +1,57 @@
+import pytest
+from db.SQLiteDB import SQLiteDB
+from helpers import make_transactions
+
+DISTRIBUTOR = "distributor1"
+
+
+@pytest.fixture
+def sqlite_db(backup_dir, monkeypatch):
+    monkeypatch.setenv("TEMP_TX_ENCODING", "struct")
+    sqlite_db = SQLiteDB()
+    sqlite_db.create_distributor_tables(DISTRIBUTOR)
+    yield sqlite_db
+    sqlite_db.close_connections()
+
+
+def make_batch(count, start=0, wallets=20):
+    transactions = make_transactions(DISTRIBUTOR, count, start, wallets)
+    for tx in transactions:
+        tx["fee_payer"] = DISTRIBUTOR
+    return transactions
+
+
+def read_native_transfers(sqlite_db):
+    return {
+        tx["signature"]: tx["native_transfers"]
+        for batch, last_id in sqlite_db.get_transactions(DISTRIBUTOR)
+        for tx in batch
+    }
+
+
+def test_failed_commit_drops_the_address_ids(sqlite_db):
+    path = sqlite_db.get_distributor_db_path(DISTRIBUTOR)
+    writer = sqlite_db.writer
+
+    # A deferred foreign key is only checked on COMMIT, so the write goes through and the commit fails
+    writer.execute(
+        path,
+        lambda cursor: cursor.execute(
+            "CREATE TABLE children (parent_id INTEGER REFERENCES temp_addresses(id) DEFERRABLE INITIALLY DEFERRED)"
+        ),
+    )
+    writer.submit(path, lambda connection: connection.execute("PRAGMA foreign_keys = ON"), transaction=False).result()
+
+    sqlite_db.begin_bulk_load(DISTRIBUTOR)
+    assert sqlite_db.insert_transactions_batch(DISTRIBUTOR, make_batch(10, wallets=10))
+    writer.execute(path, lambda cursor: cursor.execute("INSERT INTO children (parent_id) VALUES (999999)"))
+
+    with pytest.raises(Exception):
+        writer.flush(path)
+    sqlite_db.end_bulk_load(DISTRIBUTOR)
+
+    # The next batch has new wallets first, so reused ids would point them at the rolled back addresses
+    transactions = make_batch(10, start=100, wallets=7) + make_batch(10, wallets=10)
+    assert sqlite_db.insert_transactions_batch(DISTRIBUTOR, transactions)
+
+    assert read_native_transfers(sqlite_db) == {tx["signature"]: tx["native_transfers"] for tx in transactions}
@@ -0,0 +1,38 @@
+import pytest
+from utils import token_registry
+from utils.token_registry import TokenRegistry
+
+
+class FakeDB:
+    def __init__(self):
+        self.inserted = []
+
+    def get_known_tokens(self):
+        return [{"mint": "KnownMint", "symbol": "KNOWN"}]
+
+    def insert_known_tokens(self, documents):
+        self.inserted.extend(documents)
+
+
+def test_failed_lookup_is_retried(monkeypatch):
+    lookups = []
+    fetched = {"MintA": {"symbol": "AAA", "mint": "MintA"}}
+
+    def get_token_metadata_batch(mints, priority=None):
+        lookups.append(sorted(mints))
+        return {mint: fetched[mint] for mint in mints if mint in fetched}
+
+    monkeypatch.setattr(token_registry, "get_token_metadata_batch", get_token_metadata_batch)
+    registry = TokenRegistry(FakeDB())
+
+    # MintB fails, MintA is kept
+    with pytest.raises(Exception):
+        registry.resolve_mints(["KnownMint", "MintA", "MintB"])
+    assert registry.get_token_symbols(["KnownMint", "MintA"]) == {"KnownMint": "KNOWN", "MintA": "AAA"}
+    assert "mintb" not in registry.known_tokens_dict
+
+    # The next call only asks for MintB again
+    fetched["MintB"] = {"symbol": "BBB", "mint": "MintB"}
+    registry.resolve_mints(["MintA", "MintB"])
+    assert lookups == [["MintA", "MintB"], ["MintB"]]
+    assert registry.get_token_symbol("MintB") == "BBB"
@@ -1,13 +1,17 @@
-import requests
 import os
 from .utils import process_distributor_transactions
+from .helius_client import get_helius_client
+from .rate_governor import PRIORITY_LIVE, PRIORITY_BACKFILL
 from dotenv import load_dotenv
 load_dotenv()
 
+# Base url for the Helius REST api, can be pointed at the local stand-in for benchmarks
+HELIUS_API_URL = os.getenv("HELIUS_API_URL", "https://api.helius.xyz").rstrip("/")
+
 def get_historical_transactions_for_distributor(
-    distributor, before, batch_size=1000
+    distributor, before, batch_size=1000, priority=PRIORITY_BACKFILL, stop_event=None
 ):
-    """ Gets all of the transactions for a distributor """
+    """ Gets all of the transactions for a distributor, stops between pages once the stop_event is set """
     batch = []
     batch_count = 0
     total_count = 0
@@ -17,9 +21,13 @@ def get_historical_transactions_for_distributor(
     no_more_txs = False
 
     # URL for call to Helius
-    url = f"https://api.helius.xyz/v0/addresses/{distributor}/transactions"
+    url = f"{HELIUS_API_URL}/v0/addresses/{distributor}/transactions"
 
     while True:
+        # The caller is shutting down so don't start another page
+        if stop_event is not None and stop_event.is_set():
+            return
+
         # Parameters for the API call
         params = {
             "api-key": os.getenv("HELIUS_API_KEY"),
@@ -34,7 +42,7 @@ def get_historical_transactions_for_distributor(
 
         try:
             # Make the request
-            response = requests.get(url, params=params)
+            response = get_helius_client().get(url, params=params, priority=priority, stop_event=stop_event)
             response.raise_for_status()
 
             # Parse the response transactions as JSON
@@ -86,9 +94,12 @@ def get_historical_transactions_for_distributor(
 
 
 def get_new_distributor_transactions(
-    distributor, until, batch_size=1000
+    distributor, until, batch_size=1000, priority=PRIORITY_LIVE
 ):
-    """ Get all of the latest transactions base of the newest (until) signature """
+    """
+    Get all of the latest transactions base of the newest (until) signature. Errors are raised, the generator
+    only ends normally once it has paged back to until or run out of transactions
+    """
     batch = []
     batch_count = 0
     total_count = 0
@@ -96,7 +107,7 @@ def get_new_distributor_transactions(
     newest_sig = None
 
     # URL for call to Helius
-    url = f"https://api.helius.xyz/v0/addresses/{distributor}/transactions"
+    url = f"{HELIUS_API_URL}/v0/addresses/{distributor}/transactions"
 
     while True:
         # Parameters for the API call
@@ -114,7 +125,7 @@ def get_new_distributor_transactions(
 
         try:
             # Make the request
-            response = requests.get(url, params=params)
+            response = get_helius_client().get(url, params=params, priority=priority)
             response.raise_for_status()
 
             # Parse the response transactions as JSON
@@ -155,9 +166,10 @@ def get_new_distributor_transactions(
             if found_cutoff:
                 break
 
-        except:
-            print(f"Error when fetching distributor transactions from helius")
-            return 
+        except Exception as e:
+            # Raised so the caller knows the pages after this one were never fetched and keeps its last signature
+            print(f"Error when fetching distributor transactions from helius: {e}")
+            raise
 
         # Check if batch is full
         if len(batch) >= batch_size:
@@ -180,7 +192,7 @@ def get_new_distributor_transactions(
         yield {"txs": batch, "last_sig": newest_sig}
 
 
-def get_token_metadata(mint_address):
+def get_token_metadata(mint_address, priority=PRIORITY_LIVE):
     """""
     Use the Helius rpc url endpoint of getAsset to fetch a tokens metadata
     """""
@@ -205,7 +217,7 @@ def get_token_metadata(mint_address):
 
     try:
         # Helius request
-        response = requests.post(os.getenv('HELIUS_RPC_URL'), json=payload, headers=headers)
+        response = get_helius_client().post(os.getenv('HELIUS_RPC_URL'), json=payload, headers=headers, priority=priority)
         response.raise_for_status()  # Raise an error if it failed
 
         # Parse the response transactions as JSON
@@ -229,4 +241,59 @@ def get_token_metadata(mint_address):
         return token_document
     except Exception as e:
         print(f"There was an error when fetching token metadata from helius: {e}")
-        return mint_address
\ No newline at end of file
+        return mint_address
+
+def get_token_metadata_batch(mint_addresses, chunk_size=1000, priority=PRIORITY_LIVE):
+    """
+    Use the Helius rpc url endpoint of getAssetBatch to fetch the metadata for many tokens at once.
+    Returns a dict of mint -> token document, mints that couldn't be fetched are left out
+    """
+    token_documents = {}
+    mint_addresses = list(mint_addresses)
+
+    # request headers
+    headers = {"Content-Type": "application/json"}
+
+    # getAssetBatch takes at most 1000 ids per call
+    for i in range(0, len(mint_addresses), chunk_size):
+        chunk = mint_addresses[i : i + chunk_size]
+
+        # Payload for the helius getAssetBatch endpoint
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "1",
+            "method": "getAssetBatch",
+            "params": {
+                "ids": chunk,
+                "options": {
+                    "showInscription": False,
+                    "showFungible": False,
+                    "showCollectionMetadata": False,
+                    "showUnverifiedCollections": False
+                }
+            }
+        }
+
+        try:
+            # Helius request
+            response = get_helius_client().post(os.getenv('HELIUS_RPC_URL'), json=payload, headers=headers, priority=priority)
+            response.raise_for_status()  # Raise an error if it failed
+
+            # Results come back in the same order as the ids, missing assets are null
+            results = response.json().get("result") or []
+
+            for mint_address, asset in zip(chunk, results):
+                asset = asset or {}
+                metadata = asset.get("content", {}).get("metadata", {})
+
+                # Create the token document
+                token_documents[mint_address] = {
+                    "symbol": metadata.get("symbol", mint_address[:8]),  # Use truncated mint as fallback
+                    "name": metadata.get("name", "Unknown Token"),
+                    "mint": mint_address,
+                    "decimals": "unknown"
+                }
+        except Exception as e:
+            print(f"There was an error when fetching token metadata batch from helius: {e}")
+
+    return token_documents
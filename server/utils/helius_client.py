@@ -0,0 +1,196 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from .rate_governor import get_rate_governor, PRIORITY_LIVE
+from dotenv import load_dotenv
+load_dotenv()
+
+# Status codes that are worth retrying
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HeliusClient:
+    """
+    Shared HTTP client for every Helius call. It owns a pooled keep-alive session so pages reuse the
+    same TLS connection, puts a timeout on every request so a hung socket can't freeze the poller, and
+    retries failed calls with jittered exponential backoff that respects the Retry-After header on 429s.
+    Every attempt waits on the rate governor first so all Helius traffic shares one request budget.
+    """
+
+    def __init__(
+        self,
+        governor=None,
+        timeout=(5, 30),
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_max=30,
+        pool_size=20,
+    ):
+        # (connect, read) timeout in seconds
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Shared request budget, None means unthrottled
+        self.governor = governor
+
+        # Pooled session with connection reuse across threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Counters exposed through get_stats
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def get(self, url, params=None, priority=PRIORITY_LIVE, **kwargs):
+        """ GET request with retries """
+        return self.request("GET", url, priority=priority, params=params, **kwargs)
+
+    def post(self, url, json=None, priority=PRIORITY_LIVE, **kwargs):
+        """ POST request with retries """
+        return self.request("POST", url, priority=priority, json=json, **kwargs)
+
+    def request(self, method, url, priority=PRIORITY_LIVE, stop_event=None, **kwargs):
+        """
+        Makes a request retrying on connection errors, timeouts, 429s and 5xx responses. Returns the last
+        response so callers can still use raise_for_status, or raises the last connection error. Setting the
+        stop_event cuts the backoff short and hands back the last failure without retrying again
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+
+        while True:
+            # Wait for our turn in the shared request budget
+            if self.governor is not None:
+                self.governor.acquire(priority)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                error = e
+
+            latency = time.perf_counter() - start
+            self.record_request(latency)
+
+            if self.governor is not None:
+                self.governor.record_response(response.status_code if response is not None else None, latency)
+
+            # Success or an error that retrying won't fix
+            if error is None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            if response is not None and response.status_code == 429:
+                with self._lock:
+                    self.rate_limited += 1
+
+            # Out of retries so hand back the failure
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self.failures += 1
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self.get_retry_delay(attempt, response)
+            with self._lock:
+                self.retries += 1
+
+            # A 429 applies to the whole API key so hold back every caller, not just this one
+            if self.governor is not None and response is not None and response.status_code == 429:
+                self.governor.pause(delay)
+
+            attempt += 1
+            if stop_event is None:
+                time.sleep(delay)
+            elif stop_event.wait(delay):
+                # The caller is stopping so hand back the failure instead of retrying
+                if error is not None:
+                    raise error
+                return response
+
+    def get_retry_delay(self, attempt, response=None):
+        """
+        Uses the Retry-After header when Helius sends one, otherwise full jitter exponential backoff
+        """
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def record_request(self, latency):
+        """ Updates the request and latency counters """
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def get_stats(self):
+        """ Returns a snapshot of the request, retry and latency counters """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rate_limited": self.rate_limited,
+                "avg_latency": self.total_latency / self.requests if self.requests else 0.0,
+                "max_latency": self.max_latency,
+            }
+
+    def close(self):
+        """ Closes the pooled connections """
+        self.session.close()
+
+
+def parse_retry_after(value):
+    """ Retry-After can either be a number of seconds or an HTTP date """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Process wide client so every Helius call shares the same connection pool
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_helius_client():
+    """ Returns the shared HeliusClient creating it on first use """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HeliusClient(
+                governor=get_rate_governor(os.getenv("HELIUS_API_KEY")),
+                timeout=(
+                    float(os.getenv("HELIUS_CONNECT_TIMEOUT", 5)),
+                    float(os.getenv("HELIUS_READ_TIMEOUT", 30)),
+                ),
+                max_retries=int(os.getenv("HELIUS_MAX_RETRIES", 5)),
+            )
+        return _client
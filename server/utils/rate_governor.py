@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+# Request priorities, live polling always goes before backfill traffic
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 1
+
+
+class RateGovernor:
+    """
+    Token bucket that every Helius call has to go through. The rate starts at the configured requests per
+    second budget and adapts to what Helius tells us: it is cut in half on a 429, eased down when latency
+    climbs past the target and slowly grows back while responses are healthy. Live polling has priority,
+    backfill requests wait while live requests are queued and can't drain the reserve kept for live traffic.
+    """
+
+    def __init__(self, max_rate, min_rate=1.0, latency_target=2.0, live_reserve=0.2):
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min(min_rate, max_rate))
+        self.rate = self.max_rate
+        self.latency_target = latency_target
+
+        # Fraction of the bucket above one token that only live requests can use
+        self.live_reserve = live_reserve
+
+        # Bucket holds up to one second worth of requests
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+
+        self.condition = threading.Condition()
+        self.live_waiting = 0
+
+        # Counters exposed through get_stats
+        self.acquired = {PRIORITY_LIVE: 0, PRIORITY_BACKFILL: 0}
+        self.wait_time = {PRIORITY_LIVE: 0.0, PRIORITY_BACKFILL: 0.0}
+        self.rate_limited = 0
+        self.slow_responses = 0
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate)
+
+    def refill(self, now):
+        """ Adds the tokens earned since the last refill """
+        elapsed = now - self.last_refill
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.last_refill = now
+
+    def acquire(self, priority=PRIORITY_LIVE):
+        """ Blocks until the request is allowed to go out and returns how long it waited """
+        start = time.monotonic()
+
+        with self.condition:
+            if priority == PRIORITY_LIVE:
+                self.live_waiting += 1
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+
+                    # Backfill leaves a reserve in the bucket and gives way to queued live requests
+                    if priority == PRIORITY_LIVE:
+                        needed = 1.0
+                        blocked = False
+                    else:
+                        # The reserve comes out of the tokens above the one a request needs, so a backfill
+                        # request can still get through when the rate is down at min_rate
+                        needed = 1.0 + (self.capacity - 1.0) * self.live_reserve
+                        blocked = self.live_waiting > 0
+
+                    if now >= self.paused_until and not blocked and self.tokens >= needed:
+                        self.tokens -= 1.0
+                        break
+
+                    # Sleep until there should be enough tokens or the pause is over
+                    wait = max(self.paused_until - now, (needed - self.tokens) / self.rate, 0.01)
+                    self.condition.wait(timeout=wait)
+            finally:
+                if priority == PRIORITY_LIVE:
+                    self.live_waiting -= 1
+                    self.condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.acquired[priority] += 1
+            self.wait_time[priority] += waited
+
+        return waited
+
+    def record_response(self, status_code, latency):
+        """ Adapts the rate based on the response status and latency """
+        with self.condition:
+            if status_code == 429:
+                # Multiplicative decrease when Helius says we're going too fast
+                self.rate_limited += 1
+                self.rate = max(self.min_rate, self.rate * 0.5)
+                self.tokens = min(self.tokens, self.capacity)
+            elif latency > self.latency_target:
+                # Ease off when responses get slow
+                self.slow_responses += 1
+                self.rate = max(self.min_rate, self.rate * 0.9)
+                self.tokens = min(self.tokens, self.capacity)
+            elif status_code is not None and status_code < 400:
+                # Additive increase back up to the budget
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.02)
+
+    def pause(self, seconds):
+        """ Stops every request from going out for the given seconds (used for Retry-After) """
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def get_stats(self):
+        """ Returns a snapshot of the current rate and the wait counters """
+        with self.condition:
+            return {
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "rate_limited": self.rate_limited,
+                "slow_responses": self.slow_responses,
+                "live_requests": self.acquired[PRIORITY_LIVE],
+                "backfill_requests": self.acquired[PRIORITY_BACKFILL],
+                "live_wait_time": self.wait_time[PRIORITY_LIVE],
+                "backfill_wait_time": self.wait_time[PRIORITY_BACKFILL],
+            }
+
+
+# One governor per API key since the Helius plan quota is per key
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_rate_governor(api_key=None):
+    """ Returns the shared governor for an API key creating it on first use """
+    api_key = api_key or os.getenv("HELIUS_API_KEY")
+
+    with _governors_lock:
+        if api_key not in _governors:
+            _governors[api_key] = RateGovernor(
+                max_rate=float(os.getenv("HELIUS_MAX_RPS", 10)),
+                min_rate=float(os.getenv("HELIUS_MIN_RPS", 1)),
+                latency_target=float(os.getenv("HELIUS_LATENCY_TARGET", 2.0)),
+            )
+        return _governors[api_key]
@@ -0,0 +1,120 @@
+import time
+import threading
+
+
+class PollScheduler:
+    """
+    Keeps a next due time for every distributor and adapts each distributors poll interval to how active it
+    is. When a poll finds new transactions the interval is halved down to min_interval, when it finds nothing
+    it grows by half up to max_interval. Each cycle runs the most overdue distributors first and stops adding
+    distributors once the estimated Helius requests for the cycle would go over the budget, the rest stay due
+    for the next cycle.
+    """
+
+    def __init__(self, base_interval=300, min_interval=60, max_interval=1800, request_budget=200):
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.request_budget = request_budget
+
+        self.lock = threading.Lock()
+        self.distributors = {}
+
+    def sync(self, distributors, now=None):
+        """
+        Adds newly supported distributors as due right away and removes ones that are no longer supported
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            for distributor in distributors:
+                if distributor not in self.distributors:
+                    self.distributors[distributor] = {
+                        "interval": self.base_interval,
+                        "next_due": now,
+                        "last_polled": None,
+                        "last_txs": 0,
+                        "last_duration": 0.0,
+                        "estimated_requests": 1,
+                    }
+
+            for distributor in set(self.distributors) - set(distributors):
+                del self.distributors[distributor]
+
+    def get_due(self, now=None):
+        """
+        Returns the due distributors, most overdue first, that fit in the request budget for this cycle
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            due = sorted(
+                (state["next_due"], distributor)
+                for distributor, state in self.distributors.items()
+                if state["next_due"] <= now
+            )
+
+            selected = []
+            budget_used = 0
+            for _, distributor in due:
+                cost = self.distributors[distributor]["estimated_requests"]
+
+                # Always run at least one so a single huge distributor can't starve
+                if selected and budget_used + cost > self.request_budget:
+                    break
+
+                selected.append(distributor)
+                budget_used += cost
+
+            return selected
+
+    def record(self, distributor, txs, duration, success=True, now=None):
+        """
+        Records a finished poll and adapts the interval to the number of new transactions found. A failed
+        poll keeps its interval and is retried after min_interval
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            state = self.distributors.get(distributor)
+            if state is None:
+                return
+
+            if not success:
+                state["last_duration"] = duration
+                state["next_due"] = now + self.min_interval
+                return
+
+            if txs > 0:
+                state["interval"] = max(self.min_interval, state["interval"] / 2)
+            else:
+                state["interval"] = min(self.max_interval, state["interval"] * 1.5)
+
+            # Helius pages are 100 txs and there is always the page that finds the cutoff
+            state["estimated_requests"] = txs // 100 + 1
+
+            state["last_polled"] = now
+            state["last_txs"] = txs
+            state["last_duration"] = duration
+            state["next_due"] = now + state["interval"]
+
+    def get_status(self, now=None):
+        """
+        Returns every distributors current interval, when it is due next and its lag. Lag is how far past its
+        due time a distributor is waiting and staleness is how long ago it was last polled
+        """
+        now = time.time() if now is None else now
+
+        with self.lock:
+            return [
+                {
+                    "distributor": distributor,
+                    "interval": state["interval"],
+                    "next_due_in": max(0.0, state["next_due"] - now),
+                    "lag": max(0.0, now - state["next_due"]),
+                    "staleness": now - state["last_polled"] if state["last_polled"] else None,
+                    "last_txs": state["last_txs"],
+                    "last_duration": state["last_duration"],
+                }
+                for distributor, state in sorted(self.distributors.items())
+            ]
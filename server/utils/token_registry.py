@@ -0,0 +1,86 @@
+import threading
+from .helius import get_token_metadata_batch
+from .rate_governor import PRIORITY_LIVE
+
+
+class TokenRegistry:
+    """
+    Maps token mints to their symbols. It is loaded with the known tokens from the DB and any unknown
+    mints are resolved in batches with getAssetBatch and bulk inserted into the known tokens collection.
+    Shared by the Controller and the ProjectInitializer
+    """
+
+    def __init__(self, db, priority=PRIORITY_LIVE):
+        self.db = db
+
+        # Rate governor priority used for the metadata lookups
+        self.priority = priority
+
+        known_tokens = self.db.get_known_tokens() or []
+
+        # Create a dictionary for O(1) lookups
+        self.known_tokens_dict = {
+            str(token.get("mint")).lower(): token.get("symbol")
+            for token in known_tokens
+        }
+
+        # Workers can resolve tokens at the same time so guard the fetches
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.known_tokens_dict)
+
+    def resolve_mints(self, mint_addresses):
+        """
+        Makes sure every mint in the list has a symbol. All of the unknown mints are fetched with one
+        (chunked) getAssetBatch call and bulk inserted into the known tokens. Raises if some of them couldn't
+        be fetched so the transfers aren't recorded under the wrong token, those are fetched again on the
+        next call
+        """
+        unknown_mints = {
+            mint for mint in mint_addresses if mint.lower() not in self.known_tokens_dict
+        }
+        if not unknown_mints:
+            return
+
+        with self.lock:
+            # Another worker may have resolved them while we waited
+            unknown_mints = [
+                mint for mint in unknown_mints if mint.lower() not in self.known_tokens_dict
+            ]
+            if not unknown_mints:
+                return
+
+            token_documents = get_token_metadata_batch(unknown_mints, priority=self.priority)
+
+            # Add them to the database
+            if token_documents:
+                self.db.insert_known_tokens(list(token_documents.values()))
+
+            # Mints that failed are left out of the cache so they are fetched again
+            for mint, token_document in token_documents.items():
+                self.known_tokens_dict[mint.lower()] = token_document["symbol"]
+
+            print(f"Resolved {len(token_documents)}/{len(unknown_mints)} new tokens")
+
+            if len(token_documents) < len(unknown_mints):
+                raise Exception(
+                    f"Couldn't fetch the metadata for {len(unknown_mints) - len(token_documents)} token mints"
+                )
+
+    def get_token_symbol(self, mint_address):
+        """
+        Checks if the mint address is in the known list of tokens, if it isn't then we get the token metadata and instert it into the DB
+        """
+        mint_lower = mint_address.lower()
+
+        if mint_lower not in self.known_tokens_dict:
+            self.resolve_mints([mint_address])
+
+        return self.known_tokens_dict[mint_lower]
+
+    def get_token_symbols(self, mint_addresses):
+        """
+        Returns a mint -> symbol dict for mints that have already been resolved with resolve_mints
+        """
+        return {mint: self.known_tokens_dict[mint.lower()] for mint in mint_addresses}
@@ -0,0 +1,76 @@
+import sys
+from array import array
+
+
+class TransferBatch:
+    """
+    Columnar batch of transfers for one distributor. The signature, slot and timestamp are stored once per
+    transaction and every transfer points back to its transaction by index, so they aren't repeated on every
+    row. Wallet addresses are interned so a wallet that shows up in many transactions is one string, and the
+    amounts, slots and timestamps live in typed arrays instead of boxed Python objects.
+    """
+
+    __slots__ = (
+        "distributor",
+        "signatures",
+        "slots",
+        "timestamps",
+        "tx_index",
+        "wallets",
+        "tokens",
+        "amounts",
+    )
+
+    def __init__(self, distributor):
+        self.distributor = sys.intern(distributor) if distributor else ""
+
+        # Per transaction fields shared by all of the transfers in the transaction
+        self.signatures = []
+        self.slots = array("q")
+        self.timestamps = array("q")
+
+        # Per transfer columns
+        self.tx_index = array("q")
+        self.wallets = []
+        self.tokens = []
+        self.amounts = array("d")
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def add_transaction(self, signature, slot, timestamp):
+        """ Adds the shared fields of a transaction and returns its index for add_transfer """
+        self.signatures.append(signature or "")
+        self.slots.append(slot or 0)
+        self.timestamps.append(timestamp or 0)
+        return len(self.signatures) - 1
+
+    def add_transfer(self, tx, wallet_address, token, amount):
+        """ Adds a transfer for the transaction at index tx """
+        self.tx_index.append(tx)
+        self.wallets.append(sys.intern(wallet_address))
+        self.tokens.append(token)
+        self.amounts.append(amount or 0.0)
+
+    def map_tokens(self, symbols):
+        """ Swaps the tokens found in symbols, used to replace mint addresses with their symbols """
+        if symbols:
+            self.tokens = [symbols.get(token, token) for token in self.tokens]
+
+    def rows(self):
+        """
+        Yields a (signature, slot, timestamp, amount, token, wallet_address, distributor) tuple per transfer in
+        the column order of the transfers table, ready for executemany
+        """
+        signatures, slots, timestamps = self.signatures, self.slots, self.timestamps
+        distributor = self.distributor
+
+        for tx, wallet_address, token, amount in zip(self.tx_index, self.wallets, self.tokens, self.amounts):
+            yield (signatures[tx], slots[tx], timestamps[tx], amount, token, wallet_address, distributor)
+
+    def columns(self):
+        """
+        Returns the (wallets, distributor, tokens, amounts) columns for aggregate_transfer_columns, every
+        transfer has the one distributor of the batch
+        """
+        return self.wallets, self.distributor, self.tokens, self.amounts
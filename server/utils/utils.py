@@ -1,85 +1,108 @@
 import time
+import hashlib
 import threading
+import numpy as np
+from itertools import repeat
+from .transfer_batch import TransferBatch
+
+# Base58 alphabet in sort order, Solana addresses only use these characters
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+# Smallest batch aggregate_transfer_columns does the numpy grouped sum for, see bench_aggregate
+VECTORIZE_MIN_ROWS = 20000
+
+def project_native_transfers(native_transfers):
+    """
+    Keeps only the fields we use from Helius nativeTransfers as compact [toUserAccount, amount] pairs.
+    Transfers without a receiving wallet are dropped. Already projected lists are returned as they are
+    """
+    if not native_transfers or not isinstance(native_transfers[0], dict):
+        return native_transfers or []
+
+    return [
+        [tf["toUserAccount"], tf.get("amount", 0)]
+        for tf in native_transfers
+        if tf.get("toUserAccount")
+    ]
+
+def project_token_transfers(token_transfers):
+    """
+    Keeps only the fields we use from Helius tokenTransfers as compact [toUserAccount, tokenAmount, mint]
+    triples. Transfers without a receiving wallet or mint are dropped. Already projected lists are returned as they are
+    """
+    if not token_transfers or not isinstance(token_transfers[0], dict):
+        return token_transfers or []
+
+    return [
+        [tf["toUserAccount"], tf.get("tokenAmount", 0), tf["mint"]]
+        for tf in token_transfers
+        if tf.get("toUserAccount") and tf.get("mint")
+    ]
 
 def process_distributor_transactions(transactions):
-    """ Filters a transaction and extracts the feePayer, signature, slot, timestamp, and native/spl transfers """
+    """
+    Filters a transaction and extracts the feePayer, signature, slot, timestamp, and native/spl transfers.
+    The transfers are projected down to the fields we use so the rest of the payload can be freed right away
+    """
     filtered_txs = []
     # Loop through txs and add filtered txs to the batch list
     for tx in transactions:
-        token_transfers = tx.get("tokenTransfers", [])
-        native_transfers = tx.get("nativeTransfers", [])
-
         filtered_txs.append(
             {
                 "fee_payer": tx.get("feePayer"),
                 "signature": tx.get("signature"),
                 "slot": tx.get("slot"),
                 "timestamp": tx.get("timestamp"),
-                "token_transfers": token_transfers,
-                "native_transfers": native_transfers,
+                "token_transfers": project_token_transfers(tx.get("tokenTransfers")),
+                "native_transfers": project_native_transfers(tx.get("nativeTransfers")),
             }
         )
     return filtered_txs
 
-def process_distributor_transfers(app, transactions, distributor):
-    """ Creates a list of transfers """
-    total_transfers = []
+def process_distributor_transfers(token_registry, transactions, distributor):
+    """
+    Creates a TransferBatch from transactions with projected transfers. The unknown token mints in the
+    batch are collected first and resolved in one batched call so the loop never stops for a metadata lookup
+    """
+    batch, mints = extract_distributor_transfers(transactions, distributor)
+
+    # Resolve all of the token mints in the batch at once and swap them for their symbols
+    token_registry.resolve_mints(mints)
+    batch.map_tokens(token_registry.get_token_symbols(mints))
+
+    return batch
+
+def extract_distributor_transfers(transactions, distributor):
+    """
+    Creates a TransferBatch from transactions with projected transfers where the spl transfers still have
+    their mint address as the token. Returns the batch and the set of mints so the symbols can be resolved
+    separately, the process pool workers don't have a token registry
+    """
+    batch = TransferBatch(distributor)
+    mints = set()
 
     # Loop through each transaction
     for tx in transactions:
-        signature = tx.get("signature")
-        slot = tx.get("slot")
-        timestamp = tx.get("timestamp")
-        native_transfers = tx.get("native_transfers", [])
-        token_transfers = tx.get("token_transfers", [])
-
-        # Native sol transfers list
-        for tf in native_transfers:
-            # Get the user wallet
-            to_user_account = tf.get("toUserAccount")
-
-            # Skip if None or empty
-            if to_user_account:
-                # Normailize price
-                amount = tf.get("amount", 0) / 1e9
-
-                # Add to transfer to total_transfers list
-                total_transfers.append({
-                    "signature": signature,
-                    "slot": slot,
-                    "timestamp": timestamp,
-                    "amount": amount,
-                    "token": "sol",
-                    "wallet_address": to_user_account,
-                    "distributor": distributor,
-                })
+        # Temp rows saved before the transfers were projected still hold the full Helius objects
+        native_transfers = project_native_transfers(tx.get("native_transfers"))
+        token_transfers = project_token_transfers(tx.get("token_transfers"))
+
+        if not native_transfers and not token_transfers:
+            continue
+
+        # The signature, slot and timestamp are stored once for all of the transfers in the tx
+        tx_idx = batch.add_transaction(tx.get("signature"), tx.get("slot"), tx.get("timestamp"))
+
+        # Native sol transfers list, normailize the price
+        for to_user_account, amount in native_transfers:
+            batch.add_transfer(tx_idx, to_user_account, "sol", amount / 1e9)
 
         # SPL transfers list
-        for tf in token_transfers:
-            # Get user wallet and token mint
-            to_user_account = tf.get("toUserAccount")
-            mint = tf.get('mint')
-
-             # Skip if either is None or empty
-            if to_user_account and mint:
-                amount = tf.get("tokenAmount", 0)
-
-                # Gets the the token symbol from the known tokens or adds the token
-                # to the known tokens
-                token = app.get_token_symbol(mint)
-
-                # Add to transfer to total_transfers list
-                total_transfers.append({
-                    "signature": signature,
-                    "slot": slot,
-                    "timestamp": timestamp,
-                    "amount": amount,
-                    "token": token,
-                    "wallet_address": to_user_account,
-                    "distributor": distributor,
-                })
-
-    return total_transfers
+        for to_user_account, amount, mint in token_transfers:
+            batch.add_transfer(tx_idx, to_user_account, mint, amount)
+            mints.add(mint)
+
+    return batch, mints
 
 def aggregate_transfers(transfers):
     """ Adds all of the rewards together """
@@ -122,6 +145,130 @@ def aggregate_transfers(transfers):
 
     return wallets
 
+def factorize(values):
+    """
+    Maps each value in a column to an integer code. Returns the unique values in order of first appearance
+    and a numpy array with the code for every row
+    """
+    index = {}
+    setdefault = index.setdefault
+
+    # One pass, a new value gets the next code
+    codes = np.fromiter([setdefault(value, len(index)) for value in values], dtype=np.int64, count=len(values))
+    return list(index), codes
+
+def sum_transfer_columns(wallets, distributors, tokens, amounts):
+    """
+    One pass over the columns into the nested totals, faster than the grouped sum for small batches where
+    most rows are a group of their own. distributors is a column or the one distributor of the batch
+    """
+    if isinstance(distributors, str):
+        distributors = repeat(distributors)
+
+    aggregated = {}
+    for wallet_address, distributor, token, amount in zip(wallets, distributors, tokens, amounts):
+        wallet = aggregated.get(wallet_address)
+        if wallet is None:
+            wallet = aggregated[wallet_address] = {"distributors": {}}
+
+        distributor_data = wallet["distributors"].get(distributor)
+        if distributor_data is None:
+            distributor_data = wallet["distributors"][distributor] = {"tokens": {}}
+
+        total = distributor_data["tokens"].get(token)
+        if total is None:
+            distributor_data["tokens"][token] = {"total_amount": amount}
+        else:
+            total["total_amount"] += amount
+
+    return aggregated
+
+def aggregate_transfer_columns(wallets, distributors, tokens, amounts):
+    """
+    Vectorized version of aggregate_transfers for columnar batches. Takes equal length columns of wallet
+    addresses, tokens and amounts and the distributors, as a column or as the one distributor of the
+    batch, and does a grouped sum with numpy instead of walking the nested dict for every transfer. Batches
+    under VECTORIZE_MIN_ROWS are summed in one Python pass instead. Returns the same nested shape as
+    aggregate_transfers
+    """
+    if len(wallets) == 0:
+        return {}
+
+    # The numpy setup only pays off once there are a lot more rows than wallets
+    if len(wallets) < VECTORIZE_MIN_ROWS:
+        return sum_transfer_columns(wallets, distributors, tokens, amounts)
+
+    # Turn the string columns into integer codes, the distributor is usually one value for the whole batch
+    if isinstance(distributors, str):
+        distributor_values, distributor_codes = [distributors], 0
+    else:
+        distributor_values, distributor_codes = factorize(distributors)
+    wallet_values, wallet_codes = factorize(wallets)
+    token_values, token_codes = factorize(tokens)
+
+    # Combine the three codes into one group key per row
+    distributor_count = len(distributor_values)
+    token_count = len(token_values)
+    keys = (wallet_codes * distributor_count + distributor_codes) * token_count + token_codes
+
+    # Grouped sum of the amounts by key
+    group_keys, inverse = np.unique(keys, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.asarray(amounts, dtype=np.float64))
+
+    # Split the group keys back into (wallet, distributor) and token codes
+    token_idx = group_keys % token_count
+    owner_idx = group_keys // token_count
+
+    # The keys come back sorted so every (wallet, distributor) is one run, its tokens dict is only built once
+    aggregated = {}
+    last_owner = -1
+    tokens_data = None
+    for owner, t, total in zip(owner_idx.tolist(), token_idx.tolist(), totals.tolist()):
+        if owner != last_owner:
+            last_owner = owner
+            w, d = divmod(owner, distributor_count)
+
+            wallet = aggregated.get(wallet_values[w])
+            if wallet is None:
+                wallet = aggregated[wallet_values[w]] = {"distributors": {}}
+
+            tokens_data = {}
+            wallet["distributors"][distributor_values[d]] = {"tokens": tokens_data}
+
+        tokens_data[token_values[t]] = {"total_amount": total}
+
+    return aggregated
+
+def wallet_totals_to_rewards(totals, distributor):
+    """
+    Turns (wallet_address, token, total_amount) rows summed by SQLite into the nested shape
+    that insert_wallet_rewards takes
+    """
+    wallets = {}
+    for wallet_address, token, total_amount in totals:
+        wallet = wallets.setdefault(wallet_address, {"distributors": {distributor: {"tokens": {}}}})
+        wallet["distributors"][distributor]["tokens"][token] = {"total_amount": total_amount}
+    return wallets
+
+def get_batch_id(distributor, signatures):
+    """
+    Deterministic id for a batch of a distributors transactions. The signature range is kept readable and a
+    hash of every signature in the batch tells apart batches with the same ends
+    """
+    digest = hashlib.sha256("\n".join([distributor, *signatures]).encode()).hexdigest()[:24]
+    first, last = (signatures[0], signatures[-1]) if signatures else ("", "")
+    return f"{distributor}:{first[:16]}-{last[:16]}:{len(signatures)}:{digest}"
+
+def get_wallet_prefix_ranges(shards):
+    """
+    Splits the wallet address space into shards by the first character of the address. Returns a list of
+    (lower, upper) bounds, None means unbounded so anything outside the alphabet still lands in a shard
+    """
+    shards = max(1, min(shards, len(BASE58_ALPHABET)))
+    step = len(BASE58_ALPHABET) / shards
+    bounds = [BASE58_ALPHABET[round(i * step)] for i in range(1, shards)]
+    return list(zip([None] + bounds, bounds + [None]))
+
 def timer(func, seconds, *args, **kwargs):
     """
     Calls a function every 5 minutes in a separate thread.
@@ -0,0 +1,61 @@
+"""
+Moves the wallet rewards from the nested wallets documents to the flat wallet_rewards collection, one document
+per (wallet, distributor, token). Run it once with the app up, stop the poller, run it again to catch up the
+increments written in the meantime, check it with --verify and then start the app with
+WALLET_REWARDS_LAYOUT=flat. The wallets collection is left as it is so going back is only the env var.
+
+Run from the repo root:
+    python -m utils.migrate_wallet_rewards
+    python -m utils.migrate_wallet_rewards --after <last wallet printed>
+    python -m utils.migrate_wallet_rewards --verify
+"""
+import argparse
+import time
+from server.db.MongoDB import MongoDB
+
+
+def migrate(mongo_db, batch_size, after):
+    """ Copies the wallets in batches and prints the last wallet of each so a stopped run can carry on """
+    # The unique index is what keeps the upserts to one document per key
+    mongo_db.create_indexes()
+
+    start = time.perf_counter()
+    total_wallets = 0
+    total_written = 0
+
+    for wallets, written, last_wallet in mongo_db.migrate_wallets_to_wallet_rewards(batch_size, after):
+        total_wallets += wallets
+        total_written += written
+        print(f"Migrated {total_wallets} wallets into {total_written} wallet_rewards documents (last wallet {last_wallet})")
+
+    print(f"Migration finished in {time.perf_counter() - start:.1f}s")
+
+
+def verify(mongo_db, batch_size):
+    """ Checks every wallet against the flat documents """
+    checked, mismatched = mongo_db.verify_wallet_rewards(batch_size)
+
+    for wallet_address in mismatched[:20]:
+        print(f"Mismatch: {wallet_address}")
+
+    print(f"Checked {checked} wallets, {len(mismatched)} don't match")
+    return not mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--after", help="Carry on after this wallet address")
+    parser.add_argument("--verify", action="store_true", help="Only compare the two layouts")
+    args = parser.parse_args()
+
+    mongo_db = MongoDB()
+
+    if args.verify:
+        raise SystemExit(0 if verify(mongo_db, args.batch_size) else 1)
+    else:
+        migrate(mongo_db, args.batch_size, args.after)
+
+
+if __name__ == "__main__":
+    main()